@@ -0,0 +1,216 @@
+"""
+Module containing a small timing harness for the benchmarks, with results saved as
+JSON so runs can be compared.
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import typing as t
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+
+class Result(t.NamedTuple):
+    """
+    Timings of one benchmark, in seconds per call.
+    """
+
+    name: str
+    median: float
+    min: float
+    mean: float
+    stdev: float
+    number: int
+    repeat: int
+    extra: t.Dict[str, float]
+
+    @property
+    def per_second(self) -> float:
+        """
+        Calls per second, based on the median.
+        """
+        return 1 / self.median if self.median else float("inf")
+
+
+def measure(
+    name: str,
+    func: t.Callable[[], t.Any],
+    min_time: float = 0.05,
+    repeat: int = 7,
+    warmup: int = 1,
+) -> Result:
+    """
+    Times a function like `timeit`. The number of calls per round is raised until a
+    round takes at least `min_time`, then the rounds are repeated and their
+    per-call times summarized.
+    :param name: Name of the benchmark
+    :param func: Function to time, called without arguments
+    :param min_time: Minimal duration of a round in seconds, defaults to 0.05
+    :param repeat: Number of timed rounds, defaults to 7
+    :param warmup: Number of untimed calls first, e.g. to fill caches, defaults to 1
+    :returns: The timings
+    """
+    for _ in range(warmup):
+        func()
+
+    number = 1
+    while True:
+        elapsed = _time_round(func, number)
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        # Aim a bit above the minimal time, with at most 10 times more calls
+        estimate = int(number * 1.2 * min_time / max(elapsed, 1e-9))
+        number = min(number * 10, estimate + 1)
+
+    times = [elapsed / number] + [
+        _time_round(func, number) / number for _ in range(repeat - 1)
+    ]
+    return Result(
+        name=name,
+        median=statistics.median(times),
+        min=min(times),
+        mean=statistics.fmean(times),
+        stdev=statistics.stdev(times) if len(times) > 1 else 0.0,
+        number=number,
+        repeat=len(times),
+        extra={},
+    )
+
+
+def _time_round(func: t.Callable[[], t.Any], number: int) -> float:
+    """
+    Calls a function repeatedly.
+    :param func: Function to time
+    :param number: Number of calls
+    :returns: Total duration in seconds
+    """
+    calls = range(number)
+    start = time.perf_counter()
+    for _ in calls:
+        func()
+    return time.perf_counter() - start
+
+
+def environment() -> t.Dict[str, t.Any]:
+    """
+    Describes the machine and software the benchmarks ran on.
+    :returns: JSON serializable description
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def save_results(results: t.List[Result], path: Path | str):
+    """
+    Saves results with a description of the environment as JSON.
+    :param results: The results
+    :param path: Path of the JSON file
+    """
+    document = {
+        "environment": environment(),
+        "results": {
+            result.name: {
+                "median": result.median,
+                "min": result.min,
+                "mean": result.mean,
+                "stdev": result.stdev,
+                "number": result.number,
+                "repeat": result.repeat,
+                "per_second": result.per_second,
+                **result.extra,
+            }
+            for result in results
+        },
+    }
+    Path(path).write_text(json.dumps(document, indent=2) + "\n")
+
+
+def load_results(path: Path | str) -> t.Dict[str, t.Dict[str, float]]:
+    """
+    Loads results saved by `save_results`.
+    :param path: Path of the JSON file
+    :returns: Timings by the name of the benchmark
+    :raises FileExistsError: If the path does not point to a file
+    """
+    path = Path(path)
+    if not path.is_file():
+        raise FileExistsError(f"File `{path}` does not exist.")
+    return json.loads(path.read_text())["results"]
+
+
+def format_time(seconds: float) -> str:
+    """
+    Formats a duration with a fitting unit.
+    :param seconds: The duration
+    :returns: The formatted duration
+    """
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:7.2f} {unit}"
+    return f"{seconds / 1e-9:7.1f} ns"
+
+
+def format_result(result: Result, previous: t.Optional[t.Dict[str, float]]) -> str:
+    """
+    Formats a result as a line of the report.
+    :param result: The result
+    :param previous: Timings of the same benchmark in an earlier run, if any
+    :returns: The report line
+    """
+    line = (
+        f"{result.name:<48} {format_time(result.median)} "
+        f"± {format_time(result.stdev).strip():>10} {result.per_second:12.1f}/s"
+    )
+    for key, value in result.extra.items():
+        line += f"  {key}={value:.1f}"
+    if previous is not None:
+        line += f"  {result.median / previous['median']:6.2f}x"
+    return line
+
+
+def regressions(
+    results: t.List[Result],
+    previous: t.Dict[str, t.Dict[str, float]],
+    threshold: float,
+) -> t.List[t.Tuple[str, float]]:
+    """
+    Finds benchmarks that got slower than in an earlier run.
+    :param results: The current results
+    :param previous: Timings of the earlier run by the name of the benchmark
+    :param threshold: Relative slowdown of the median considered a regression,
+        e.g. 0.1 for 10 %
+    :returns: Names of the slower benchmarks with their ratio to the earlier median
+    """
+    slower = []
+    for result in results:
+        if result.name not in previous:
+            continue
+        ratio = result.median / previous[result.name]["median"]
+        if ratio > 1 + threshold:
+            slower.append((result.name, ratio))
+    return slower
@@ -0,0 +1,449 @@
+"""
+Module containing benchmarks of the hot paths, from packing DDP packets up to
+rendering a canvas and sending it to a local UDP sink. No device is needed, all
+packets go to sockets on the loopback interface.
+
+Usage: python -m benchmarks.run [-k PATTERN] [--resolution ROWS COLS]
+    [--output PATH] [--compare PATH] [--threshold FRACTION] [--quick]
+"""
+
+import argparse
+import fnmatch
+import logging
+import socket
+import subprocess
+import sys
+import threading
+import typing as t
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.harness import (
+    Result,
+    format_result,
+    load_results,
+    measure,
+    regressions,
+    save_results,
+)
+from src.DDPAgent import _BatchSender, _DDPAgent
+from src.DDPDevice import DDPDevice
+from src.DDPReceiver import DDPReceiver
+from src.drawing.canvas import Canvas
+from src.drawing.common import insert
+from src.drawing.text import FONTS, PixelFontRenderer, Text, TextMarquee
+
+ROOT_PATH = Path(__file__).parent.parent
+RESULTS_PATH = Path(__file__).parent / "results"
+IMAGE_PATH = ROOT_PATH / "test_data" / "heart.bmp"
+
+# From a single panel up to a large wall of them
+DEFAULT_RESOLUTIONS = [(16, 16), (64, 64), (256, 256)]
+
+
+class Case(t.NamedTuple):
+    """
+    A benchmark ready to be timed.
+    :param name: Name of the benchmark, with its parameters in brackets
+    :param func: Function to time, called without arguments
+    :param extra: Function called after timing, returning additional values to
+        report, e.g. the share of received frames
+    """
+
+    name: str
+    func: t.Callable[[], t.Any]
+    extra: t.Optional[t.Callable[[], t.Dict[str, float]]] = None
+
+
+Resolution = t.Tuple[int, int]
+Cases = t.Iterator[Case]
+
+
+class _Sink:
+    """
+    UDP socket on the loopback interface that never reads, packets it can't hold
+    are dropped by the kernel. Sending to it costs the same as sending to a device,
+    without the errors of sending to a closed port.
+    """
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+
+    def close(self):
+        self.sock.close()
+
+
+def _label(resolution: Resolution) -> str:
+    return f"{resolution[0]}x{resolution[1]}"
+
+
+def _random_frame(resolution: Resolution, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, resolution, dtype=np.uint8)
+
+
+def agent_cases(resolution: Resolution, sink: _Sink) -> Cases:
+    """
+    Packing and sending whole frames, the legacy per-packet path and the
+    preallocated packet buffer.
+    """
+    label = _label(resolution)
+    rgb = np.repeat(_random_frame(resolution).reshape(-1, 1), 3, axis=1)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        yield Case(
+            f"send_out_packets[{label}]",
+            lambda: _DDPAgent.send_out_packets(sock, "127.0.0.1", sink.port, rgb, 0),
+        )
+    finally:
+        sock.close()
+
+    variants = {"plain": {}, "partial": {"partial_updates": True}}
+    if _BatchSender.available():
+        variants["batched"] = {"batched": True}
+    for variant, options in variants.items():
+        agent = _DDPAgent(
+            "127.0.0.1", resolution, dest_port=sink.port, keepalive=1e9, **options
+        )
+        frames = [rgb, rgb.copy()]
+        # One changed pixel per frame, the case partial updates are made for
+        frames[1][len(rgb) // 2] ^= 0xFF
+        counter = iter(range(1 << 62))
+
+        def flush(agent=agent, frames=frames, counter=counter):
+            agent.flush(frames[next(counter) & 1])
+
+        yield Case(f"flush[{variant},{label}]", flush)
+        if agent._sock is not None:
+            agent._sock.close()
+
+
+def packet_cases(sink: _Sink) -> Cases:
+    """
+    Sending a single full packet the legacy way.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    data = memoryview(bytes(_DDPAgent._MAX_DATALEN))
+    try:
+        yield Case(
+            "send_packet",
+            lambda: _DDPAgent.send_packet(
+                sock, "127.0.0.1", sink.port, 1, 0, data, True
+            ),
+        )
+    finally:
+        sock.close()
+
+
+def device_cases(resolution: Resolution, sink: _Sink) -> Cases:
+    """
+    Displaying arrays of each input type, and images with each preprocessing mode.
+    """
+    label = _label(resolution)
+    frame = _random_frame(resolution)
+    inputs = {
+        "bool": frame >= 128,
+        "uint8": frame,
+        "float": frame.astype(float),
+    }
+
+    device = DDPDevice(dest_ip="127.0.0.1", resolution=resolution, dest_port=sink.port)
+    for dtype, data in inputs.items():
+        yield Case(
+            f"display_array[{dtype},{label}]",
+            lambda data=data: device.display_array(data),
+        )
+    yield Case(
+        f"display_array[uint8,unvalidated,{label}]",
+        lambda: device.display_array(frame, validate=False),
+    )
+
+    uncached = DDPDevice(
+        dest_ip="127.0.0.1",
+        resolution=resolution,
+        dest_port=sink.port,
+        image_cache_size=0,
+    )
+    for mode in ("resize", "crop", "pad"):
+        yield Case(
+            f"display_img[{mode},{label}]",
+            lambda mode=mode: uncached.display_img(IMAGE_PATH, mode=mode),
+        )
+        yield Case(
+            f"display_img[{mode},cached,{label}]",
+            lambda mode=mode: device.display_img(IMAGE_PATH, mode=mode),
+        )
+
+
+def text_cases() -> Cases:
+    """
+    Rendering text, with and without the cache of rendered lines.
+    """
+    text = "HELLO WORLD\nDDP 0123"
+    for name in FONTS:
+        font = FONTS[name]
+        # Same font without the line cache, glyphs are still rasterized only once
+        uncached = PixelFontRenderer(
+            font_file_path=font.pillow_font.path,
+            font_pixel_width=font.font_pixel_width,
+            font_pixel_height=font.font_pixel_height,
+            font_render_height=font.font_render_height,
+            cache_size=0,
+        )
+        yield Case(f"render_text[{name}]", lambda font=uncached: font.render_text(text))
+        yield Case(
+            f"render_text[{name},cached]", lambda font=font: font.render_text(text)
+        )
+
+
+def insert_cases(resolution: Resolution) -> Cases:
+    """
+    Inserting an array a quarter of the size of the base, partly outside of it.
+    """
+    label = _label(resolution)
+    rows, cols = resolution
+    base = _random_frame(resolution)
+    array = _random_frame((rows // 2, cols // 2), seed=1)
+    for mode in ("replace", "add", "alpha"):
+        yield Case(
+            f"insert[{mode},{label}]",
+            lambda mode=mode: insert(
+                base, array, x=cols * 3 // 4, y=rows // 4, mode=mode, alpha=0.5
+            ),
+        )
+
+
+def canvas_cases(resolution: Resolution) -> Cases:
+    """
+    Rendering a canvas of text objects, when nothing, one or all of them moved.
+    """
+    label = _label(resolution)
+    rows, cols = resolution
+    rng = np.random.default_rng(0)
+    for count in (1, 10, 100):
+        objects = [
+            Text(
+                text="HELLO",
+                font="3x5",
+                x=int(rng.integers(-4, cols)),
+                y=int(rng.integers(-2, rows)),
+            )
+            for _ in range(count)
+        ]
+        canvas = Canvas(width=cols, height=rows, objects=objects)
+        canvas.render()
+        yield Case(f"canvas_render[static,{count},{label}]", canvas.render)
+
+        for moving in sorted({1, count}):
+            steps = iter(range(1 << 62))
+
+            def render(objects=objects[:moving], canvas=canvas, steps=steps):
+                step = 1 if next(steps) & 1 else -1
+                for obj in objects:
+                    obj.x += step
+                return canvas.render()
+
+            kind = "all" if moving == count else "one"
+            yield Case(f"canvas_render[{kind}_moving,{count},{label}]", render)
+
+
+def end_to_end_cases(resolution: Resolution) -> Cases:
+    """
+    Frames per second of the whole loop of updating and rendering a canvas of
+    scrolling text and sending it to a local DDP receiver. The share of frames the
+    receiver got shows if the loopback interface or the receiver kept up.
+    """
+    label = _label(resolution)
+    rows, cols = resolution
+    variants = {"rgb": {}, "gray8": {"pixel_format": "gray8"}}
+    if _BatchSender.available():
+        variants["rgb,batched"] = {"batched": True}
+
+    for variant, options in variants.items():
+        receiver = DDPReceiver(resolution=resolution, port=0)
+        received = [0]
+        stop = threading.Event()
+
+        def receive(receiver=receiver, received=received, stop=stop):
+            while not stop.is_set():
+                try:
+                    receiver.receive_frame(timeout=0.05)
+                except (TimeoutError, OSError):
+                    continue
+                received[0] += 1
+
+        thread = threading.Thread(target=receive, daemon=True)
+        thread.start()
+
+        device = DDPDevice(
+            dest_ip="127.0.0.1",
+            resolution=resolution,
+            dest_port=receiver.port,
+            **options,
+        )
+        canvas = Canvas(
+            width=cols,
+            height=rows,
+            objects=[
+                TextMarquee(
+                    text="HELLO WORLD", font="5x5", y=y, speed=0.5, screen_width=cols
+                )
+                for y in range(0, rows - 4, 6)
+            ],
+        )
+
+        def frame(canvas=canvas, device=device):
+            canvas.update()
+            device.display_array(canvas.render(), validate=False)
+
+        def extra(device=device, received=received):
+            return {"received_pct": 100 * received[0] / max(device.frames_sent, 1)}
+
+        try:
+            yield Case(f"end_to_end[{variant},{label}]", frame, extra)
+        finally:
+            stop.set()
+            thread.join()
+            receiver.close()
+
+
+def import_cases() -> Cases:
+    """
+    Time to import the modules in a fresh interpreter, including its startup.
+    """
+    modules = ["src.DDPDevice", "src.drawing.canvas", "src.drawing.text"]
+    for module in [None] + modules:
+
+        def run(module=module):
+            code = "pass" if module is None else f"import {module}"
+            subprocess.run([sys.executable, "-c", code], cwd=ROOT_PATH, check=True)
+
+        yield Case(f"import[{module or 'interpreter'}]", run)
+
+
+def all_cases(resolutions: t.List[Resolution], sink: _Sink) -> t.Iterator[Cases]:
+    """
+    All groups of benchmarks, resolution dependent ones for each resolution.
+    """
+    yield packet_cases(sink)
+    yield text_cases()
+    yield import_cases()
+    for resolution in resolutions:
+        yield agent_cases(resolution, sink)
+        yield device_cases(resolution, sink)
+        yield insert_cases(resolution)
+        yield canvas_cases(resolution)
+        yield end_to_end_cases(resolution)
+
+
+def run(
+    resolutions: t.List[Resolution],
+    patterns: t.Optional[t.List[str]] = None,
+    previous: t.Optional[t.Dict[str, t.Dict[str, float]]] = None,
+    min_time: float = 0.05,
+    repeat: int = 7,
+) -> t.List[Result]:
+    """
+    Runs the benchmarks, printing each result as it is measured.
+    :param resolutions: Resolutions to run the resolution dependent benchmarks at
+    :param patterns: Glob patterns of the names of benchmarks to run, defaults to
+        all
+    :param previous: Timings of an earlier run to compare with, by name
+    :param min_time: Minimal duration of a timed round in seconds
+    :param repeat: Number of timed rounds
+    :returns: The results
+    """
+    results = []
+    sink = _Sink()
+    try:
+        for cases in all_cases(resolutions, sink):
+            for case in cases:
+                if patterns and not any(
+                    fnmatch.fnmatchcase(case.name, pattern) for pattern in patterns
+                ):
+                    continue
+                result = measure(case.name, case.func, min_time=min_time, repeat=repeat)
+                if case.extra is not None:
+                    result.extra.update(case.extra())
+                results.append(result)
+                print(format_result(result, (previous or {}).get(case.name)))
+    finally:
+        sink.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the hot paths and save the results as JSON."
+    )
+    parser.add_argument(
+        "-k",
+        dest="patterns",
+        action="append",
+        metavar="PATTERN",
+        help="Run only benchmarks with names matching the glob pattern, e.g. "
+        "'canvas_render*' (may be repeated)",
+    )
+    parser.add_argument(
+        "--resolution",
+        dest="resolutions",
+        type=int,
+        nargs=2,
+        action="append",
+        metavar=("ROWS", "COLS"),
+        help="Resolution to benchmark at (may be repeated), defaults to "
+        + ", ".join(_label(resolution) for resolution in DEFAULT_RESOLUTIONS),
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="JSON file to save the results to, defaults to a new file in "
+        "benchmarks/results",
+    )
+    parser.add_argument(
+        "--compare", type=Path, help="JSON file of an earlier run to compare with"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown against the earlier run reported as a regression, "
+        "exiting with status 1",
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="Time shorter and fewer rounds"
+    )
+    args = parser.parse_args()
+    # Keep the report free of the debug messages of image decoding
+    logging.getLogger("PIL").setLevel(logging.INFO)
+
+    previous = load_results(args.compare) if args.compare else None
+    results = run(
+        resolutions=[tuple(res) for res in args.resolutions or DEFAULT_RESOLUTIONS],
+        patterns=args.patterns,
+        previous=previous,
+        min_time=0.01 if args.quick else 0.05,
+        repeat=3 if args.quick else 7,
+    )
+
+    output = args.output
+    if output is None:
+        RESULTS_PATH.mkdir(exist_ok=True)
+        output = RESULTS_PATH / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    save_results(results, output)
+    print(f"{len(results)} results written to `{output}`.")
+
+    if previous is not None:
+        slower = regressions(results, previous, args.threshold)
+        for name, ratio in slower:
+            print(f"Regression: {name} is {ratio:.2f}x slower.")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
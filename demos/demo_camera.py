@@ -1,37 +1,27 @@
 import cv2 as cv
 
 from src.DDPDevice import DDPDevice
+from src.sources import VideoFrameSource
 from src.utils import load_config
 
 
 config = load_config()
 device = DDPDevice(dest_ip=config["dest_ip"])
 
-cap = cv.VideoCapture(0)
-
-if not cap.isOpened():
+# Frames are captured, converted to grayscale and downscaled on a background thread.
+# If the processing below falls behind the camera, the oldest frames are dropped.
+try:
+    camera = VideoFrameSource(0, resolution=device.resolution)
+except ValueError:
     print("Cannot open camera")
     exit()
 
-while True:
-    # Capture frame-by-frame
-    ret, frame = cap.read()
-
-    # if frame is read correctly ret is True
-    if not ret:
-        print("Can't receive frame (stream end?). Exiting ...")
-        break
+for small in camera:
     # Our operations on the frame come here
-    gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
-
-    small = cv.resize(gray, (16, 16))
-
     blur = cv.GaussianBlur(small, (9, 9), sigmaX=0, sigmaY=0)
 
     edges = cv.Canny(image=blur, threshold1=50, threshold2=100)
 
-    # data = cv.resize(edges, (16, 16))
-
     device.display_array(edges)
 
     edges_big = cv.resize(edges, (512, 512), interpolation=cv.INTER_NEAREST)
@@ -42,7 +32,7 @@ while True:
 
     if cv.waitKey(1) == ord("q"):
         break
+else:
+    print("Can't receive frame (stream end?). Exiting ...")
 
-# When everything done, release the capture
-cap.release()
 cv.destroyAllWindows()
@@ -2,12 +2,11 @@
 Example showing how to use the Canvas and drawable objects.
 """
 
-import time
-
 from src.DDPDevice import DDPDevice
 from src.display import show_image_loop
 from src.drawing.canvas import Canvas
 from src.drawing.text import Text, TextMarquee
+from src.scheduler import FrameScheduler
 from src.utils import load_config
 
 
@@ -27,14 +26,13 @@ canvas = Canvas(
 # You can also add objects to the canvas after it is created
 canvas.add(TextMarquee(text="IJKL", font="5x5", y=10, speed=1.5))
 
-while True:
+# Run the loop at a steady framerate
+for _ in FrameScheduler(fps=8).frames():
     # Render out the array (pixels) of the canvas based on its objects
     array = canvas.render()
     # Update the canvas, and all its objects (for example scroll Marquees, etc.)
     canvas.update()
-    # Send the pixel array to the device
-    device.display_array(data=array)
+    # Send the pixel array to the device, rendered arrays need no validation
+    device.display_array(data=array, validate=False)
     # Also show the contents of the pixel array in another window
     show_image_loop(array, scale=50)
-    # Sleep by a fraction of the framerate
-    time.sleep(1 / 8)
@@ -0,0 +1,29 @@
+"""
+Example showing how to play a video file or an animated GIF at its native
+framerate, without extracting its frames first.
+"""
+
+import sys
+
+from src.DDPDevice import DDPDevice
+from src.sources import GifFrameSource, VideoFrameSource
+from src.utils import load_config
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python -m demos.demo_video VIDEO_OR_GIF")
+        exit()
+
+    config = load_config()
+    device = DDPDevice(dest_ip=config["dest_ip"])
+
+    path = sys.argv[1]
+    if path.lower().endswith(".gif"):
+        source = GifFrameSource(path, resolution=device.resolution)
+    else:
+        source = VideoFrameSource(path, resolution=device.resolution)
+
+    # Frames are decoded and downscaled on a background thread, while the device
+    # plays them at the native framerate, dropping frames if it falls behind
+    device.play(source)
+    device.clear()
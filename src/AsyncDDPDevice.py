@@ -0,0 +1,251 @@
+import asyncio
+import logging
+from pathlib import Path
+from typing import Literal, Optional
+
+import numpy as np
+
+from src.DDPDevice import PixelFormat, _DDPDeviceBase
+from src.scheduler import FrameScheduler
+from src.sources import DirectoryFrameSource, FrameSource
+
+_LOGGER = logging.getLogger(__file__)
+_LOGGER.setLevel(logging.DEBUG)
+
+
+class _DDPProtocol(asyncio.DatagramProtocol):
+    """
+    Datagram protocol of a DDP device. The device does not answer, so it only
+    reports errors. These arrive after the packets causing them were sent, so the
+    connection counts as re-established once a whole frame went by without errors.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.connection_warning = False
+        self._errors = 0
+        self._errors_before = 0
+
+    def error_received(self, exc: Exception) -> None:
+        self._errors += 1
+        # print warning only once until it clears
+        if not self.connection_warning:
+            _LOGGER.warning(f"Error in DDP connection to {self.name}: {exc}")
+            self.connection_warning = True
+
+    def frame_sent(self) -> None:
+        """
+        Clears the warning if no errors were received since the previous frame.
+        """
+        if self.connection_warning and self._errors == self._errors_before:
+            _LOGGER.info(f"DDP connection to {self.name} re-established.")
+            self.connection_warning = False
+        self._errors_before = self._errors
+
+
+class AsyncDDPDevice(_DDPDeviceBase):
+    """
+    Monochrome LED panel driven over DDP from an asyncio event loop. Offers the same
+    methods as `DDPDevice` as coroutines, so one loop can drive many devices without
+    threads. Packets are sent through a datagram transport created on first use, or
+    explicitly with `connect`. Animation frames are decoded off the loop, on the
+    background thread of their source.
+    :param dest_ip: IP address of the device
+    :param resolution: Number of LED rows and columns, defaults to (16, 16)
+    :param dest_port: Port of the device, defaults to 4048
+    :param name: Identifier of the device, defaults to "ddp-obegransead"
+    :param skip_unchanged: Do not send frames identical to the previous one,
+        defaults to False
+    :param keepalive: Seconds after which an unchanged frame is sent anyway,
+        defaults to 1.0
+    :param partial_updates: Send only the changed parts of frames, defaults to False
+    :param pixel_format: Format of the pixel data on the wire, see `DDPDevice`,
+        defaults to "rgb"
+    :param image_cache_size: Number of preprocessed images kept by `display_img`,
+        0 disables caching, defaults to 64
+    :raises ValueError: If unsupported `pixel_format` value is passed
+    """
+
+    def __init__(
+        self,
+        dest_ip: str,
+        resolution: tuple[int, int] = (16, 16),
+        dest_port: int = 4048,
+        name: str = "ddp-obegransead",
+        skip_unchanged: bool = False,
+        keepalive: float = 1.0,
+        partial_updates: bool = False,
+        pixel_format: PixelFormat = "rgb",
+        image_cache_size: int = 64,
+    ):
+        super().__init__(
+            dest_ip=dest_ip,
+            resolution=resolution,
+            dest_port=dest_port,
+            name=name,
+            batched=False,
+            skip_unchanged=skip_unchanged,
+            keepalive=keepalive,
+            partial_updates=partial_updates,
+            pixel_format=pixel_format,
+            image_cache_size=image_cache_size,
+        )
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._protocol: Optional[_DDPProtocol] = None
+
+    async def connect(self) -> None:
+        """
+        Creates the datagram transport, if not created yet.
+        """
+        if self._transport is None or self._transport.is_closing():
+            loop = asyncio.get_running_loop()
+            self._transport, self._protocol = await loop.create_datagram_endpoint(
+                lambda: _DDPProtocol(self.name),
+                remote_addr=(self._agent.dest_ip, self._agent.dest_port),
+            )
+
+    def close(self) -> None:
+        """
+        Closes the datagram transport.
+        """
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    async def __aenter__(self) -> "AsyncDDPDevice":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+
+    async def display_array(self, data: np.ndarray, validate: bool = True) -> None:
+        """
+        Displays the data given as a pixel array.
+        Values can be either integers [0-255] - indicating brightness, or booleans -
+        ignoring brightness setting.
+        :param data: Array of LED brightness values
+        :param validate: Check the shape and range of the data. Disable only for
+            uint8 arrays of the right shape, defaults to True
+        :raises ValueError: If shape of the data is different from the LED array
+            dimensions
+        """
+        data = self._prepare(data, validate)
+        await self.connect()
+        packets = self._agent.packetize(data)
+        if packets is None:
+            return
+
+        # The transport sends right away, and copies the packet only if it has to
+        # queue it, so the reused packet buffer can't be overwritten while queued
+        for packet in packets:
+            self._transport.sendto(packet)
+        self._protocol.frame_sent()
+
+    async def display_pixel(self, x: int, y: int, value: int = 255) -> None:
+        """
+        Lights up a single pixel.
+        :param x: Row of the LED
+        :param y: column of the LED
+        :param value: Brightness of the pixel. Defaults to 255
+        :raises ValueError: If coordinates are out of bounds of the defined resolution
+        """
+        await self.display_array(self._pixel_array(x, y, value))
+
+    async def clear(self) -> None:
+        """
+        Turns off all the LEDs.
+        """
+        await self.display_array(np.zeros(self.resolution))
+
+    async def display_img(
+        self,
+        path: Path | str,
+        mode: Literal["resize", "crop", "pad"] = "resize",
+    ) -> None:
+        """
+        Loads and displays an image file, see `DDPDevice.display_img`.
+        :param path: Path to the image file
+        :param mode: Preprocessing option of images with different resolution, defaults
+            to "resize"
+        :raises FileExistsError: If the path does not point to a file
+        :raises ValueError: If unsupported `mode` value is passed
+        """
+        await self.display_array(self._load_img(path, mode))
+
+    async def display_animation(
+        self,
+        dir_path: Path | str,
+        fps: int = 30,
+        countdown: int = 0,
+        catch_up: Literal["drop", "slow"] = "drop",
+    ) -> None:
+        """
+        Displays a series of ordered image files inside a given directory as an
+        animation, see `DDPDevice.display_animation`.
+        :param dir_path: Directory containing frames of the animation
+        :param fps: Frames per second, defaults to 30
+        :param countdown: Initial countdown in the command line before the animation is
+            displayed (useful for syncing music or other device), defaults to 0
+        :param catch_up: What to do when falling behind - "drop" frames to keep the
+            duration, or "slow" down, defaults to "drop"
+        :raises FileExistsError: If incorrect directory path is given
+        """
+        loop = asyncio.get_running_loop()
+        # Listing the files touches the disk, so it's done off the loop as well
+        source = await loop.run_in_executor(None, DirectoryFrameSource, dir_path)
+        _LOGGER.debug(f"{len(source)} frames found in `{dir_path}`.")
+        await self.play(source, fps=fps, countdown=countdown, catch_up=catch_up)
+
+    async def play(
+        self,
+        source: FrameSource,
+        fps: Optional[float] = None,
+        countdown: int = 0,
+        catch_up: Literal["drop", "slow"] = "drop",
+    ) -> None:
+        """
+        Displays the frames of a source as an animation, see `DDPDevice.play`.
+        Frames are pulled from the source on a worker thread, so waiting for them
+        doesn't block the event loop.
+        :param source: Source of the frames
+        :param fps: Frames per second, defaults to the frame rate of the source, or
+            30 if it has none
+        :param countdown: Initial countdown in the command line before the animation is
+            displayed (useful for syncing music or other device), defaults to 0
+        :param catch_up: What to do when falling behind - "drop" frames to keep the
+            duration, or "slow" down, defaults to "drop"
+        """
+        loop = asyncio.get_running_loop()
+        # Random access sources are read directly at the frame that is due
+        seekable = hasattr(source, "__getitem__") and hasattr(source, "__len__")
+
+        # Start iterating first, so the source can prepare frames during countdown
+        frames = iter(source)
+        frame = await loop.run_in_executor(None, next, frames, None)
+
+        try:
+            for i in reversed(range(countdown + 1)):
+                await asyncio.sleep(1)
+                print(f"{i}...")
+
+            scheduler = FrameScheduler(fps=fps or source.fps or 30, catch_up=catch_up)
+            shown = 0
+            async for i in scheduler.frames_async():
+                if seekable:
+                    frame = source[i] if i < len(source) else None
+                else:
+                    # Skip the frames dropped by the scheduler
+                    while shown < i and frame is not None:
+                        frame = await loop.run_in_executor(None, next, frames, None)
+                        shown += 1
+                if frame is None:
+                    break
+                await self.display_array(frame)
+                _LOGGER.debug(f"Frame {i}")
+            _LOGGER.debug(f"Animation timing: {scheduler.stats}")
+        finally:
+            # Stopping a prefetching source waits for its thread
+            close = getattr(frames, "close", None)
+            if close is not None:
+                await loop.run_in_executor(None, close)
@@ -1,7 +1,13 @@
+import ctypes
+import ctypes.util
+import errno
 import logging
+import os
 import socket
 import struct
-from typing import Union
+import sys
+import time
+from typing import Optional, Union
 
 import numpy as np
 
@@ -27,8 +33,11 @@ class _DDPAgent():
     _STORAGE = 0x08
     _TIME = 0x10
     _DATATYPE = 0x01
+    _DATATYPE_GRAY8 = 0x23  # grayscale, 8 bits per pixel
+    _DATATYPE_MONO1 = 0x21  # grayscale, 1 bit per pixel
     _SOURCE = 0x01
     _TIMEOUT = 1
+    _BYTES_PER_PIXEL = {_DATATYPE: 3}
 
     def __init__(
         self,
@@ -36,6 +45,12 @@ class _DDPAgent():
         resolution: tuple[int, int],
         dest_port: int = 4048,
         name: str = "ddp-device",
+        batched: bool = False,
+        skip_unchanged: bool = False,
+        keepalive: float = 1.0,
+        partial_updates: bool = False,
+        merge_gap: int = 64,
+        data_type: int = _DATATYPE,
     ) -> None:
         """
         Args:
@@ -43,17 +58,47 @@ class _DDPAgent():
             dest_port: Port of the DDP device. Defaults to 4048.
             resolution: Number of LED rows and columns.
             name: Identifier of the device. Defaults to "ddp-device".
+            batched: Send all packets of a frame with a single system call where
+                supported (`sendmmsg` on Linux). Falls back to one call per packet
+                elsewhere. Defaults to False.
+            skip_unchanged: Do not send frames identical to the previously sent one.
+                Defaults to False.
+            keepalive: When skipping unchanged frames, resend the last frame if
+                nothing was sent for this many seconds, so the device does not time
+                out. With partial updates, a full frame is sent at least this often
+                to recover from lost packets. Defaults to 1.0.
+            partial_updates: Send only the byte spans that changed since the last
+                frame, at their offsets. Unchanged frames are sent as a single
+                zero-length PUSH packet. Defaults to False.
+            merge_gap: Changed spans separated by at most this many unchanged bytes
+                are sent as one span. Defaults to 64.
+            data_type: DDP data type of the pixel data. Defaults to 8-bit RGB.
         """
         self.dest_ip = dest_ip
         self.dest_port = dest_port
         self.resolution = resolution
         self.name = name
+        self.skip_unchanged = skip_unchanged
+        self.keepalive = keepalive
+        self.partial_updates = partial_updates
+        self.merge_gap = merge_gap
+        self.data_type = data_type
 
-        self._sock: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock: Optional[socket.socket] = None
+        self._packetizer = _DDPPacketizer(data_type)
+        self._batch_sender = (
+            _BatchSender() if batched and _BatchSender.available() else None
+        )
 
         self._frame_count = 0
         self._connection_warning = False
 
+        self._last_frame = np.empty(0, dtype=np.uint8)
+        self._last_sent_time = -np.inf
+        self._last_full_time = -np.inf
+        self.frames_sent = 0
+        self.frames_suppressed = 0
+
     @staticmethod
     def send_out_packets(
         sock: socket.socket,
@@ -128,26 +173,147 @@ class _DDPAgent():
 
         sock.sendto(udpData, (dest, port))
 
-    def flush(self, data: np.ndarray) -> None:
+    def _transmit(self, packets: list[memoryview]) -> int:
         """
-        Flushes LED data to the DDP device.
+        Sends packets over the connected socket, in one batch if possible.
 
         Args:
-            data: The LED data to be flushed.
+            packets: The packets to be sent.
+
+        Returns:
+            Number of packets sent.
 
         Raises:
-            OSError: If an OS error occurs during the flush.
+            OSError: If an OS error occurs before all packets are sent. The number
+                of packets sent before the failure is stored in its `packets_sent`
+                attribute.
+        """
+        if self._batch_sender is not None:
+            return self._batch_sender.send(self._sock, packets)
+
+        for sent, packet in enumerate(packets):
+            try:
+                try:
+                    self._sock.send(packet)
+                except ConnectionRefusedError:
+                    # A connected socket reports ICMP errors caused by earlier
+                    # packets on the next send, which is then not sent. An offline
+                    # device is not an error of this packet, so it is sent again.
+                    self._sock.send(packet)
+            except OSError as e:
+                e.packets_sent = sent
+                raise
+        return len(packets)
+
+    def _remember(self, data: np.ndarray, now: float, full: bool) -> None:
         """
+        Stores a copy of the frame about to be sent.
+
+        Args:
+            data: The flattened LED data.
+            now: Monotonic time of the flush.
+            full: Whether the whole frame is sent, rather than only changed spans.
+        """
+        if data.size != self._last_frame.size:
+            self._last_frame = np.empty(data.size, dtype=np.uint8)
+        np.copyto(self._last_frame, data, casting="unsafe")
+        self._last_sent_time = now
+        if full:
+            self._last_full_time = now
+
+    def packetize(self, data: np.ndarray) -> Optional[list[memoryview]]:
+        """
+        Turns LED data into DDP packets, applying change detection and partial
+        updates if enabled.
+
+        Args:
+            data: The LED data to be sent.
+
+        Returns:
+            Views of the packets to send, valid until the next call. None if the
+            frame is skipped as unchanged.
+        """
+        data = data.reshape(-1)
+        spans = None
+        if self.skip_unchanged or self.partial_updates:
+            now = time.monotonic()
+            comparable = data.size == self._last_frame.size
+            if (
+                comparable
+                and self.partial_updates
+                and now - self._last_full_time < self.keepalive
+            ):
+                spans = _changed_spans(
+                    self._last_frame,
+                    data,
+                    self.merge_gap,
+                    self._BYTES_PER_PIXEL.get(self.data_type, 1),
+                )
+                unchanged = len(spans) == 0
+                span_bytes = np.sum(spans[:, 1] - spans[:, 0])
+                full_packets = -(-data.size // self._MAX_DATALEN)
+                if (
+                    len(spans) >= full_packets
+                    or span_bytes + len(spans) * self._HEADER_LEN >= data.size
+                ):
+                    # Scattered changes - the full frame is cheaper to send
+                    spans = None
+            else:
+                unchanged = comparable and np.array_equal(self._last_frame, data)
+
+            if unchanged:
+                # With partial updates, spans are empty and only a zero-length PUSH
+                # packet is sent, until a full frame is due for the keepalive
+                if self.skip_unchanged and now - self._last_sent_time < self.keepalive:
+                    self.frames_suppressed += 1
+                    return None
+            self._remember(data, now, full=spans is None)
+
+        self.frames_sent += 1
         self._frame_count += 1
+        sequence = self._frame_count % 15 + 1
+        if spans is None:
+            return self._packetizer.pack(data, sequence)
+        return self._packetizer.pack_spans(self._last_frame, spans, sequence)
+
+    def flush(self, data: np.ndarray) -> int:
+        """
+        Flushes LED data to the DDP device.
+
+        Args:
+            data: The LED data to be flushed.
+
+        Returns:
+            Number of packets sent. Errors are logged and not raised, in which case
+            fewer packets than the frame consists of are reported. Frames skipped as
+            unchanged report 0.
+        """
+        packets = self.packetize(data)
+        if packets is None:
+            return 0
+        return self.send(packets)
+
+    def send(self, packets: list[memoryview]) -> int:
+        """
+        Sends packets prepared by `packetize` to the DDP device.
+
+        Args:
+            packets: The packets to be sent.
+
+        Returns:
+            Number of packets sent. Errors are logged and not raised, in which case
+            fewer packets than given are reported.
+        """
+        sent = 0
         try:
+            if self._sock is None:
+                # Resolve the destination once, so each send skips the address lookup
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.connect((self.dest_ip, self.dest_port))
+                self._sock = sock
+
+            sent = self._transmit(packets)
 
-            _DDPAgent.send_out_packets(
-                self._sock,
-                self.dest_ip,
-                self.dest_port,
-                data,
-                self._frame_count,
-            )
             if self._connection_warning:
                 # If we have reconnected, log it, come back online, and fire an event to
                 # the frontend
@@ -160,3 +326,309 @@ class _DDPAgent():
                 # the frontend
                 _LOGGER.warning(f"Error in DDP connection to {self.name}: {e}")
                 self._connection_warning = True
+            sent = getattr(e, "packets_sent", sent)
+
+        if sent < len(packets):
+            _LOGGER.debug(f"Sent {sent}/{len(packets)} packets to {self.name}.")
+        return sent
+
+
+class _DDPPacketizer():
+    """
+    Reusable DDP packet buffer. All packets of a frame are laid out back to back in
+    one preallocated buffer with their headers written ahead of time, so packing a
+    frame only copies the pixel data into place and patches the sequence number.
+    The buffer is reallocated only when the length of the frame changes.
+    """
+
+    def __init__(self, data_type: int = _DDPAgent._DATATYPE) -> None:
+        """
+        Args:
+            data_type: DDP data type written to the headers. Defaults to 8-bit RGB.
+        """
+        self.data_type = data_type
+        self._data_len = -1
+        self._buffer = bytearray()
+        self._packets = np.empty((0, 0), dtype=np.uint8)
+        self._views: list[memoryview] = []
+        self._span_buffer = bytearray()
+
+    def _allocate(self, data_len: int) -> None:
+        """
+        Allocates the packet buffer and writes the headers for frames of a given
+        length.
+
+        Args:
+            data_len: Number of data bytes in a frame.
+        """
+        max_len = _DDPAgent._MAX_DATALEN
+        stride = _DDPAgent._HEADER_LEN + max_len
+        count = -(-data_len // max_len)
+
+        self._buffer = bytearray(count * stride)
+        buffer_view = memoryview(self._buffer)
+        self._views = []
+        for i in range(count):
+            start = i * stride
+            length = min(max_len, data_len - i * max_len)
+            struct.pack_into(
+                "!BBBBLH",
+                self._buffer,
+                start,
+                _DDPAgent._VER1 | (_DDPAgent._PUSH if i == count - 1 else 0),
+                0,
+                self.data_type,
+                _DDPAgent._SOURCE,
+                i * max_len,
+                length,
+            )
+            self._views.append(
+                buffer_view[start:start + _DDPAgent._HEADER_LEN + length]
+            )
+
+        self._packets = np.frombuffer(self._buffer, dtype=np.uint8).reshape(
+            count, stride
+        )
+        self._data_len = data_len
+
+    def pack(self, data: np.ndarray, sequence: int) -> list[memoryview]:
+        """
+        Copies a frame into the packet buffer.
+
+        Args:
+            data: The data to be sent. Values are cast to 8-bit unsigned integers.
+            sequence: The sequence number of the frame.
+
+        Returns:
+            Views of the ready-to-send packets. They stay valid until the next call.
+        """
+        data = data.reshape(-1)
+        if data.size != self._data_len:
+            self._allocate(data.size)
+
+        max_len = _DDPAgent._MAX_DATALEN
+        full, remainder = divmod(data.size, max_len)
+        payload = self._packets[:, _DDPAgent._HEADER_LEN:]
+        payload[:full] = data[:full * max_len].reshape(full, max_len)
+        if remainder:
+            payload[full, :remainder] = data[full * max_len:]
+
+        self._packets[:, 1] = sequence
+        return self._views
+
+    def pack_spans(
+        self,
+        data: np.ndarray,
+        spans: np.ndarray,
+        sequence: int,
+    ) -> list[memoryview]:
+        """
+        Packs only the given byte spans of a frame, each at its own offset. Spans
+        longer than a packet are split, and only the final packet has PUSH set.
+        Without spans, a single zero-length PUSH packet is packed.
+
+        Args:
+            data: The complete frame as a flat 8-bit unsigned integer array.
+            spans: Array of shape (n, 2) with start and end offsets of the spans.
+            sequence: The sequence number of the frame.
+
+        Returns:
+            Views of the ready-to-send packets. They stay valid until the next call.
+        """
+        max_len = _DDPAgent._MAX_DATALEN
+        header_len = _DDPAgent._HEADER_LEN
+        stride = header_len + max_len
+
+        chunks = [
+            (offset, min(offset + max_len, end))
+            for start, end in spans.tolist()
+            for offset in range(start, end, max_len)
+        ]
+        if not chunks:
+            # Nothing changed, the device still gets a PUSH to show the frame
+            chunks = [(0, 0)]
+        if len(self._span_buffer) < len(chunks) * stride:
+            self._span_buffer = bytearray(len(chunks) * stride)
+
+        source = memoryview(data)
+        buffer_view = memoryview(self._span_buffer)
+        views = []
+        for i, (start, end) in enumerate(chunks):
+            packet_start = i * stride
+            struct.pack_into(
+                "!BBBBLH",
+                self._span_buffer,
+                packet_start,
+                _DDPAgent._VER1 | (_DDPAgent._PUSH if i == len(chunks) - 1 else 0),
+                sequence,
+                self.data_type,
+                _DDPAgent._SOURCE,
+                start,
+                end - start,
+            )
+            data_start = packet_start + header_len
+            packet_end = data_start + end - start
+            buffer_view[data_start:packet_end] = source[start:end]
+            views.append(buffer_view[packet_start:packet_end])
+        return views
+
+
+def _changed_spans(
+    old: np.ndarray,
+    new: np.ndarray,
+    merge_gap: int,
+    alignment: int = 1,
+) -> np.ndarray:
+    """
+    Finds the byte spans in which two frames differ.
+
+    Args:
+        old: The previous frame, flattened.
+        new: The new frame, flattened, of the same size.
+        merge_gap: Spans separated by at most this many equal bytes are merged.
+        alignment: Spans are widened so their bounds are multiples of this value.
+
+    Returns:
+        Array of shape (n, 2) with start (inclusive) and end (exclusive) offsets.
+    """
+    changed = np.flatnonzero(old != new)
+    if changed.size == 0:
+        return np.empty((0, 2), dtype=np.intp)
+
+    starts = changed // alignment * alignment
+    ends = (changed // alignment + 1) * alignment
+    breaks = np.flatnonzero(starts[1:] - ends[:-1] > merge_gap)
+    spans = np.empty((breaks.size + 1, 2), dtype=np.intp)
+    spans[:, 0] = starts[np.r_[0, breaks + 1]]
+    spans[:, 1] = np.minimum(ends[np.r_[breaks, -1]], new.size)
+    return spans
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", _MsgHdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+class _BatchSender():
+    """
+    Sends several datagrams over a connected socket with one `sendmmsg` call.
+    The message vector is built once per set of packets and reused while the
+    packets keep pointing to the same buffer.
+    """
+    _libc = None
+
+    def __init__(self) -> None:
+        self._packets: list[memoryview] = []
+        self._iovecs = (_IOVec * 0)()
+        self._msgs = (_MMsgHdr * 0)()
+
+    @classmethod
+    def available(cls) -> bool:
+        """
+        Checks whether `sendmmsg` can be called on this platform.
+
+        Returns:
+            True if batched sending is supported.
+        """
+        if cls._libc is None:
+            cls._libc = False
+            if sys.platform.startswith("linux"):
+                try:
+                    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+                    libc.sendmmsg.argtypes = [
+                        ctypes.c_int,
+                        ctypes.POINTER(_MMsgHdr),
+                        ctypes.c_uint,
+                        ctypes.c_int,
+                    ]
+                    libc.sendmmsg.restype = ctypes.c_int
+                    cls._libc = libc
+                except (OSError, AttributeError):
+                    pass
+        return cls._libc is not False
+
+    def _prepare(self, packets: list[memoryview]) -> None:
+        """
+        Builds the message vector pointing to the given packets.
+
+        Args:
+            packets: Writable views of the packets to be sent.
+        """
+        count = len(packets)
+        self._iovecs = (_IOVec * count)()
+        self._msgs = (_MMsgHdr * count)()
+        for i, packet in enumerate(packets):
+            self._iovecs[i].iov_base = ctypes.addressof(
+                ctypes.c_char.from_buffer(packet)
+            )
+            self._iovecs[i].iov_len = len(packet)
+            self._msgs[i].msg_hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            self._msgs[i].msg_hdr.msg_iovlen = 1
+        self._packets = packets
+
+    def send(self, sock: socket.socket, packets: list[memoryview]) -> int:
+        """
+        Sends the packets, retrying the remainder if the kernel accepts only part of
+        the batch.
+
+        Args:
+            sock: Connected socket to send the packets over.
+            packets: The packets to be sent.
+
+        Returns:
+            Number of packets sent.
+
+        Raises:
+            OSError: If sending fails. The number of packets sent before the failure
+                is stored in its `packets_sent` attribute.
+        """
+        if packets is not self._packets:
+            self._prepare(packets)
+
+        count = len(packets)
+        size = ctypes.sizeof(_MMsgHdr)
+        sent = 0
+        retried = -1
+        while sent < count:
+            result = self._libc.sendmmsg(
+                sock.fileno(),
+                ctypes.cast(
+                    ctypes.addressof(self._msgs) + sent * size,
+                    ctypes.POINTER(_MMsgHdr),
+                ),
+                count - sent,
+                0,
+            )
+            if result <= 0:
+                code = ctypes.get_errno()
+                if code == errno.ECONNREFUSED and retried != sent:
+                    # ICMP error caused by an earlier packet, the packet it was
+                    # reported on was not sent, see `_DDPAgent._transmit`
+                    retried = sent
+                    continue
+                error = OSError(code, os.strerror(code))
+                error.packets_sent = sent
+                raise error
+            sent += result
+        return sent
@@ -1,42 +1,100 @@
-import glob
 import logging
+import threading
 import time
 from pathlib import Path
-from typing import Literal
+from typing import Literal, Optional
 
 import numpy as np
-from PIL import Image
 
 from src.DDPAgent import _DDPAgent
+from src.preprocessing import ImageCache
+from src.scheduler import FrameScheduler
+from src.sources import DirectoryFrameSource, FrameSource
 
 logging.basicConfig(format="%(levelname)s:%(name)s:%(message)s")
 _LOGGER = logging.getLogger(__file__)
 _LOGGER.setLevel(logging.DEBUG)
 
+PixelFormat = Literal["rgb", "gray8", "mono1"]
+
+_DATA_TYPES = {
+    "rgb": _DDPAgent._DATATYPE,
+    "gray8": _DDPAgent._DATATYPE_GRAY8,
+    "mono1": _DDPAgent._DATATYPE_MONO1,
+}
+
+
+class _DDPDeviceBase:
+    """
+    Parts shared by the synchronous and asynchronous devices - the DDP agent, the
+    conversion of pixel arrays to the pixel format, and the image cache. The
+    devices add the methods that display frames.
+    :param dest_ip: IP address of the device
+    :param resolution: Number of LED rows and columns
+    :param dest_port: Port of the device
+    :param name: Identifier of the device
+    :param batched: Send all packets of a frame with one system call where
+        supported
+    :param skip_unchanged: Do not send frames identical to the previous one
+    :param keepalive: Seconds after which an unchanged frame is sent anyway
+    :param partial_updates: Send only the changed parts of frames
+    :param pixel_format: Format of the pixel data on the wire, see `DDPDevice`
+    :param image_cache_size: Number of preprocessed images kept, 0 disables caching
+    :raises ValueError: If unsupported `pixel_format` value is passed
+    """
 
-class DDPDevice:
     def __init__(
         self,
         dest_ip: str,
-        resolution: tuple[int, int] = (16, 16),
-        dest_port: int = 4048,
-        name: str = "ddp-obegransead",
+        resolution: tuple[int, int],
+        dest_port: int,
+        name: str,
+        batched: bool,
+        skip_unchanged: bool,
+        keepalive: float,
+        partial_updates: bool,
+        pixel_format: PixelFormat,
+        image_cache_size: int,
     ):
+        if pixel_format not in _DATA_TYPES:
+            raise ValueError(f"Incorrect `pixel_format` given ({pixel_format}).")
+
         self.resolution = resolution
         self.name = name
+        self.pixel_format = pixel_format
+        self._rgb = np.empty((resolution[0] * resolution[1], 3), dtype=np.uint8)
+        self.image_cache = ImageCache(maxsize=image_cache_size)
 
         self._agent = _DDPAgent(
             dest_ip=dest_ip,
             dest_port=dest_port,
             resolution=self.resolution,
             name=self.name,
+            batched=batched,
+            skip_unchanged=skip_unchanged,
+            keepalive=keepalive,
+            partial_updates=partial_updates,
+            data_type=_DATA_TYPES[pixel_format],
         )
 
-    def display_array(self, data: np.ndarray) -> None:
+    @property
+    def frames_sent(self) -> int:
         """
-        Displays the data given as a pixel array.
-        Values can be either integers [0-255] - indicating brightness, or booleans -
-        ignoring brightness setting.
+        Number of frames sent to the device.
+        """
+        return self._agent.frames_sent
+
+    @property
+    def frames_suppressed(self) -> int:
+        """
+        Number of frames not sent because they matched the previous frame
+        (only counted with `skip_unchanged` enabled).
+        """
+        return self._agent.frames_suppressed
+
+    def _check_shape(self, data: np.ndarray) -> None:
+        """
+        Validates the shape of a pixel array.
         :param data: Array of LED brightness values
         :raises ValueError: If shape of the data is different from the LED array
             dimensions
@@ -48,23 +106,54 @@ class DDPDevice:
             )
             raise ValueError(msg)
 
-        if data.dtype == bool:
+    def _prepare(self, data: np.ndarray, validate: bool = True) -> np.ndarray:
+        """
+        Validates a pixel array and converts it to the selected pixel format.
+        :param data: Array of LED brightness values
+        :param validate: Check the shape and range of the data, defaults to True
+        :returns: Flat array of pixel data
+        :raises ValueError: If shape of the data is different from the LED array
+            dimensions
+        """
+        if not validate:
+            return self._encode(data)
+
+        self._check_shape(data)
+
+        if data.dtype == np.uint8:
+            pass  # always within range
+        elif data.dtype == bool:
             data = data.astype(int) * 255
         elif np.any((data < 0) | (data > 255)):
             _LOGGER.warning("Values outside allowed range. Clipping to [0-255].")
             data = data.clip(0, 255)
 
-        # each value needs to be repeated 3 times for RGB value format
-        data = np.repeat(data.flatten(), 3)
+        return self._encode(data)
 
-        self._agent.flush(data)
+    def _encode(self, data: np.ndarray) -> np.ndarray:
+        """
+        Converts brightness values [0-255] to the bytes of the selected pixel format.
+        :param data: Array of LED brightness values
+        :returns: Flat array of pixel data
+        """
+        match self.pixel_format:
+            case "rgb":
+                # each value needs to be repeated 3 times for RGB value format
+                self._rgb[:] = data.reshape(-1, 1)
+                return self._rgb
+            case "gray8":
+                return data.reshape(-1)
+            case "mono1":
+                # 8 pixels per byte, lit from half brightness upwards
+                return np.packbits(data.reshape(-1) >= 128)
 
-    def display_pixel(self, x: int, y: int, value: int = 255) -> None:
+    def _pixel_array(self, x: int, y: int, value: int) -> np.ndarray:
         """
-        Lights up a single pixel.
+        Creates a pixel array with a single pixel lit.
         :param x: Row of the LED
         :param y: column of the LED
-        :param value: Brightness of the pixel. Defaults to 255
+        :param value: Brightness of the pixel
+        :returns: The pixel array
         :raises ValueError: If coordinates are out of bounds of the defined resolution
         """
         if x not in range(self.resolution[0]) or y not in range(self.resolution[1]):
@@ -73,7 +162,179 @@ class DDPDevice:
 
         data = np.zeros(self.resolution)
         data[x, y] = value
-        self.display_array(data)
+        return data
+
+    def _load_img(
+        self,
+        path: Path | str,
+        mode: Literal["resize", "crop", "pad"],
+    ) -> np.ndarray:
+        """
+        Loads an image file as a grayscale pixel array matching the resolution,
+        through the image cache.
+        :param path: Path to the image file
+        :param mode: Preprocessing option of images with different resolution
+        :returns: The read-only pixel array
+        :raises FileExistsError: If the path does not point to a file
+        :raises ValueError: If unsupported `mode` value is passed
+        """
+        return self.image_cache.get(path, self.resolution, mode)
+
+    def preload_images(
+        self,
+        paths: list[Path | str],
+        mode: Literal["resize", "crop", "pad"] = "resize",
+    ) -> None:
+        """
+        Loads and preprocesses image files into the image cache ahead of time, so
+        displaying them later costs no decoding.
+        :param paths: Paths to the image files
+        :param mode: Preprocessing option of images with different resolution, defaults
+            to "resize"
+        :raises FileExistsError: If a path does not point to a file
+        :raises ValueError: If unsupported `mode` value is passed
+        """
+        self.image_cache.preload(paths, self.resolution, mode)
+
+
+class DDPDevice(_DDPDeviceBase):
+    """
+    Monochrome LED panel driven over DDP.
+    :param dest_ip: IP address of the device
+    :param resolution: Number of LED rows and columns, defaults to (16, 16)
+    :param dest_port: Port of the device, defaults to 4048
+    :param name: Identifier of the device, defaults to "ddp-obegransead"
+    :param batched: Send all packets of a frame with one system call where
+        supported, defaults to False
+    :param skip_unchanged: Do not send frames identical to the previous one,
+        defaults to False
+    :param keepalive: Seconds after which an unchanged frame is sent anyway,
+        defaults to 1.0
+    :param partial_updates: Send only the changed parts of frames, defaults to False
+    :param pixel_format: Format of the pixel data on the wire - "rgb" (each
+        brightness repeated for 3 channels), "gray8" (one byte per pixel) or "mono1"
+        (one bit per pixel, lit from brightness 128), defaults to "rgb"
+    :param threaded: Convert and send frames on a background thread. Frames the
+        thread can't keep up with are dropped, the latest one is always sent. Call
+        `close` when done. Defaults to False
+    :param image_cache_size: Number of preprocessed images kept by `display_img`,
+        0 disables caching, defaults to 64
+    :raises ValueError: If unsupported `pixel_format` value is passed
+    """
+
+    def __init__(
+        self,
+        dest_ip: str,
+        resolution: tuple[int, int] = (16, 16),
+        dest_port: int = 4048,
+        name: str = "ddp-obegransead",
+        batched: bool = False,
+        skip_unchanged: bool = False,
+        keepalive: float = 1.0,
+        partial_updates: bool = False,
+        pixel_format: PixelFormat = "rgb",
+        threaded: bool = False,
+        image_cache_size: int = 64,
+    ):
+        super().__init__(
+            dest_ip=dest_ip,
+            resolution=resolution,
+            dest_port=dest_port,
+            name=name,
+            batched=batched,
+            skip_unchanged=skip_unchanged,
+            keepalive=keepalive,
+            partial_updates=partial_updates,
+            pixel_format=pixel_format,
+            image_cache_size=image_cache_size,
+        )
+
+        self._sender: Optional[_FrameSender] = None
+        if threaded:
+            self._sender = _FrameSender(self)
+            self._sender.start()
+
+    def __enter__(self) -> "DDPDevice":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Stops the background sender thread, after it sends the last submitted frame.
+        """
+        if self._sender is not None:
+            self._sender.close()
+
+    @property
+    def frames_dropped(self) -> int:
+        """
+        Number of frames replaced by a newer one before the background sender thread
+        got to them (only counted with `threaded` enabled).
+        """
+        return self._sender.frames_dropped if self._sender is not None else 0
+
+    def display_array(self, data: np.ndarray, validate: bool = True) -> None:
+        """
+        Displays the data given as a pixel array.
+        Values can be either integers [0-255] - indicating brightness, or booleans -
+        ignoring brightness setting.
+        :param data: Array of LED brightness values
+        :param validate: Check the shape and range of the data. Disable only for
+            uint8 arrays of the right shape, e.g. rendered by a Canvas, which are
+            then sent without any checks or conversion. Defaults to True
+        :raises ValueError: If shape of the data is different from the LED array
+            dimensions
+        """
+        if self._sender is not None:
+            if validate:
+                self._check_shape(data)
+            self._sender.submit(data)
+        else:
+            self._agent.flush(self._prepare(data, validate))
+
+    def packetize(
+        self, data: np.ndarray, validate: bool = True
+    ) -> Optional[list[memoryview]]:
+        """
+        Converts a frame to packets without sending them, so the conversion and the
+        network wait can happen separately, e.g. for several devices at once.
+        `display_array` is the same as `send(packetize(data))`.
+        :param data: Array of LED brightness values
+        :param validate: Check the shape and range of the data, see `display_array`
+        :returns: Packets of the frame, valid until the next call, or None if the
+            frame is skipped as unchanged
+        :raises ValueError: If shape of the data is different from the LED array
+            dimensions
+        :raises RuntimeError: If the device sends on a background thread
+        """
+        if self._sender is not None:
+            raise RuntimeError(
+                f"Device {self.name} sends frames on its own thread, "
+                "use `display_array` instead."
+            )
+        return self._agent.packetize(self._prepare(data, validate))
+
+    def send(self, packets: Optional[list[memoryview]]) -> int:
+        """
+        Sends packets made by `packetize`.
+        :param packets: Packets of the frame, None if the frame is skipped
+        :returns: Number of packets sent, fewer than given if sending failed
+        """
+        if packets is None:
+            return 0
+        return self._agent.send(packets)
+
+    def display_pixel(self, x: int, y: int, value: int = 255) -> None:
+        """
+        Lights up a single pixel.
+        :param x: Row of the LED
+        :param y: column of the LED
+        :param value: Brightness of the pixel. Defaults to 255
+        :raises ValueError: If coordinates are out of bounds of the defined resolution
+        """
+        self.display_array(self._pixel_array(x, y, value))
 
     def clear(self) -> None:
         """
@@ -90,67 +351,152 @@ class DDPDevice:
         Loads and displays an image file.
         Image is first converted to grayscale. Then, if its size is not exactly the same
         as the resolution, it can be cropped (from top left corner), resized or padded
-        (if the image is larger it's first resized and then padded).
+        (if the image is larger it's first resized and then padded). Preprocessed
+        images are kept in `image_cache`, so displaying them again costs no decoding.
         :param path: Path to the image file
         :param mode: Preprocessing option of images with different resolution, defaults
             to "resize"
         :raises FileExistsError: If the path does not point to a file
         :raises ValueError: If unsupported `mode` value is passed
         """
-        path = Path(path)
-        if not path.exists() or not path.is_file():
-            raise FileExistsError(f"File `{path}` does not exist.")
-
-        img = Image.open(path).convert("L")  # convert to 8-bit grayscale
-        if img.size != self.resolution:
-            x, y = img.size
-            match mode:
-                case "resize":
-                    img = img.resize(self.resolution)
-                case "crop":
-                    img = img.crop([0, 0, self.resolution[0], self.resolution[1]])
-                case "pad":
-                    bound = max(x, y, *self.resolution)
-                    padded_img = Image.new("L", (bound, bound), "black")
-                    padded_img.paste(img, (int((bound - x) / 2), int((bound - y) / 2)))
-                    img = padded_img.resize(self.resolution)
-                case _:
-                    raise ValueError(f"Incorrect `mode` given ({mode}).")
-        self.display_array(np.array(img))
+        self.display_array(self._load_img(path, mode))
 
     def display_animation(
         self,
         dir_path: Path | str,
         fps: int = 30,
         countdown: int = 0,
+        catch_up: Literal["drop", "slow"] = "drop",
     ) -> None:
         """
         Displays a series of ordered image files inside a given directory as an
-        animation.
+        animation. Files are ordered by name, with numbers in natural order.
         :param dir_path: Directory containing frames of the animation
         :param fps: Frames per second, defaults to 30
         :param countdown: Initial countdown in the command line before the animation is
             displayed (useful for syncing music or other device), defaults to 0
+        :param catch_up: What to do when falling behind - "drop" frames to keep the
+            duration, or "slow" down, defaults to "drop"
         :raises FileExistsError: If incorrect directory path is given
         """
-        dir_path = Path(dir_path)
-        if not dir_path.exists() or not dir_path.is_dir():
-            raise FileExistsError(f"Directory `{dir_path}` does not exist.")
-
-        imgs = [
-            np.array(Image.open(filepath).convert("L"))
-            for filepath
-            in glob.glob(f"{dir_path}/**/*.bmp")
-        ]
-        _LOGGER.debug(f"{len(imgs)} frames found in `{dir_path}`.")
-
-        for i in reversed(range(countdown + 1)):
-            time.sleep(1)
-            print(f"{i}...")
-
-        start_time = time.time()
-        for i, img in enumerate(imgs):
-            self.display_array(img)
-            _LOGGER.debug(f"Frame {i}/{len(imgs)}")
-            expected_elapsed = start_time + (i + 1) * (1 / fps)
-            time.sleep(expected_elapsed - time.time())
+        source = DirectoryFrameSource(dir_path)
+        _LOGGER.debug(f"{len(source)} frames found in `{dir_path}`.")
+        self.play(source, fps=fps, countdown=countdown, catch_up=catch_up)
+
+    def play(
+        self,
+        source: FrameSource,
+        fps: Optional[float] = None,
+        countdown: int = 0,
+        catch_up: Literal["drop", "slow"] = "drop",
+    ) -> None:
+        """
+        Displays the frames of a source as an animation.
+        :param source: Source of the frames
+        :param fps: Frames per second, defaults to the frame rate of the source, or
+            30 if it has none
+        :param countdown: Initial countdown in the command line before the animation is
+            displayed (useful for syncing music or other device), defaults to 0
+        :param catch_up: What to do when falling behind - "drop" frames to keep the
+            duration, or "slow" down, defaults to "drop"
+        """
+        # Random access sources are read directly at the frame that is due
+        seekable = hasattr(source, "__getitem__") and hasattr(source, "__len__")
+
+        # Start iterating first, so the source can prepare frames during countdown
+        frames = iter(source)
+        try:
+            frame = next(frames, None)
+
+            for i in reversed(range(countdown + 1)):
+                time.sleep(1)
+                print(f"{i}...")
+
+            scheduler = FrameScheduler(fps=fps or source.fps or 30, catch_up=catch_up)
+            shown = 0
+            for i in scheduler.frames():
+                if seekable:
+                    frame = source[i] if i < len(source) else None
+                else:
+                    # Skip the frames dropped by the scheduler
+                    while shown < i and frame is not None:
+                        frame = next(frames, None)
+                        shown += 1
+                if frame is None:
+                    break
+                self.display_array(frame)
+                _LOGGER.debug(f"Frame {i}")
+            _LOGGER.debug(f"Animation timing: {scheduler.stats}")
+        finally:
+            # Stops the prefetching thread of the source and releases its files
+            close = getattr(frames, "close", None)
+            if close is not None:
+                close()
+
+
+class _FrameSender(threading.Thread):
+    """
+    Background thread converting and sending the frames of a device. Holds at most
+    one pending frame - submitting a new one replaces it, so the caller never waits
+    for the network.
+    :param device: The device to send the frames with
+    """
+
+    def __init__(self, device: DDPDevice):
+        super().__init__(name=f"{device.name}-sender", daemon=True)
+        self.frames_dropped = 0
+        self._device = device
+        self._condition = threading.Condition()
+        self._pending: Optional[np.ndarray] = None
+        self._free: list[np.ndarray] = []
+        self._closed = False
+
+    def submit(self, data: np.ndarray) -> None:
+        """
+        Queues a copy of a frame for sending, dropping the frame still pending.
+        :param data: Array of LED brightness values
+        :raises RuntimeError: If the sender was closed
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Sender thread of a closed device.")
+
+            if self._pending is not None:
+                self.frames_dropped += 1
+                buffer = self._pending
+            elif self._free:
+                buffer = self._free.pop()
+            else:
+                buffer = np.empty_like(data)
+
+            if buffer.shape != data.shape or buffer.dtype != data.dtype:
+                buffer = np.empty_like(data)
+            np.copyto(buffer, data)
+            self._pending = buffer
+            self._condition.notify()
+
+    def close(self) -> None:
+        """
+        Stops the thread once the pending frame is sent.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self.join()
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                frame, self._pending = self._pending, None
+
+            try:
+                self._device._agent.flush(self._device._prepare(frame))
+            except Exception:
+                _LOGGER.exception(f"Failed to send a frame to {self._device.name}.")
+
+            with self._condition:
+                self._free.append(frame)
@@ -0,0 +1,592 @@
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import socket
+import sys
+import time
+from typing import Optional, Union
+
+import numpy as np
+
+from src.DDPAgent import _DDPAgent, _IOVec, _MMsgHdr
+from src.scheduler import RunningStats
+
+
+def decode_frame(
+    data: Union[bytes, bytearray, memoryview, np.ndarray],
+    data_type: int,
+    resolution: tuple[int, int],
+) -> np.ndarray:
+    """
+    Decodes the pixel data of a DDP frame.
+
+    Args:
+        data: Pixel data of the whole frame.
+        data_type: DDP data type from the packet header.
+        resolution: Number of LED rows and columns.
+
+    Returns:
+        Array of shape (rows, columns, 3) for RGB data, or (rows, columns) of
+        brightness values for grayscale data.
+
+    Raises:
+        ValueError: If the data type is not supported.
+    """
+    rows, cols = resolution
+    pixels = np.frombuffer(data, dtype=np.uint8)
+    if data_type == _DDPAgent._DATATYPE:
+        return pixels[:rows * cols * 3].reshape(rows, cols, 3)
+    if data_type == _DDPAgent._DATATYPE_GRAY8:
+        return pixels[:rows * cols].reshape(rows, cols)
+    if data_type == _DDPAgent._DATATYPE_MONO1:
+        bits = np.unpackbits(pixels, count=rows * cols)
+        return (bits * np.uint8(255)).reshape(rows, cols)
+    raise ValueError(f"Unsupported DDP data type {data_type:#04x}.")
+
+
+class DDPReceiver():
+    """
+    Local stand-in for a DDP device, for developing and load testing without one.
+    Receives packets on a UDP port and reassembles them into frames using their
+    data offsets and the PUSH flag. Parts of the frame not covered by the packets
+    of a frame keep their previous contents, as on a device, so partial updates
+    are reassembled correctly.
+
+    Packets are received in batches into one preallocated buffer, with a single
+    `recvmmsg` call per batch where supported (Linux), and their headers are parsed
+    together, so the receiver keeps up with hundreds of thousands of packets per
+    second. Frames are decoded only when asked for.
+
+    Sequence numbers are tracked to count lost frames (skipped sequence numbers),
+    incomplete frames (started, but their PUSH packet never arrived) and duplicate
+    packets. At the PUSH packet, the bytes received for the frame are checked against
+    its size, and frames missing packets are counted as partial instead of
+    completed, unless the sender uses partial updates. Timing of completed frames
+    gives the effective frame rate and jitter.
+    """
+    _HEADER = np.dtype([
+        ("flags", "u1"),
+        ("sequence", "u1"),
+        ("data_type", "u1"),
+        ("source", "u1"),
+        ("offset", ">u4"),
+        ("length", ">u2"),
+    ])
+    _TIMECODE_LEN = 4
+    # Largest UDP payload of an Ethernet frame
+    _PACKET_SIZE = 1472
+    _SEQUENCE_MASK = 0x0F
+    _SEQUENCE_CYCLE = 15
+
+    def __init__(
+        self,
+        resolution: tuple[int, int],
+        host: str = "127.0.0.1",
+        port: int = 4048,
+        batch_size: int = 256,
+        buffer_size: int = 1 << 22,
+        partial_updates: bool = False,
+    ) -> None:
+        """
+        Args:
+            resolution: Number of LED rows and columns.
+            host: Address to listen on. Defaults to "127.0.0.1".
+            port: Port to listen on, 0 picks a free one. Defaults to 4048.
+            batch_size: Maximum number of packets received at once. Defaults to 256.
+            buffer_size: Requested size of the socket receive buffer in bytes, so
+                bursts are not dropped by the kernel. Defaults to 4 MiB.
+            partial_updates: Whether the sender only sends the changed parts of
+                frames, so any frame ending with a PUSH packet counts as completed.
+                Otherwise, frames need all their bytes. Defaults to False.
+        """
+        self.resolution = resolution
+        self.partial_updates = partial_updates
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+        except OSError:
+            pass
+        self._sock.bind((host, port))
+        self._sock.setblocking(False)
+        self.port = self._sock.getsockname()[1]
+
+        # Frame being reassembled, and a copy of the last completed one
+        frame_len = resolution[0] * resolution[1] * 3
+        self._frame = bytearray(frame_len)
+        self._frame_view = memoryview(self._frame)
+        self._completed = bytearray(frame_len)
+        self._completed_type: Optional[int] = None
+        self._decoded: Optional[np.ndarray] = None
+
+        # Received packets, one per slot of the buffer
+        self._buffer = bytearray(batch_size * self._PACKET_SIZE)
+        self._buffer_view = memoryview(self._buffer)
+        self._headers = np.ndarray(
+            shape=(batch_size,),
+            dtype=self._HEADER,
+            buffer=self._buffer,
+            strides=(self._PACKET_SIZE,),
+        )
+        self._batch_receiver = (
+            _BatchReceiver(self._buffer, batch_size, self._PACKET_SIZE)
+            if _BatchReceiver.available()
+            else None
+        )
+        self._batch: list[tuple] = []
+        self._next = 0
+        self._batch_time = 0.0
+
+        # Sequence number of the current or last frame, whether it is still being
+        # reassembled, the offsets of its packets and the bytes received so far
+        self._sequence = 0
+        self._assembling = False
+        self._offsets: set[int] = set()
+        self._received = 0
+        self._frame_start = 0.0
+
+        self.reset_stats()
+
+    def __enter__(self) -> "DDPReceiver":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def reset_stats(self) -> None:
+        """
+        Resets the statistics, see `stats`.
+        """
+        self.packets = 0
+        self.bytes = 0
+        self.frames = 0
+        self.frames_lost = 0
+        self.frames_incomplete = 0
+        self.frames_partial = 0
+        self.duplicates = 0
+        self.invalid = 0
+
+        self._first_time: Optional[float] = None
+        self._last_time: Optional[float] = None
+        self._intervals = RunningStats()
+        self._assembly = RunningStats()
+
+    @property
+    def stats(self) -> dict[str, float]:
+        """
+        Statistics since the start or the last `reset_stats`.
+
+        Returns:
+            Number of packets, bytes and completed frames received, frames lost,
+            incomplete frames, partial frames (pushed with packets missing),
+            duplicate and invalid packets, the effective frame
+            rate, the mean, standard deviation (jitter) and max of intervals between
+            completed frames and the mean and max time from the first to the last
+            packet of a frame, all in seconds.
+        """
+        intervals = self._intervals
+        duration = self._last_time - self._first_time if intervals.count else 0.0
+        return {
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "frames": self.frames,
+            "frames_lost": self.frames_lost,
+            "frames_incomplete": self.frames_incomplete,
+            "frames_partial": self.frames_partial,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "fps": intervals.count / duration if duration else 0.0,
+            "mean_interval": intervals.mean,
+            "jitter": intervals.std,
+            "max_interval": intervals.max,
+            "mean_assembly": self._assembly.mean,
+            "max_assembly": self._assembly.max,
+        }
+
+    @property
+    def frame(self) -> Optional[np.ndarray]:
+        """
+        The last completed frame, see `decode_frame`, or None before the first one.
+        """
+        if self._decoded is None and self._completed_type is not None:
+            self._decoded = decode_frame(
+                self._completed, self._completed_type, self.resolution
+            ).copy()
+        return self._decoded
+
+    def receive_frame(self, timeout: Optional[float] = None) -> np.ndarray:
+        """
+        Receives packets until one with the PUSH flag arrives.
+
+        Args:
+            timeout: Seconds to wait for each packet. Defaults to waiting forever.
+
+        Returns:
+            The decoded frame, see `decode_frame`.
+
+        Raises:
+            TimeoutError: If no packet arrives in time.
+        """
+        while not self._process(stop_at_push=True):
+            if not self._receive(timeout):
+                raise TimeoutError("No DDP packet received in time.")
+        return self.frame
+
+    def poll(self, timeout: float = 0.0) -> int:
+        """
+        Processes all packets received so far, without decoding the frames.
+
+        Args:
+            timeout: Seconds to wait if no packet has arrived yet. Defaults to not
+                waiting.
+
+        Returns:
+            Number of frames completed.
+        """
+        frames = self.frames
+        self._process(stop_at_push=False)
+        if self._receive(timeout):
+            self._process(stop_at_push=False)
+            # Drain what arrived meanwhile, a batch at a time
+            while self._receive(0.0):
+                self._process(stop_at_push=False)
+                if len(self._batch) < len(self._headers):
+                    break
+        return self.frames - frames
+
+    def _receive(self, timeout: Optional[float]) -> int:
+        """
+        Receives a batch of packets, replacing the previous batch.
+
+        Args:
+            timeout: Seconds to wait if no packet is ready. None waits forever.
+
+        Returns:
+            Number of packets received.
+        """
+        sizes = self._read()
+        if not sizes:
+            ready, _, _ = select.select([self._sock], [], [], timeout)
+            if not ready:
+                return 0
+            sizes = self._read()
+
+        count = len(sizes)
+        headers = self._headers[:count]
+        self._batch = list(
+            zip(
+                sizes,
+                headers["flags"].tolist(),
+                headers["sequence"].tolist(),
+                headers["data_type"].tolist(),
+                headers["offset"].tolist(),
+                headers["length"].tolist(),
+            )
+        )
+        self._next = 0
+        self._batch_time = time.perf_counter()
+        return count
+
+    def _read(self) -> list[int]:
+        """
+        Reads the packets waiting in the socket into the buffer, without blocking.
+
+        Returns:
+            Sizes of the packets read.
+        """
+        if self._batch_receiver is not None:
+            return self._batch_receiver.receive(self._sock)
+
+        sizes = []
+        for start in range(0, len(self._buffer), self._PACKET_SIZE):
+            try:
+                sizes.append(
+                    self._sock.recv_into(
+                        self._buffer_view[start:start + self._PACKET_SIZE]
+                    )
+                )
+            except (BlockingIOError, InterruptedError):
+                break
+        return sizes
+
+    def _process(self, stop_at_push: bool) -> bool:
+        """
+        Reassembles the packets of the current batch not processed yet.
+
+        Args:
+            stop_at_push: Stop after the first completed frame, leaving the rest of
+                the batch for later.
+
+        Returns:
+            True if a frame was completed.
+        """
+        frame = self._frame_view
+        frame_len = len(self._frame)
+        buffer = self._buffer_view
+        offsets = self._offsets
+        stride = self._PACKET_SIZE
+        completed = False
+
+        batch = self._batch
+        index = self._next
+        while index < len(batch):
+            size, flags, sequence, data_type, offset, length = batch[index]
+            start = index * stride
+            index += 1
+            self.packets += 1
+
+            header_len = _DDPAgent._HEADER_LEN
+            if flags & _DDPAgent._TIME:
+                header_len += self._TIMECODE_LEN
+            if (
+                flags & _DDPAgent._VER != _DDPAgent._VER1
+                or size < header_len
+                or flags & (_DDPAgent._QUERY | _DDPAgent._REPLY)
+                or (offset >= frame_len and length)
+            ):
+                self.invalid += 1
+                continue
+
+            sequence &= self._SEQUENCE_MASK
+            if sequence:
+                if sequence != self._sequence:
+                    if self._assembling:
+                        self.frames_incomplete += 1
+                    if self._sequence:
+                        self.frames_lost += (
+                            (sequence - self._sequence - 1) % self._SEQUENCE_CYCLE
+                        )
+                    self._sequence = sequence
+                    self._assembling = False
+                    offsets.clear()
+                elif not self._assembling or offset in offsets:
+                    # Sent again, or a packet of the frame that was just completed
+                    self.duplicates += 1
+                    continue
+                offsets.add(offset)
+
+            if not self._assembling:
+                self._assembling = True
+                self._frame_start = self._batch_time
+                self._received = 0
+
+            length = min(length, size - header_len, frame_len - offset)
+            data_start = start + header_len
+            frame[offset:offset + length] = buffer[data_start:data_start + length]
+            self.bytes += length
+            self._received += length
+
+            if flags & _DDPAgent._PUSH:
+                if (
+                    not self.partial_updates
+                    and self._received < self._frame_size(data_type)
+                ):
+                    self.frames_partial += 1
+                    self._assembling = False
+                    continue
+                self._complete(data_type)
+                completed = True
+                if stop_at_push:
+                    break
+
+        self._next = index
+        return completed
+
+    def _frame_size(self, data_type: int) -> int:
+        """
+        Size of the pixel data of a whole frame.
+
+        Args:
+            data_type: DDP data type of the frame.
+
+        Returns:
+            Number of bytes, that of RGB data for unsupported data types.
+        """
+        pixels = self.resolution[0] * self.resolution[1]
+        if data_type == _DDPAgent._DATATYPE_GRAY8:
+            return pixels
+        if data_type == _DDPAgent._DATATYPE_MONO1:
+            return (pixels + 7) // 8
+        return pixels * 3
+
+    def _complete(self, data_type: int) -> None:
+        """
+        Stores the reassembled frame as completed and updates the statistics.
+
+        Args:
+            data_type: DDP data type of the frame.
+        """
+        self._completed[:] = self._frame
+        self._completed_type = data_type
+        self._decoded = None
+        self._assembling = False
+        self.frames += 1
+
+        now = self._batch_time
+        self._assembly.add(now - self._frame_start)
+
+        if self._last_time is None:
+            self._first_time = now
+        else:
+            self._intervals.add(now - self._last_time)
+        self._last_time = now
+
+    def close(self) -> None:
+        """
+        Closes the socket.
+        """
+        self._sock.close()
+
+
+class _BatchReceiver():
+    """
+    Receives several datagrams with one `recvmmsg` call, each into its own slot of
+    a preallocated buffer. The message vector is built once and reused.
+    """
+    _libc = None
+    _MSG_DONTWAIT = 0x40
+
+    def __init__(self, buffer: bytearray, count: int, stride: int) -> None:
+        """
+        Args:
+            buffer: Buffer of `count` slots of `stride` bytes.
+            count: Maximum number of datagrams received at once.
+            stride: Size of a slot, longer datagrams are truncated.
+        """
+        self._buffer = buffer
+        self._iovecs = (_IOVec * count)()
+        self._msgs = (_MMsgHdr * count)()
+        address = ctypes.addressof(ctypes.c_char.from_buffer(buffer))
+        for i in range(count):
+            self._iovecs[i].iov_base = address + i * stride
+            self._iovecs[i].iov_len = stride
+            self._msgs[i].msg_hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            self._msgs[i].msg_hdr.msg_iovlen = 1
+        self._count = count
+
+    @classmethod
+    def available(cls) -> bool:
+        """
+        Checks whether `recvmmsg` can be called on this platform.
+
+        Returns:
+            True if batched receiving is supported.
+        """
+        if cls._libc is None:
+            cls._libc = False
+            if sys.platform.startswith("linux"):
+                try:
+                    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+                    libc.recvmmsg.argtypes = [
+                        ctypes.c_int,
+                        ctypes.POINTER(_MMsgHdr),
+                        ctypes.c_uint,
+                        ctypes.c_int,
+                        ctypes.c_void_p,
+                    ]
+                    libc.recvmmsg.restype = ctypes.c_int
+                    cls._libc = libc
+                except (OSError, AttributeError):
+                    pass
+        return cls._libc is not False
+
+    def receive(self, sock: socket.socket) -> list[int]:
+        """
+        Receives the datagrams waiting in the socket, without blocking.
+
+        Args:
+            sock: Bound socket to receive from.
+
+        Returns:
+            Sizes of the received datagrams, in the order of the buffer slots.
+
+        Raises:
+            OSError: If receiving fails.
+        """
+        result = self._libc.recvmmsg(
+            sock.fileno(), self._msgs, self._count, self._MSG_DONTWAIT, None
+        )
+        if result < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(error, os.strerror(error))
+        msgs = self._msgs
+        return [msgs[i].msg_len for i in range(result)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Emulate a DDP device, printing statistics of received frames."
+    )
+    parser.add_argument(
+        "--resolution",
+        type=int,
+        nargs=2,
+        default=(16, 16),
+        metavar=("ROWS", "COLS"),
+        help="Number of LED rows and columns",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=4048, help="Port to listen on")
+    parser.add_argument(
+        "--interval", type=float, default=1.0, help="Seconds between statistics"
+    )
+    parser.add_argument(
+        "--partial-updates",
+        action="store_true",
+        help="Count frames with only some of their bytes as completed",
+    )
+    parser.add_argument(
+        "--preview", action="store_true", help="Show the frames in a window"
+    )
+    parser.add_argument(
+        "--scale", type=int, default=20, help="Scale multiplier of the preview"
+    )
+    args = parser.parse_args()
+
+    if args.preview:
+        # cv2 takes most of the import time and is not needed otherwise
+        from src.display import show_image_loop
+
+    receiver = DDPReceiver(
+        resolution=tuple(args.resolution),
+        host=args.host,
+        port=args.port,
+        partial_updates=args.partial_updates,
+    )
+    print(f"Listening on {args.host}:{receiver.port}, Ctrl+C to stop.")
+    next_report = time.perf_counter() + args.interval
+    try:
+        while True:
+            if receiver.poll(timeout=0.01) and args.preview:
+                frame = receiver.frame
+                if frame.ndim == 3:
+                    # OpenCV expects BGR
+                    frame = np.ascontiguousarray(frame[..., ::-1])
+                show_image_loop(frame, scale=args.scale)
+
+            if time.perf_counter() >= next_report:
+                next_report += args.interval
+                stats = receiver.stats
+                print(
+                    f"{stats['fps']:7.1f} fps, "
+                    f"jitter {stats['jitter'] * 1000:.2f} ms, "
+                    f"{stats['frames']} frames, "
+                    f"{stats['frames_lost']} lost, "
+                    f"{stats['frames_incomplete']} incomplete, "
+                    f"{stats['frames_partial']} partial, "
+                    f"{stats['duplicates']} duplicates, "
+                    f"{stats['invalid']} invalid"
+                )
+                receiver.reset_stats()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.close()
+
+
+if __name__ == "__main__":
+    main()
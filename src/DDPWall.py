@@ -0,0 +1,199 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import numpy as np
+
+from src.DDPDevice import DDPDevice
+from src.utils import load_config
+
+_LOGGER = logging.getLogger(__file__)
+_LOGGER.setLevel(logging.DEBUG)
+
+
+@dataclass
+class Panel:
+    """
+    Placement of a single panel within a wall.
+    :param dest_ip: IP address of the panel
+    :param x: Column of the wall where the left edge of the panel is
+    :param y: Row of the wall where the top edge of the panel is
+    :param rotation: Clockwise rotation of the mounted panel in degrees, one of 0,
+        90, 180, 270. Content is rotated the other way, so it appears upright.
+    :param resolution: Number of LED rows and columns of the panel
+    :param dest_port: Port of the panel
+    :param name: Identifier of the panel, defaults to its address
+    """
+
+    dest_ip: str
+    x: int = 0
+    y: int = 0
+    rotation: int = 0
+    resolution: tuple[int, int] = (16, 16)
+    dest_port: int = 4048
+    name: Optional[str] = None
+
+    def __post_init__(self):
+        if self.rotation not in (0, 90, 180, 270):
+            raise ValueError(f"Incorrect `rotation` given ({self.rotation}).")
+        self.resolution = tuple(self.resolution)
+        if self.name is None:
+            self.name = f"{self.dest_ip}:{self.dest_port}"
+
+    @property
+    def footprint(self) -> tuple[int, int]:
+        """
+        Number of wall rows and columns covered by the panel.
+        """
+        rows, cols = self.resolution
+        return (cols, rows) if self.rotation in (90, 270) else (rows, cols)
+
+
+class DDPWall:
+    """
+    Several panels tiled into one virtual display. Frames are sliced into per-panel
+    views and sent to all panels at the same time, from a pool of threads.
+    :param panels: Placement of the panels
+    :param resolution: Number of rows and columns of the whole wall, defaults to
+        the bounding box of the panels
+    :param device_kwargs: Additional arguments of each panel's `DDPDevice`, except
+        `threaded`, as the wall sends from its own threads
+    :raises ValueError: If a panel does not fit within the wall, or `threaded` is
+        given
+    """
+
+    def __init__(
+        self,
+        panels: list[Panel],
+        resolution: Optional[tuple[int, int]] = None,
+        **device_kwargs: Any,
+    ):
+        if device_kwargs.get("threaded"):
+            raise ValueError("Incorrect `threaded` given, the wall sends in threads.")
+        if resolution is None:
+            resolution = (
+                max(panel.y + panel.footprint[0] for panel in panels),
+                max(panel.x + panel.footprint[1] for panel in panels),
+            )
+        self.resolution = tuple(resolution)
+        self.panels = panels
+
+        self._views = []
+        for panel in panels:
+            rows, cols = panel.footprint
+            if (
+                panel.x < 0
+                or panel.y < 0
+                or panel.y + rows > self.resolution[0]
+                or panel.x + cols > self.resolution[1]
+            ):
+                raise ValueError(
+                    f"Panel {panel.name} does not fit within {self.resolution}."
+                )
+            self._views.append(
+                (slice(panel.y, panel.y + rows), slice(panel.x, panel.x + cols))
+            )
+
+        self.devices = [
+            DDPDevice(
+                dest_ip=panel.dest_ip,
+                resolution=panel.resolution,
+                dest_port=panel.dest_port,
+                name=panel.name,
+                **device_kwargs,
+            )
+            for panel in panels
+        ]
+        self.latencies = {panel.name: 0.0 for panel in panels}
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(panels),
+            thread_name_prefix="ddp-wall",
+        )
+
+    @classmethod
+    def from_config(
+        cls,
+        config: Optional[dict] = None,
+        **device_kwargs: Any,
+    ) -> "DDPWall":
+        """
+        Creates a wall from the "wall" section of the configuration file, e.g.
+        {"resolution": [16, 32], "panels": [{"dest_ip": "...", "x": 16, "y": 0,
+        "rotation": 180}, ...]}.
+        :param config: Loaded configuration, defaults to `load_config()`
+        :param device_kwargs: Additional arguments of each panel's `DDPDevice`
+        :returns: The wall
+        """
+        wall_config = (config or load_config())["wall"]
+        panels = [Panel(**panel) for panel in wall_config["panels"]]
+        return cls(
+            panels=panels,
+            resolution=wall_config.get("resolution"),
+            **device_kwargs,
+        )
+
+    def display_array(self, data: np.ndarray) -> None:
+        """
+        Displays the data given as a pixel array spanning the whole wall.
+        Values can be either integers [0-255] - indicating brightness, or booleans -
+        ignoring brightness setting.
+        :param data: Array of LED brightness values
+        :raises ValueError: If shape of the data is different from the wall
+            resolution
+        """
+        if data.shape != self.resolution:
+            msg = (
+                f"Incorrect dimensions of the input data - {data.shape}. "
+                f"Must be {self.resolution}."
+            )
+            raise ValueError(msg)
+
+        # Convert all frames up front, so the panels only wait for the network
+        packets = [
+            device.packetize(np.rot90(data[view], k=k))
+            for device, view, k in zip(
+                self.devices,
+                self._views,
+                (panel.rotation // 90 for panel in self.panels),
+            )
+        ]
+
+        start = time.perf_counter()
+        futures = [
+            self._executor.submit(self._send, device, panel_packets, start)
+            for device, panel_packets in zip(self.devices, packets)
+        ]
+        for panel, future in zip(self.panels, futures):
+            self.latencies[panel.name] = future.result()
+
+    @staticmethod
+    def _send(
+        device: DDPDevice,
+        packets: Optional[list[memoryview]],
+        start: float,
+    ) -> float:
+        """
+        Sends a frame to one panel.
+        :param device: The panel
+        :param packets: Packets of the frame, None if the frame is skipped
+        :param start: Time when sending to all panels started
+        :returns: Seconds from the start until the panel's frame was sent
+        """
+        device.send(packets)
+        return time.perf_counter() - start
+
+    def clear(self) -> None:
+        """
+        Turns off all the LEDs.
+        """
+        self.display_array(np.zeros(self.resolution))
+
+    def close(self) -> None:
+        """
+        Stops the sending threads and closes the panels.
+        """
+        self._executor.shutdown()
+        for device in self.devices:
+            device.close()
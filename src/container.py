@@ -0,0 +1,357 @@
+"""
+Module containing a precompiled animation container format. A container is a
+single file with a fixed-size header followed by all frames stored back to back,
+either as 8-bit grayscale or bit-packed, and an optional per-frame timestamp index.
+Players memory-map the file, so loading is instant and any frame can be read in
+constant time.
+
+Usage: python -m src.container INPUT OUTPUT [--fps FPS] [--format {gray8,mono1}]
+"""
+
+import argparse
+import struct
+import typing as t
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from src.sources import FrameSource, downscale, list_frame_paths
+
+# cv2 is imported where needed, as it takes most of the import time
+
+MAGIC = b"OBGA"
+VERSION = 1
+
+# magic, version, height, width, pixel format, flags, fps, frame count
+_HEADER = struct.Struct("<4sHHHBBfI")
+_HEADER_SIZE = 32
+_FLAG_TIMESTAMPS = 0x01
+
+ContainerFormat = t.Literal["gray8", "mono1"]
+_FORMAT_CODES = {"gray8": 0, "mono1": 1}
+
+# Row i holds the 8 pixels (0 or 255) encoded by the byte value i
+_UNPACK_LUT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1) * 255
+
+
+def _frame_size(height: int, width: int, pixel_format: ContainerFormat) -> int:
+    """
+    Number of bytes of a single stored frame.
+    :param height: Number of rows of the frame
+    :param width: Number of columns of the frame
+    :param pixel_format: Format of the stored pixels
+    :returns: Size in bytes
+    """
+    pixels = height * width
+    return pixels if pixel_format == "gray8" else -(-pixels // 8)
+
+
+def _resize(
+    frame: np.ndarray,
+    resolution: t.Optional[t.Tuple[int, int]],
+) -> np.ndarray:
+    """
+    Downscales a frame, if a resolution is given.
+    :param frame: The grayscale frame
+    :param resolution: Number of rows and columns of the result
+    :returns: The resized frame
+    """
+    return frame if resolution is None else downscale(frame, resolution)
+
+
+def _read_directory(
+    path: Path,
+    resolution: t.Optional[t.Tuple[int, int]],
+) -> t.Iterator[t.Tuple[np.ndarray, t.Optional[float]]]:
+    """
+    Reads frames from image files in a directory, in natural order.
+    :param path: Directory containing the frames
+    :param resolution: Number of rows and columns to resize the frames to
+    :returns: Iterator of grayscale frames, without timestamps
+    """
+    for frame_path in list_frame_paths(path):
+        with Image.open(frame_path) as img:
+            frame = np.array(img.convert("L"))
+        yield _resize(frame, resolution), None
+
+
+def _read_video(
+    path: Path,
+    resolution: t.Optional[t.Tuple[int, int]],
+) -> t.Iterator[t.Tuple[np.ndarray, t.Optional[float]]]:
+    """
+    Reads frames from a video file.
+    :param path: Path to the video file
+    :param resolution: Number of rows and columns to resize the frames to
+    :returns: Iterator of grayscale frames with their timestamps in seconds
+    :raises ValueError: If the video can't be opened
+    """
+    import cv2
+
+    capture = cv2.VideoCapture(str(path))
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video `{path}`.")
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            timestamp = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            yield _resize(frame, resolution), timestamp
+    finally:
+        capture.release()
+
+
+def compile_animation(
+    source: Path | str,
+    output: Path | str,
+    fps: t.Optional[float] = None,
+    pixel_format: ContainerFormat = "gray8",
+    resolution: t.Optional[t.Tuple[int, int]] = None,
+    timestamps: bool = False,
+) -> Path:
+    """
+    Converts a directory of frame images, or a video file, into a container file.
+    Frames are written as they are read, so memory use does not depend on the
+    length of the animation.
+    :param source: Directory containing frames, or a video file
+    :param output: Path of the container file to write
+    :param fps: Frame rate of the animation, defaults to the frame rate of the video,
+        or 30 for directories
+    :param pixel_format: "gray8" stores one byte per pixel, "mono1" one bit per
+        pixel (lit from brightness 128), defaults to "gray8"
+    :param resolution: Number of rows and columns to downscale the frames to,
+        defaults to the size of the first frame
+    :param timestamps: Store the timestamp of each frame (taken from the video, or
+        derived from the frame rate), defaults to False
+    :returns: Path of the written container
+    :raises FileExistsError: If the source does not exist
+    :raises ValueError: If unsupported `pixel_format` value is passed, or the frames
+        differ in size
+    """
+    source = Path(source)
+    output = Path(output)
+    if pixel_format not in _FORMAT_CODES:
+        raise ValueError(f"Incorrect `pixel_format` given ({pixel_format}).")
+    if not source.exists():
+        raise FileExistsError(f"Source `{source}` does not exist.")
+
+    if source.is_dir():
+        frames = _read_directory(source, resolution)
+        fps = fps or 30
+    else:
+        import cv2
+
+        capture = cv2.VideoCapture(str(source))
+        fps = fps or capture.get(cv2.CAP_PROP_FPS) or 30
+        capture.release()
+        frames = _read_video(source, resolution)
+
+    return _write(frames, output, fps, pixel_format, timestamps)
+
+
+def save_container(
+    frames: np.ndarray,
+    output: Path | str,
+    fps: float = 30,
+    pixel_format: ContainerFormat = "gray8",
+    timestamps: bool = False,
+) -> Path:
+    """
+    Writes an array of frames into a container file.
+    :param frames: Frames as an array of shape (N, rows, columns)
+    :param output: Path of the container file to write
+    :param fps: Frame rate of the animation, defaults to 30
+    :param pixel_format: "gray8" stores one byte per pixel, "mono1" one bit per
+        pixel (lit from brightness 128), defaults to "gray8"
+    :param timestamps: Store the timestamp of each frame, derived from the frame
+        rate, defaults to False
+    :returns: Path of the written container
+    :raises ValueError: If unsupported `pixel_format` value is passed
+    """
+    if pixel_format not in _FORMAT_CODES:
+        raise ValueError(f"Incorrect `pixel_format` given ({pixel_format}).")
+    return _write(
+        ((frame, None) for frame in frames),
+        Path(output),
+        fps,
+        pixel_format,
+        timestamps,
+    )
+
+
+def _write(
+    frames: t.Iterable[t.Tuple[np.ndarray, t.Optional[float]]],
+    output: Path,
+    fps: float,
+    pixel_format: ContainerFormat,
+    timestamps: bool,
+) -> Path:
+    """
+    Writes frames into a container file as they come.
+    :param frames: Frames with their timestamps in seconds, if known
+    :param output: Path of the container file to write
+    :param fps: Frame rate of the animation
+    :param pixel_format: Format of the stored pixels
+    :param timestamps: Store the timestamp of each frame
+    :returns: Path of the written container
+    :raises ValueError: If the frames differ in size
+    """
+    count = 0
+    shape = None
+    frame_times = []
+    with open(output, "wb") as fp:
+        # Header is written once the frame count and size are known
+        fp.write(bytes(_HEADER_SIZE))
+        for frame, timestamp in frames:
+            if shape is None:
+                shape = frame.shape
+            elif frame.shape != shape:
+                raise ValueError(
+                    f"Frame {count} has shape {frame.shape}, expected {shape}."
+                )
+            if pixel_format == "mono1":
+                frame = np.packbits(frame.reshape(-1) >= 128)
+            fp.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+            frame_times.append(count / fps if timestamp is None else timestamp)
+            count += 1
+
+        if timestamps:
+            fp.write(np.asarray(frame_times, dtype="<f8").tobytes())
+
+        height, width = shape or (0, 0)
+        fp.seek(0)
+        fp.write(
+            _HEADER.pack(
+                MAGIC,
+                VERSION,
+                height,
+                width,
+                _FORMAT_CODES[pixel_format],
+                _FLAG_TIMESTAMPS if timestamps else 0,
+                fps,
+                count,
+            )
+        )
+    return output
+
+
+class ContainerFrameSource(FrameSource):
+    """
+    Frames of a container file, memory-mapped. Opening is instant regardless of the
+    file size, and frames can be read in any order in constant time.
+    :param path: Path to the container file
+    :raises ValueError: If the file is not a supported container
+    """
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        with open(self.path, "rb") as fp:
+            header = fp.read(_HEADER.size)
+        if len(header) < _HEADER.size or header[:4] != MAGIC:
+            raise ValueError(f"`{self.path}` is not an animation container.")
+
+        (_, version, height, width, format_code, flags, fps, count) = (
+            _HEADER.unpack(header)
+        )
+        if version != VERSION:
+            raise ValueError(f"Unsupported container version {version}.")
+
+        self.resolution = (height, width)
+        self.pixel_format: ContainerFormat = next(
+            name for name, code in _FORMAT_CODES.items() if code == format_code
+        )
+        self.fps = fps
+        frame_size = _frame_size(height, width, self.pixel_format)
+
+        self._frames = np.memmap(
+            self.path,
+            dtype=np.uint8,
+            mode="r",
+            offset=_HEADER_SIZE,
+            shape=(count, frame_size),
+        ) if count else np.empty((0, frame_size), dtype=np.uint8)
+
+        self.timestamps: t.Optional[np.ndarray] = None
+        if flags & _FLAG_TIMESTAMPS and count:
+            self.timestamps = np.memmap(
+                self.path,
+                dtype="<f8",
+                mode="r",
+                offset=_HEADER_SIZE + count * frame_size,
+                shape=(count,),
+            )
+
+        # Bit-packed frames are unpacked into this buffer
+        self._unpacked = np.empty((frame_size, 8), dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        """
+        Reads a single frame. Grayscale frames are returned as read-only views of
+        the file, bit-packed frames are unpacked into a buffer reused by the next
+        call.
+        :param index: Index of the frame
+        :returns: The frame as a 2D uint8 array
+        """
+        frame = self._frames[index]
+        if self.pixel_format == "gray8":
+            return frame.reshape(self.resolution)
+
+        np.take(_UNPACK_LUT, frame, axis=0, out=self._unpacked)
+        pixels = self.resolution[0] * self.resolution[1]
+        return self._unpacked.reshape(-1)[:pixels].reshape(self.resolution)
+
+    def __iter__(self) -> t.Iterator[np.ndarray]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compile a directory of frames or a video into a container."
+    )
+    parser.add_argument("input", type=Path, help="Directory of frames or video file")
+    parser.add_argument("output", type=Path, help="Container file to write")
+    parser.add_argument("--fps", type=float, help="Frame rate of the animation")
+    parser.add_argument(
+        "--format",
+        choices=list(_FORMAT_CODES),
+        default="gray8",
+        help="Pixel format of the stored frames",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=int,
+        nargs=2,
+        metavar=("ROWS", "COLS"),
+        help="Downscale the frames to this resolution",
+    )
+    parser.add_argument(
+        "--timestamps",
+        action="store_true",
+        help="Store the timestamp of each frame",
+    )
+    args = parser.parse_args()
+
+    output = compile_animation(
+        source=args.input,
+        output=args.output,
+        fps=args.fps,
+        pixel_format=args.format,
+        resolution=args.resolution,
+        timestamps=args.timestamps,
+    )
+    source = ContainerFrameSource(output)
+    print(
+        f"{len(source)} frames of {source.resolution} at {source.fps:g} fps "
+        f"written to `{output}`."
+    )
+
+
+if __name__ == "__main__":
+    main()
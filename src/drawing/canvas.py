@@ -6,7 +6,246 @@ import typing as t
 
 import numpy as np
 
-from src.drawing.common import DrawableObject
+from src.drawing.common import BlendMode, Bounds, DrawableObject, blend
+
+# Beyond this many changed regions, or this fraction of the area changed, one
+# redraw of everything is cheaper than redrawing the regions one by one
+_MAX_REGIONS = 8
+_MAX_AREA = 0.5
+
+
+class Layer:
+    """
+    A group of objects drawn together onto an image of their own, which is then
+    blended onto the layers below it. Layers are created by `Canvas.add_layer`.
+
+    Rendering is incremental. The layer remembers the version and bounds of each
+    object when it was drawn, and only redraws the regions of objects that were
+    added, removed or changed since, so its cost depends on what moved rather than
+    on the number of objects.
+
+    Static layers are drawn once and then cached, their objects are neither
+    updated nor checked for changes. Call `invalidate` after changing them.
+
+    The layer covers only the bounds of its objects, elsewhere it is transparent
+    and leaves the layers below as they are, whatever its blend mode.
+
+    :param width: The pixel width of the layer
+    :param height: The pixel height of the layer
+    :param objects: Optional initial list of DrawableObject
+    :param z: Position of the layer, layers with higher z are on top
+    :param blend_mode: How the layer is combined with the layers below, see
+        BlendMode
+    :param alpha: Opacity of the layer with the "alpha" blend mode, from 0 to 1
+    :param static: Whether the objects of the layer never change
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        objects: t.Optional[t.List[DrawableObject]] = None,
+        z: int = 0,
+        blend_mode: BlendMode = "replace",
+        alpha: float = 1.0,
+        static: bool = False,
+    ):
+        self.objects = objects or []
+        self.width = width
+        self.height = height
+        self.z = z
+        self.blend_mode = blend_mode
+        self.alpha = alpha
+        self.static = static
+
+        # Objects drawn together, kept up to date with the objects
+        self.frame = np.zeros((height, width), dtype=np.uint8)
+        # Pixels within the bounds of the objects, the rest is transparent
+        self.coverage = np.zeros((height, width), dtype=bool)
+        self._covers_all = False
+        # Objects are drawn onto this buffer when redrawing a region
+        self._scratch = np.zeros((height, width), dtype=np.uint8)
+        # Drawn objects with their versions and clipped bounds when drawn, None if
+        # not looked up yet
+        self._drawn: t.List[DrawableObject] = []
+        self._versions: t.List[int] = []
+        self._bounds: t.List[t.Optional[Bounds]] = []
+        self._invalidated = True
+
+    def add(self, obj: DrawableObject):
+        """
+        Add a single DrawableObject to the layer.
+        :param obj: An instance of DrawableObject
+        """
+        self.objects.append(obj)
+
+    def remove(self, obj: DrawableObject):
+        """
+        Remove a single DrawableObject from the layer.
+        :param obj: An instance of DrawableObject
+        """
+        self.objects.remove(obj)
+
+    def update(self):
+        """
+        Call the update function of DrawableObject in the layer, unless it is
+        static.
+        """
+        if self.static:
+            return
+        for obj in self.objects:
+            # Skip objects which do not update at all
+            if type(obj).update is not DrawableObject.update:
+                obj.update()
+
+    def invalidate(self):
+        """
+        Forces the whole layer to be drawn again on the next render.
+        """
+        self._invalidated = True
+
+    def composite(self, track_coverage: bool = True) -> t.List[Bounds]:
+        """
+        Brings the frame of the layer up to date with the objects, redrawing the
+        regions that changed. Static layers are only drawn if invalidated.
+
+        When many objects changed, the whole layer is redrawn at once instead, and
+        the bounds of the changed objects are only looked up when the coverage is
+        tracked or the objects are redrawn by regions later.
+        :param track_coverage: Keep `coverage` up to date, otherwise the layer
+            covers everything, e.g. when there is nothing below it. Call
+            `invalidate` before tracking it again.
+        :returns: The redrawn regions
+        """
+        if self.static and not self._invalidated:
+            return []
+
+        regions = []
+        full = self._invalidated
+        self._invalidated = False
+        whole = (0, 0, self.width, self.height)
+        objects = self.objects
+        versions = [obj.version for obj in objects]
+
+        if objects == self._drawn:
+            drawn_versions = self._versions
+        else:
+            index = {id(obj): i for i, obj in enumerate(self._drawn)}
+            present = {id(obj) for obj in objects}
+            for key, i in index.items():
+                if key not in present:
+                    regions.append(self._bounds[i] or whole)
+            kept = [id(obj) for obj in self._drawn if id(obj) in present]
+            # Objects changing places might change which one is on top
+            full = full or kept != [id(obj) for obj in objects if id(obj) in index]
+            positions = [index.get(id(obj)) for obj in objects]
+            drawn_versions = [
+                None if i is None else self._versions[i] for i in positions
+            ]
+            self._bounds = [None if i is None else self._bounds[i] for i in positions]
+            self._drawn = list(objects)
+
+        changed = [
+            i
+            for i, (version, drawn) in enumerate(zip(versions, drawn_versions))
+            if version != drawn
+        ]
+        # Each changed object dirties the regions of its old and new bounds, and
+        # redrawing regions only pays off when most objects are left as they are
+        full = (
+            full
+            or 2 * len(changed) > _MAX_REGIONS
+            or 2 * len(changed) >= len(objects)
+        )
+
+        bounds = self._bounds
+        for i in changed:
+            if drawn_versions[i] is not None:
+                regions.append(bounds[i] or whole)
+            if full:
+                bounds[i] = None
+            else:
+                bounds[i] = self._clip(objects[i].get_bounds())
+                regions.append(bounds[i])
+        self._versions = versions
+
+        regions = [whole] if full else _merge_regions(regions, whole)
+        if not regions:
+            return regions
+
+        if regions[0] == whole and not track_coverage:
+            self.frame.fill(0)
+            for obj in objects:
+                obj.draw(canvas=self.frame)
+            if not self._covers_all:
+                self.coverage.fill(True)
+                self._covers_all = True
+            return regions
+
+        for i, obj in enumerate(objects):
+            if bounds[i] is None:
+                bounds[i] = self._clip(obj.get_bounds())
+        entries = list(zip(objects, bounds))
+
+        self._covers_all = False
+        if regions[0] == whole:
+            self._scratch.fill(0)
+            self.coverage.fill(False)
+            for obj, (x0, y0, x1, y1) in entries:
+                obj.draw(canvas=self._scratch)
+                self.coverage[y0:y1, x0:x1] = True
+            self.frame[...] = self._scratch
+            return regions
+
+        for region in regions:
+            x0, y0, x1, y1 = region
+            # Objects may draw outside of the region onto the scratch buffer, but
+            # only the region is copied to the frame
+            self._scratch[y0:y1, x0:x1] = 0
+            self.coverage[y0:y1, x0:x1] = False
+            for obj, (bx0, by0, bx1, by1) in entries:
+                if bx0 < x1 and x0 < bx1 and by0 < y1 and y0 < by1:
+                    obj.draw(canvas=self._scratch)
+                    self.coverage[
+                        max(y0, by0):min(y1, by1), max(x0, bx0):min(x1, bx1)
+                    ] = True
+            self.frame[y0:y1, x0:x1] = self._scratch[y0:y1, x0:x1]
+        return regions
+
+    def blend_onto(self, base: np.ndarray, region: Bounds):
+        """
+        Blends a region of the layer onto the layers below, within its coverage.
+        :param base: The pixels below the region, modified in-place
+        :param region: The region of the layer
+        """
+        x0, y0, x1, y1 = region
+        pixels = self.frame[y0:y1, x0:x1]
+        if self._covers_all:
+            blend(base, pixels, self.blend_mode, self.alpha)
+            return
+        if self.blend_mode != "replace":
+            # The scratch buffer is not needed between composites
+            blended = self._scratch[:y1 - y0, :x1 - x0]
+            blended[...] = base
+            blend(blended, pixels, self.blend_mode, self.alpha)
+            pixels = blended
+        np.copyto(base, pixels, where=self.coverage[y0:y1, x0:x1])
+
+    def _clip(self, bounds: t.Optional[Bounds]) -> Bounds:
+        """
+        Clips the bounds of an object to the layer.
+        :param bounds: The bounds, None for the whole layer
+        :returns: The clipped bounds, possibly empty
+        """
+        if bounds is None:
+            return 0, 0, self.width, self.height
+        x0, y0, x1, y1 = bounds
+        return (
+            min(max(x0, 0), self.width),
+            min(max(y0, 0), self.height),
+            min(max(x1, 0), self.width),
+            min(max(y1, 0), self.height),
+        )
 
 
 class Canvas:
@@ -22,6 +261,17 @@ class Canvas:
     coordinated by the canvas through a single update call, and the resulting
     image pixels can then be fetched from the Canvas object.
 
+    Objects are organized in layers, see Layer. Objects given to the canvas
+    directly belong to its bottom layer at z 0. The bottom-most static layers are
+    flattened into a single cached image, so only the layers above them are
+    blended, and only in the regions that changed.
+
+    Pixels are uint8 brightness values [0-255] in (height, width) order. The
+    canvas owns two pixel buffers and renders into them in turns, so rendering
+    allocates no memory, and the previously rendered frame stays intact while the
+    next one is drawn. After rendering, `changed` tells whether any pixels may
+    differ from the previous frame.
+
     :param width: The pixel width of the canvas
     :param height: The pixel height of the canvas
     :param objects: Optional initial list of DrawableObject
@@ -33,9 +283,31 @@ class Canvas:
         height: int = 16,
         objects: t.Optional[t.List[DrawableObject]] = None,
     ):
-        self.objects = objects or []
         self.width = width
         self.height = height
+        self.layers = [Layer(width=width, height=height, objects=objects)]
+        self.changed = False
+        self._buffers = [np.zeros((height, width), dtype=np.uint8) for _ in range(2)]
+        self._current = 0
+
+        # Regions each buffer is missing, copied from the composited frame
+        self._stale: t.List[t.List[Bounds]] = [[], []]
+        # Composited frame, kept up to date with the layers
+        self._frame = np.zeros((height, width), dtype=np.uint8)
+        # Flattened bottom-most static layers
+        self._base = np.zeros((height, width), dtype=np.uint8)
+        self._layer_state: t.List[tuple] = []
+
+    @property
+    def objects(self) -> t.List[DrawableObject]:
+        """
+        Objects of the bottom layer.
+        """
+        return self.layers[0].objects
+
+    @objects.setter
+    def objects(self, objects: t.List[DrawableObject]):
+        self.layers[0].objects = objects
 
     def add(self, obj: DrawableObject):
         """
@@ -51,22 +323,178 @@ class Canvas:
         """
         self.objects.remove(obj)
 
+    def add_layer(
+        self,
+        objects: t.Optional[t.List[DrawableObject]] = None,
+        z: int = 0,
+        blend_mode: BlendMode = "replace",
+        alpha: float = 1.0,
+        static: bool = False,
+    ) -> Layer:
+        """
+        Add a layer to the canvas. Layers of the same z are drawn in the order they
+        were added.
+        :param objects: Optional initial list of DrawableObject
+        :param z: Position of the layer, layers with higher z are on top
+        :param blend_mode: How the layer is combined with the layers below, see
+            BlendMode
+        :param alpha: Opacity of the layer with the "alpha" blend mode, from 0 to 1
+        :param static: Whether the objects of the layer never change
+        :returns: The new layer
+        """
+        layer = Layer(
+            width=self.width,
+            height=self.height,
+            objects=objects,
+            z=z,
+            blend_mode=blend_mode,
+            alpha=alpha,
+            static=static,
+        )
+        self.layers.append(layer)
+        return layer
+
+    def remove_layer(self, layer: Layer):
+        """
+        Remove a layer from the canvas.
+        :param layer: The layer
+        """
+        self.layers.remove(layer)
+
     def update(self):
         """
         Call the update function of DrawableObject in the canvas.
         """
-        for obj in self.objects:
-            obj.update()
+        for layer in self.layers:
+            layer.update()
 
     def render(self) -> np.ndarray:
         """
         Render out the pixels of each DrawableObject on the canvas and return
-        the resulting image pixel array.
-        :returns: The rendered image array
+        the resulting image pixel array. The array is one of the canvas buffers,
+        valid until the next but one call.
+        :returns: The rendered image array of shape (height, width)
         """
-        canvas = np.zeros((self.width, self.height))
+        self._composite()
+        self._current ^= 1
+        buffer = self._buffers[self._current]
+        for x0, y0, x1, y1 in self._stale[self._current]:
+            buffer[y0:y1, x0:x1] = self._frame[y0:y1, x0:x1]
+        self._stale[self._current].clear()
+        return buffer
 
-        for obj in self.objects:
-            obj.draw(canvas=canvas)
+    def render_into(self, out: np.ndarray) -> np.ndarray:
+        """
+        Render out the pixels of each DrawableObject on the canvas into a given
+        array, overwriting its contents.
+        :param out: The array to render into, of shape (height, width)
+        :returns: The same array
+        :raises ValueError: If shape of the array is different from the canvas
+        """
+        if out.shape != (self.height, self.width):
+            raise ValueError(
+                f"Incorrect dimensions of the output array - {out.shape}. "
+                f"Must be {(self.height, self.width)}."
+            )
+
+        self._composite()
+        np.copyto(out, self._frame)
+        return out
+
+    def invalidate(self):
+        """
+        Forces the whole canvas to be drawn again on the next render.
+        """
+        for layer in self.layers:
+            layer.invalidate()
+
+    def _composite(self):
+        """
+        Brings the composited frame up to date with the layers, blending the
+        regions that changed.
+        """
+        layers = sorted(self.layers, key=lambda layer: layer.z)
+        state = [
+            (id(layer), layer.z, layer.blend_mode, layer.alpha, layer.static)
+            for layer in layers
+        ]
+        full = state != self._layer_state
+        self._layer_state = state
+        if full:
+            # The coverage of the lowest layer is only tracked with layers below it
+            for layer in layers:
+                layer.invalidate()
+
+        base_count = 0
+        while base_count < len(layers) and layers[base_count].static:
+            base_count += 1
+
+        regions = []
+        for i, layer in enumerate(layers):
+            layer_regions = layer.composite(track_coverage=i > 0 or base_count > 0)
+            full = full or (i < base_count and bool(layer_regions))
+            regions.extend(layer_regions)
+
+        if full:
+            self._base.fill(0)
+            for layer in layers[:base_count]:
+                layer.blend_onto(self._base, (0, 0, self.width, self.height))
+            regions = [(0, 0, self.width, self.height)]
+
+        regions = _merge_regions(regions, (0, 0, self.width, self.height))
+        self.changed = bool(regions)
+
+        for region in regions:
+            x0, y0, x1, y1 = region
+            view = self._frame[y0:y1, x0:x1]
+            view[...] = self._base[y0:y1, x0:x1]
+            for layer in layers[base_count:]:
+                layer.blend_onto(view, region)
+            for stale in self._stale:
+                stale.append(region)
+
+
+def _overlap(a: Bounds, b: Bounds) -> bool:
+    """
+    Checks if two rectangles share any pixels.
+    """
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _merge_regions(regions: t.List[Bounds], whole: Bounds) -> t.List[Bounds]:
+    """
+    Drops empty regions and merges overlapping ones into their bounding boxes, in
+    one pass over the regions sorted by their left edge. Too many or too large
+    regions are replaced by the whole area.
+    :param regions: The regions
+    :param whole: The whole area, containing all the regions
+    :returns: Regions covering all given ones. Boxes grown by merging may overlap
+        others, which only costs drawing some pixels twice.
+    """
+    if whole in regions:
+        return [whole]
+    regions = [
+        region for region in regions if region[0] < region[2] and region[1] < region[3]
+    ]
+    area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+    if (
+        len(regions) > _MAX_REGIONS
+        or area > _MAX_AREA * (whole[2] - whole[0]) * (whole[3] - whole[1])
+    ):
+        return [whole] if regions else []
 
-        return canvas
+    regions.sort()
+    merged: t.List[Bounds] = []
+    for region in regions:
+        for i, other in enumerate(merged):
+            if _overlap(other, region):
+                merged[i] = (
+                    other[0],
+                    min(region[1], other[1]),
+                    max(region[2], other[2]),
+                    max(region[3], other[3]),
+                )
+                break
+        else:
+            merged.append(region)
+    return merged
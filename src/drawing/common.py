@@ -2,15 +2,58 @@
 Module containing common drawing functionality.
 """
 
+import typing as t
+
 import numpy as np
 
+# Left, top, right and bottom edge of a rectangle of pixels, the right and bottom
+# edges are exclusive
+Bounds = t.Tuple[int, int, int, int]
+
+_MISSING = object()
+
+# How pixels are combined with the pixels below them - "replace" overwrites them,
+# "max" keeps the brighter, "add" sums them (saturating at 255), "alpha" mixes
+# them by opacity and "xor" inverts the bits below
+BlendMode = t.Literal["replace", "max", "add", "alpha", "xor"]
+
 
 class DrawableObject:
     """
     This class is an abstraction of a drawable object. It exists only to
     provide a common shared base for all drawable objects for the Canvas.
+
+    Objects track their changes in `version`, which is increased whenever a public
+    attribute is assigned. Objects changing in other ways, e.g. by modifying an
+    array in-place, must call `mark_dirty` so the Canvas draws them again.
     """
 
+    version: int = 0
+
+    def __setattr__(self, name: str, value: t.Any):
+        if (
+            not name.startswith("_")
+            and name != "version"
+            and self.__dict__.get(name, _MISSING) is not value
+        ):
+            object.__setattr__(self, "version", self.version + 1)
+        object.__setattr__(self, name, value)
+
+    def mark_dirty(self):
+        """
+        Marks the object as changed, so it is drawn again.
+        """
+        self.version += 1
+
+    def get_bounds(self) -> t.Optional[Bounds]:
+        """
+        Method used to get the area of the canvas the object draws to. Objects
+        drawing outside of their bounds are not drawn correctly by the Canvas.
+        :returns: The bounds in canvas coordinates, or None if the object may draw
+            anywhere on the canvas
+        """
+        return None
+
     def update(self):
         """
         Method used to update the object and change its values in some way.
@@ -26,12 +69,52 @@ class DrawableObject:
         pass
 
 
+def blend(
+    base: np.ndarray,
+    array: np.ndarray,
+    mode: BlendMode = "replace",
+    alpha: float = 1.0,
+):
+    """
+    Combine an array of pixels with the base array of the same shape.
+    NOTE: This will modify the base array in-place.
+    :param base: The base numpy array
+    :param array: The array to be combined with the base
+    :param mode: How the pixels are combined, see BlendMode
+    :param alpha: Opacity of the array with the "alpha" mode, from 0 to 1
+    :raises ValueError: If unsupported `mode` value is passed
+    """
+    match mode:
+        case "replace":
+            base[...] = array
+        case "max":
+            np.maximum(base, array, out=base, casting="unsafe")
+        case "add":
+            if base.dtype == np.uint8 and array.dtype == np.uint8:
+                # min(a + b, 255) computed without overflowing 8 bits
+                np.minimum(base, 255 - array, out=base)
+                base += array
+            else:
+                np.minimum(base + array, 255, out=base, casting="unsafe")
+        case "alpha":
+            mixed = base * (1 - alpha) + array * alpha
+            if np.issubdtype(base.dtype, np.integer):
+                np.rint(mixed, out=mixed)
+            base[...] = mixed
+        case "xor":
+            base[...] = base.astype(np.uint8) ^ array.astype(np.uint8)
+        case _:
+            raise ValueError(f"Incorrect `mode` given ({mode}).")
+
+
 def insert(
     base: np.ndarray,
     array: np.ndarray,
     x: float,
     y: float,
     inplace: bool = True,
+    mode: BlendMode = "replace",
+    alpha: float = 1.0,
 ) -> np.ndarray:
     """
     Insert one numpy array into a base array, overlapping them.
@@ -40,6 +123,8 @@ def insert(
     :param x: The x offset where the array will be inserted
     :param y: The y offset where the array will be inserted
     :param inplace: Modify the base array in-place, otherwise return a new copy
+    :param mode: How the overlapping pixels are combined, see BlendMode
+    :param alpha: Opacity of the array with the "alpha" mode, from 0 to 1
     :returns: The modified base array
     """
 
@@ -112,6 +197,11 @@ def insert(
 
     array_overlap = array[array_start_row:array_end_row, array_start_col:array_end_col]
 
-    base[base_start_row:base_end_row, base_start_col:base_end_col] = array_overlap
+    blend(
+        base=base[base_start_row:base_end_row, base_start_col:base_end_col],
+        array=array_overlap,
+        mode=mode,
+        alpha=alpha,
+    )
 
     return base
@@ -0,0 +1,417 @@
+"""
+Module containing procedural animated effects, e.g. for backgrounds.
+"""
+
+import functools
+import time
+import typing as t
+
+import numpy as np
+
+from src.drawing.common import BlendMode, Bounds, DrawableObject, insert
+
+
+class Effect:
+    """
+    Base class of procedural effects. An effect renders whole blocks of frames at
+    once, most of them as a single vectorized function of a (t, y, x) grid.
+
+    Subclasses implement `field`, or override `render` for effects which are not
+    a function of time, e.g. simulations.
+    """
+
+    # Seconds after which the effect repeats itself, if it does
+    period: t.Optional[float] = None
+    # Most frames rendered at once, e.g. 1 for simulations advancing a step per call
+    max_block: t.Optional[int] = None
+
+    def render(
+        self,
+        times: np.ndarray,
+        y: np.ndarray,
+        x: np.ndarray,
+        out: np.ndarray,
+    ):
+        """
+        Renders frames of the effect.
+        :param times: Times of the frames in seconds, of shape (N,)
+        :param y: Row coordinates of the pixels, of shape (rows,)
+        :param x: Column coordinates of the pixels, of shape (columns,)
+        :param out: Array of shape (N, rows, columns) the uint8 frames are written to
+        """
+        values = self.field(times[:, None, None], y[None, :, None], x[None, None, :])
+        values = np.broadcast_to(values, out.shape) * np.float32(255)
+        np.clip(values, 0, 255, out=values)
+        out[...] = values
+
+    def field(self, t: np.ndarray, y: np.ndarray, x: np.ndarray) -> np.ndarray:
+        """
+        Brightness of the effect as a function of time and position.
+        :param t: Times in seconds, of shape (N, 1, 1)
+        :param y: Row coordinates, of shape (1, rows, 1)
+        :param x: Column coordinates, of shape (1, 1, columns)
+        :returns: Brightness [0-1], broadcastable to (N, rows, columns)
+        """
+        raise NotImplementedError
+
+
+class Plasma(Effect):
+    """
+    Smoothly flowing interference of sine waves.
+    :param scale: Size of the waves in pixels
+    :param period: Seconds after which the effect repeats itself
+    """
+
+    def __init__(self, scale: float = 3.0, period: float = 4.0):
+        self.scale = scale
+        self.period = period
+
+    def field(self, t: np.ndarray, y: np.ndarray, x: np.ndarray) -> np.ndarray:
+        # Whole multiples of the base frequency keep the effect periodic
+        phase = (2 * np.pi / self.period) * t
+        x = x / self.scale
+        y = y / self.scale
+        value = (
+            np.sin(x + phase)
+            + np.sin(y + 2 * phase)
+            + np.sin((x + y) / 2 - phase)
+            + np.sin(np.sqrt(x * x + y * y) + 3 * phase)
+        )
+        return value * 0.125 + 0.5
+
+
+class Ripples(Effect):
+    """
+    Circular waves spreading from a point, fading with distance.
+    :param center: Row and column of the center, defaults to the middle of the
+        effect
+    :param wavelength: Distance between the waves in pixels
+    :param period: Seconds for a wave to travel one wavelength
+    :param decay: How fast the waves fade with distance, per pixel
+    """
+
+    def __init__(
+        self,
+        center: t.Optional[t.Tuple[float, float]] = None,
+        wavelength: float = 4.0,
+        period: float = 1.0,
+        decay: float = 0.1,
+    ):
+        self.center = center
+        self.wavelength = wavelength
+        self.period = period
+        self.decay = decay
+
+    def field(self, t: np.ndarray, y: np.ndarray, x: np.ndarray) -> np.ndarray:
+        if self.center is None:
+            center_y, center_x = (y.size - 1) / 2, (x.size - 1) / 2
+        else:
+            center_y, center_x = self.center
+        distance = np.sqrt((y - center_y) ** 2 + (x - center_x) ** 2)
+        wave = np.cos(2 * np.pi * (distance / self.wavelength - t / self.period))
+        return (wave * 0.5 + 0.5) * np.exp(-self.decay * distance)
+
+
+class Noise(Effect):
+    """
+    Smooth random noise slowly changing over time.
+    :param scale: Size of the features in pixels
+    :param speed: How fast the noise changes, in features per second
+    :param seed: Seed of the noise
+    """
+
+    def __init__(self, scale: float = 4.0, speed: float = 0.5, seed: int = 0):
+        self.scale = scale
+        self.speed = speed
+        self.seed = seed
+
+    def field(self, t: np.ndarray, y: np.ndarray, x: np.ndarray) -> np.ndarray:
+        return value_noise(x / self.scale, y / self.scale, t * self.speed, self.seed)
+
+
+class Fire(Effect):
+    """
+    Flames rising from the bottom edge, made of noise moving upwards.
+    :param scale: Size of the flames in pixels
+    :param speed: How fast the flames rise, in pixels per second
+    :param height: Fraction of the height reached by the flames
+    :param seed: Seed of the noise
+    """
+
+    def __init__(
+        self,
+        scale: float = 3.0,
+        speed: float = 8.0,
+        height: float = 0.8,
+        seed: int = 0,
+    ):
+        self.scale = scale
+        self.speed = speed
+        self.height = height
+        self.seed = seed
+
+    def field(self, t: np.ndarray, y: np.ndarray, x: np.ndarray) -> np.ndarray:
+        noise = value_noise(
+            x / self.scale,
+            (y + t * self.speed) / self.scale,
+            t * 0.5,
+            self.seed,
+        )
+        # Hottest at the bottom, cooling off towards the top of the flames
+        heat = 1 - (y.size - 1 - y) / max(self.height * y.size, 1)
+        return np.clip(noise * 0.6 + heat, 0, 1) ** 2 * np.clip(heat * 2, 0, 1)
+
+
+class Life(Effect):
+    """
+    Conway's Game of Life, advancing one generation per frame. It is rendered one
+    frame at a time, so the board is not simulated ahead of the shown frame, and
+    frames skipped when falling behind cost no generations. Each generation is
+    computed for the whole board at once. The board is seeded randomly, and seeded
+    again when all cells die.
+    :param density: Fraction of cells alive after seeding
+    :param wrap: Connect the opposite edges of the board
+    :param seed: Seed of the random number generator
+    """
+
+    max_block = 1
+
+    def __init__(
+        self,
+        density: float = 0.35,
+        wrap: bool = True,
+        seed: t.Optional[int] = None,
+    ):
+        self.density = density
+        self.wrap = wrap
+        self._rng = np.random.default_rng(seed)
+        self._cells: t.Optional[np.ndarray] = None
+
+    def render(
+        self,
+        times: np.ndarray,
+        y: np.ndarray,
+        x: np.ndarray,
+        out: np.ndarray,
+    ):
+        if self._cells is None or self._cells.shape != out.shape[1:]:
+            self._cells = self._seed(out.shape[1:])
+
+        for frame in out:
+            np.multiply(self._cells, np.uint8(255), out=frame)
+            self._cells = self._step(self._cells)
+            if not self._cells.any():
+                self._cells = self._seed(out.shape[1:])
+
+    def _seed(self, shape: t.Tuple[int, int]) -> np.ndarray:
+        """
+        Creates a random board.
+        :param shape: Number of rows and columns
+        :returns: Boolean array of live cells
+        """
+        return self._rng.random(shape) < self.density
+
+    def _step(self, cells: np.ndarray) -> np.ndarray:
+        """
+        Computes the next generation.
+        :param cells: Boolean array of live cells
+        :returns: Boolean array of live cells of the next generation
+        """
+        if self.wrap:
+            padded = np.pad(cells, 1, mode="wrap").astype(np.uint8)
+        else:
+            padded = np.pad(cells, 1).astype(np.uint8)
+
+        rows, cols = cells.shape
+        neighbors = sum(
+            padded[dy:dy + rows, dx:dx + cols]
+            for dy in range(3)
+            for dx in range(3)
+            if dy != 1 or dx != 1
+        )
+        return (neighbors == 3) | (cells & (neighbors == 2))
+
+
+@functools.lru_cache(maxsize=16)
+def _permutation(seed: int) -> np.ndarray:
+    """
+    Random permutation table used to hash the lattice points of the noise.
+    :param seed: Seed of the noise
+    :returns: Array of 512 values, the permutation of 0-255 repeated twice
+    """
+    permutation = np.random.default_rng(seed).permutation(256).astype(np.intp)
+    return np.concatenate([permutation, permutation])
+
+
+def value_noise(
+    x: np.ndarray,
+    y: np.ndarray,
+    z: np.ndarray,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Smooth 3D value noise, repeating every 256 units. Arguments are broadcast
+    together, so e.g. a (N, 1, 1) z with a (1, rows, 1) y and a (1, 1, columns) x
+    give a block of N frames.
+    :param x: First coordinates
+    :param y: Second coordinates
+    :param z: Third coordinates
+    :param seed: Seed of the noise
+    :returns: Values [0-1]
+    """
+    permutation = _permutation(seed)
+
+    corners = []
+    weights = []
+    for coordinate in (x, y, z):
+        floor = np.floor(coordinate)
+        fraction = coordinate - floor
+        cell = floor.astype(np.intp) & 255
+        corners.append((cell, (cell + 1) & 255))
+        weights.append(fraction * fraction * (3 - 2 * fraction))
+
+    (x0, x1), (y0, y1), (z0, z1) = corners
+    wx, wy, wz = weights
+
+    # Hash each lattice corner, the first steps only on the smaller arrays
+    hashed_x = (permutation[x0], permutation[x1])
+    values = []
+    for hx in hashed_x:
+        for yi in (y0, y1):
+            hxy = permutation[hx + yi]
+            values.append((permutation[hxy + z0], permutation[hxy + z1]))
+
+    def mix(a, b, weight):
+        return a + (b - a) * weight
+
+    (v000, v001), (v010, v011), (v100, v101), (v110, v111) = values
+    value = mix(
+        mix(mix(v000, v001, wz), mix(v010, v011, wz), wy),
+        mix(mix(v100, v101, wz), mix(v110, v111, wz), wy),
+        wx,
+    )
+    return value / 255
+
+
+class EffectObject(DrawableObject):
+    """
+    Shows an effect, sampled at a fixed frame rate and looked up by the time
+    elapsed since the start. Frames are rendered ahead in blocks into a reused
+    buffer, so the cost of each vectorized call is shared by a whole block of
+    frames. Periodic effects are rendered only for their first cycle, which is
+    then cached and replayed.
+    :param effect: The effect
+    :param width: The pixel width of the effect
+    :param height: The pixel height of the effect
+    :param x: The top left x position of the effect
+    :param y: The top left y position of the effect
+    :param fps: Number of frames per second the effect is sampled at
+    :param block: Number of frames rendered at once, at most the `max_block` of
+        the effect
+    :param max_cached_frames: Maximum number of frames of a cached cycle, longer
+        periodic effects are rendered block by block like other effects
+    :param clock: Function returning the current time in seconds, defaults to
+        `time.perf_counter`
+    :param blend_mode: How the effect is combined with the pixels below, see
+        BlendMode
+    """
+
+    def __init__(
+        self,
+        effect: Effect,
+        width: int = 16,
+        height: int = 16,
+        x: int = 0,
+        y: int = 0,
+        fps: float = 30.0,
+        block: int = 32,
+        max_cached_frames: int = 1024,
+        clock: t.Callable[[], float] = time.perf_counter,
+        blend_mode: BlendMode = "replace",
+    ):
+        self.effect = effect
+        self.width = width
+        self.height = height
+        self.x = x
+        self.y = y
+        self.fps = fps
+        self.block = min(block, effect.max_block or block)
+        self.blend_mode = blend_mode
+        self.frame = 0
+
+        self._clock = clock
+        self._start = clock()
+        self._y = np.arange(height, dtype=np.float32)
+        self._x = np.arange(width, dtype=np.float32)
+
+        self._cycle = 0
+        if effect.period is not None:
+            cycle = max(round(effect.period * fps), 1)
+            if cycle <= max_cached_frames:
+                self._cycle = cycle
+
+        # Frames of the whole cycle for periodic effects, otherwise the block of
+        # frames from `_ring_start` on
+        capacity = self._cycle or self.block
+        self._frames = np.zeros((capacity, height, width), dtype=np.uint8)
+        self._rendered = 0
+        self._ring_start = 0
+        self._render_block(0)
+
+    def update(self):
+        index = int((self._clock() - self._start) * self.fps)
+        if index != self.frame:
+            self.frame = index
+
+    def get_bounds(self) -> Bounds:
+        x = round(self.x)
+        y = round(self.y)
+        return x, y, x + self.width, y + self.height
+
+    def draw(self, canvas: np.ndarray):
+        insert(
+            base=canvas,
+            array=self._lookup(self.frame),
+            x=self.x,
+            y=self.y,
+            inplace=True,
+            mode=self.blend_mode,
+        )
+
+    def _lookup(self, index: int) -> np.ndarray:
+        """
+        Gets a frame of the effect, rendering the block it is in if needed.
+        :param index: Index of the frame since the start
+        :returns: The frame
+        """
+        if self._cycle:
+            index %= self._cycle
+            while index >= self._rendered:
+                self._render_block(self._rendered)
+            return self._frames[index]
+
+        if not self._ring_start <= index < self._ring_start + self.block:
+            # Continue with the next block, unless so far behind that it's skipped
+            start = self._ring_start + self.block
+            self._render_block(start if start <= index < start + self.block else index)
+        return self._frames[index - self._ring_start]
+
+    def _render_block(self, start: int):
+        """
+        Renders a block of frames in one call.
+        :param start: Index of the first frame of the block
+        """
+        if self._cycle:
+            count = min(self.block, self._cycle - start)
+            # Sampled so that the cycle joins up exactly, the times stay small
+            # enough for single precision
+            period = self.effect.period
+            times = np.arange(start, start + count, dtype=np.float32)
+            times *= np.float32(period / self._cycle)
+            out = self._frames[start:start + count]
+            self._rendered = start + count
+        else:
+            times = np.arange(start, start + self.block) / self.fps
+            out = self._frames
+            self._ring_start = start
+        self.effect.render(times, self._y, self._x, out)
@@ -0,0 +1,347 @@
+"""
+Module containing particle system drawing functionality.
+"""
+
+import time
+import typing as t
+
+import numpy as np
+
+from src.drawing.common import BlendMode, Bounds, DrawableObject, blend
+
+# A fixed value, or a (low, high) range particles get uniformly random values from
+Spread = float | t.Tuple[float, float]
+
+# Rows of the particle state array
+_X, _Y, _VX, _VY, _LIFE, _MAX_LIFE, _BRIGHTNESS = range(7)
+
+
+class ParticleSystem(DrawableObject):
+    """
+    Many small points moving on their own, e.g. rain, snow or sparks. Particles
+    are stored as arrays of their properties (structure of arrays), so all of them
+    are moved in a few vectorized steps per update and drawn by accumulating their
+    brightness per pixel, saturating at 255.
+
+    New particles are emitted continuously at `rate`, or in bursts by `emit`.
+    Their properties are drawn from the spawn spreads. Particles die when their
+    life runs out or when they leave the area of the system.
+
+    :param width: The pixel width of the area of the system, from the left edge
+        of the canvas
+    :param height: The pixel height of the area of the system, from the top edge
+        of the canvas
+    :param capacity: Maximum number of live particles, further ones are not emitted
+    :param rate: Number of particles emitted per second
+    :param spawn_x: Initial x position of the particles, defaults to anywhere
+        across the width
+    :param spawn_y: Initial y position of the particles
+    :param velocity_x: Initial x velocity of the particles in pixels per second
+    :param velocity_y: Initial y velocity of the particles in pixels per second
+    :param life: Lifetime of the particles in seconds
+    :param brightness: Initial brightness of the particles [0-255]
+    :param gravity: Acceleration of all particles in pixels per second squared,
+        as (x, y)
+    :param drag: Fraction of the velocity lost per second
+    :param jitter: Standard deviation of random velocity changes per second, e.g.
+        for the drift of snowflakes
+    :param fade: Dim the particles as their life runs out
+    :param dt: Seconds simulated per update, defaults to the time elapsed since
+        the previous update (at most 0.1)
+    :param clock: Function returning the current time in seconds, defaults to
+        `time.perf_counter`
+    :param seed: Seed of the random number generator
+    :param blend_mode: How the particles are combined with the pixels below, see
+        BlendMode
+    """
+
+    def __init__(
+        self,
+        width: int = 16,
+        height: int = 16,
+        capacity: int = 10000,
+        rate: float = 0.0,
+        spawn_x: t.Optional[Spread] = None,
+        spawn_y: Spread = 0.0,
+        velocity_x: Spread = 0.0,
+        velocity_y: Spread = 0.0,
+        life: Spread = 1.0,
+        brightness: Spread = 255.0,
+        gravity: t.Tuple[float, float] = (0.0, 0.0),
+        drag: float = 0.0,
+        jitter: float = 0.0,
+        fade: bool = False,
+        dt: t.Optional[float] = None,
+        clock: t.Callable[[], float] = time.perf_counter,
+        seed: t.Optional[int] = None,
+        blend_mode: BlendMode = "add",
+    ):
+        self.width = width
+        self.height = height
+        self.capacity = capacity
+        self.rate = rate
+        self.spawn_x = (0.0, float(width)) if spawn_x is None else spawn_x
+        self.spawn_y = spawn_y
+        self.velocity_x = velocity_x
+        self.velocity_y = velocity_y
+        self.life = life
+        self.brightness = brightness
+        self.gravity = gravity
+        self.drag = drag
+        self.jitter = jitter
+        self.fade = fade
+        self.dt = dt
+        self.blend_mode = blend_mode
+
+        self._clock = clock
+        self._last_time: t.Optional[float] = None
+        self._rng = np.random.default_rng(seed)
+        self._pending = 0.0
+
+        # Particles are kept at the start of each row, dead ones (with no life
+        # left) are removed once there are enough of them
+        self._state = np.zeros((7, capacity), dtype=np.float32)
+        self._count = 0
+        self._alive = 0
+        self._image = np.zeros((height, width), dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return self._alive
+
+    def emit(
+        self,
+        count: int,
+        x: t.Optional[Spread] = None,
+        y: t.Optional[Spread] = None,
+        velocity_x: t.Optional[Spread] = None,
+        velocity_y: t.Optional[Spread] = None,
+        life: t.Optional[Spread] = None,
+        brightness: t.Optional[Spread] = None,
+    ) -> int:
+        """
+        Adds particles, with properties drawn from the given spreads, or from the
+        spawn spreads of the system.
+        :param count: Number of particles
+        :param x: Initial x position
+        :param y: Initial y position
+        :param velocity_x: Initial x velocity in pixels per second
+        :param velocity_y: Initial y velocity in pixels per second
+        :param life: Lifetime in seconds
+        :param brightness: Initial brightness [0-255]
+        :returns: Number of particles added, limited by the capacity
+        """
+        if count > self.capacity - self._count:
+            self._compact()
+        count = min(count, self.capacity - self._count)
+        if count <= 0:
+            return 0
+
+        new = self._state[:, self._count:self._count + count]
+        spreads = {
+            _X: self.spawn_x if x is None else x,
+            _Y: self.spawn_y if y is None else y,
+            _VX: self.velocity_x if velocity_x is None else velocity_x,
+            _VY: self.velocity_y if velocity_y is None else velocity_y,
+            _LIFE: self.life if life is None else life,
+            _BRIGHTNESS: self.brightness if brightness is None else brightness,
+        }
+        for row, spread in spreads.items():
+            if isinstance(spread, tuple):
+                new[row] = self._rng.uniform(spread[0], spread[1], count)
+            else:
+                new[row] = spread
+        new[_MAX_LIFE] = new[_LIFE]
+
+        self._count += count
+        self._alive += count
+        self.mark_dirty()
+        return count
+
+    def clear(self):
+        """
+        Removes all particles.
+        """
+        self._count = 0
+        self._alive = 0
+        self.mark_dirty()
+
+    def update(self):
+        now = self._clock()
+        if self.dt is not None:
+            dt = self.dt
+        elif self._last_time is None:
+            dt = 0.0
+        else:
+            dt = min(now - self._last_time, 0.1)
+        self._last_time = now
+
+        self._step(dt)
+
+        self._pending += self.rate * dt
+        if self._pending >= 1:
+            emitted = int(self._pending)
+            self._pending -= emitted
+            self.emit(emitted)
+
+    def _step(self, dt: float):
+        """
+        Moves all particles and removes the dead ones.
+        :param dt: Seconds to simulate
+        """
+        if not self._count or not dt:
+            return
+
+        state = self._state[:, :self._count]
+        x, y, vx, vy, life = state[_X], state[_Y], state[_VX], state[_VY], state[_LIFE]
+
+        gravity_x, gravity_y = self.gravity
+        if gravity_x:
+            vx += gravity_x * dt
+        if gravity_y:
+            vy += gravity_y * dt
+        if self.drag:
+            state[_VX:_VY + 1] *= max(1 - self.drag * dt, 0)
+        if self.jitter:
+            # Uniform noise, much faster to generate than normal, scaled to the
+            # same standard deviation
+            noise = self._rng.random((2, self._count), dtype=np.float32)
+            noise -= 0.5
+            noise *= self.jitter * np.sqrt(12 * dt)
+            state[_VX:_VY + 1] += noise
+
+        x += vx * dt
+        y += vy * dt
+        life -= dt
+
+        alive = (life > 0) & (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        # Particles which left the area die as well
+        life *= alive
+        self._alive = int(np.count_nonzero(alive))
+
+        # Removing particles means moving all others, so it's done only once an
+        # eighth of the particles are dead
+        if self._count - self._alive > self._count // 8:
+            self._compact()
+        self.mark_dirty()
+
+    def _compact(self):
+        """
+        Removes the dead particles.
+        """
+        keep = np.flatnonzero(self._state[_LIFE, :self._count] > 0)
+        self._state[:, :len(keep)] = self._state[:, :self._count].take(keep, axis=1)
+        self._count = self._alive = len(keep)
+
+    def get_bounds(self) -> Bounds:
+        return 0, 0, self.width, self.height
+
+    def draw(self, canvas: np.ndarray):
+        image = self._image
+        state = self._state[:, :self._count]
+
+        # Live particles inside of the area, they may be outside before the first
+        # update
+        x, y = state[_X], state[_Y]
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        inside &= state[_LIFE] > 0
+        columns = x.astype(np.intp)
+        rows = y.astype(np.intp)
+
+        weights = state[_BRIGHTNESS]
+        if self.fade:
+            weights = weights * (state[_LIFE] / state[_MAX_LIFE])
+
+        # Sum the brightness of all particles in each pixel
+        pixels = np.bincount(
+            (rows * self.width + columns)[inside],
+            weights=weights[inside],
+            minlength=self.width * self.height,
+        )
+        np.minimum(pixels, 255, out=pixels)
+        image.reshape(-1)[:] = pixels
+
+        height = min(self.height, canvas.shape[0])
+        width = min(self.width, canvas.shape[1])
+        blend(canvas[:height, :width], image[:height, :width], self.blend_mode)
+
+
+def rain(
+    width: int = 16,
+    height: int = 16,
+    rate: float = 40.0,
+    speed: Spread = (15.0, 25.0),
+    **kwargs: t.Any,
+) -> ParticleSystem:
+    """
+    Creates a particle system of raindrops falling from the top edge.
+    :param width: The pixel width of the area
+    :param height: The pixel height of the area
+    :param rate: Number of raindrops per second
+    :param speed: Falling speed in pixels per second
+    :param kwargs: Additional arguments of the ParticleSystem
+    :returns: The particle system
+    """
+    options = dict(
+        spawn_y=0.0,
+        velocity_y=speed,
+        life=float(height),
+        brightness=(80.0, 200.0),
+    )
+    options.update(kwargs)
+    return ParticleSystem(width=width, height=height, rate=rate, **options)
+
+
+def snow(
+    width: int = 16,
+    height: int = 16,
+    rate: float = 8.0,
+    speed: Spread = (1.5, 4.0),
+    **kwargs: t.Any,
+) -> ParticleSystem:
+    """
+    Creates a particle system of snowflakes drifting down from the top edge.
+    :param width: The pixel width of the area
+    :param height: The pixel height of the area
+    :param rate: Number of snowflakes per second
+    :param speed: Falling speed in pixels per second
+    :param kwargs: Additional arguments of the ParticleSystem
+    :returns: The particle system
+    """
+    options = dict(
+        spawn_y=0.0,
+        velocity_x=(-0.5, 0.5),
+        velocity_y=speed,
+        life=float(height),
+        brightness=(150.0, 255.0),
+        drag=0.5,
+        jitter=1.5,
+    )
+    options.update(kwargs)
+    return ParticleSystem(width=width, height=height, rate=rate, **options)
+
+
+def sparks(
+    width: int = 16,
+    height: int = 16,
+    **kwargs: t.Any,
+) -> ParticleSystem:
+    """
+    Creates a particle system of fading sparks falling under gravity. Sparks are
+    not emitted continuously, call `emit` with a position for each burst, e.g.
+    `system.emit(50, x=8, y=8)`.
+    :param width: The pixel width of the area
+    :param height: The pixel height of the area
+    :param kwargs: Additional arguments of the ParticleSystem
+    :returns: The particle system
+    """
+    options = dict(
+        velocity_x=(-12.0, 12.0),
+        velocity_y=(-16.0, 4.0),
+        life=(0.3, 1.2),
+        brightness=255.0,
+        gravity=(0.0, 30.0),
+        drag=0.8,
+        fade=True,
+    )
+    options.update(kwargs)
+    return ParticleSystem(width=width, height=height, **options)
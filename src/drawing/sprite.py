@@ -0,0 +1,266 @@
+"""
+Module containing sprite drawing functionality.
+"""
+
+import functools
+import time
+import typing as t
+from pathlib import Path
+
+import numpy as np
+
+from src.drawing.common import BlendMode, Bounds, DrawableObject, blend
+
+# PIL is imported where needed, as it takes most of the import time
+
+
+class SpriteSheet:
+    """
+    Frames of a sprite, stored together as one contiguous (frames, height, width)
+    uint8 array, with a transparency mask of the same shape. Sheets are immutable,
+    so a single sheet can be shared by any number of sprites.
+    :param frames: Array of shape (frames, height, width), or a single frame of
+        shape (height, width)
+    :param mask: Boolean array of the same shape, True where the frames are
+        opaque. Defaults to the pixels not equal to `transparent`
+    :param transparent: Brightness of the pixels which are transparent when no
+        mask is given, None makes all pixels opaque. Defaults to 0
+    :raises ValueError: If the mask has a different shape than the frames
+    """
+
+    def __init__(
+        self,
+        frames: np.ndarray,
+        mask: t.Optional[np.ndarray] = None,
+        transparent: t.Optional[int] = 0,
+    ):
+        frames = np.asarray(frames)
+        if frames.ndim == 2:
+            frames = frames[None]
+        self.frames = np.ascontiguousarray(frames.clip(0, 255), dtype=np.uint8)
+
+        if mask is None:
+            if transparent is None:
+                mask = np.ones(self.frames.shape, dtype=bool)
+            else:
+                mask = self.frames != transparent
+        mask = np.asarray(mask, dtype=bool)
+        if mask.ndim == 2:
+            mask = mask[None]
+        if mask.shape != self.frames.shape:
+            raise ValueError(
+                f"Incorrect dimensions of the mask - {mask.shape}. "
+                f"Must be {self.frames.shape}."
+            )
+        self.mask = np.ascontiguousarray(mask)
+
+        self.frames.setflags(write=False)
+        self.mask.setflags(write=False)
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    @property
+    def frame_size(self) -> t.Tuple[int, int]:
+        """
+        Number of rows and columns of each frame.
+        """
+        return self.frames.shape[1], self.frames.shape[2]
+
+    @classmethod
+    def load(
+        cls,
+        path: Path | str,
+        frame_size: t.Optional[t.Tuple[int, int]] = None,
+        frame_count: t.Optional[int] = None,
+        transparent: t.Optional[int] = 0,
+    ) -> "SpriteSheet":
+        """
+        Loads a sprite sheet from an image file. The file is read only once,
+        loading it again returns the same sheet, unless the file was modified.
+        :param path: Path to the image file. Images are converted to grayscale,
+            animated images (e.g. GIFs) give one frame per image frame
+        :param frame_size: Number of rows and columns of each frame, to split the
+            image into a grid of frames ordered left to right and top to bottom.
+            Defaults to the whole image being one frame
+        :param frame_count: Number of frames, to skip empty cells at the end of the
+            grid. Defaults to all cells
+        :param transparent: Brightness of the transparent pixels of images without
+            an alpha channel, None makes all pixels opaque. Defaults to 0
+        :returns: The sprite sheet
+        :raises FileExistsError: If the path does not point to a file
+        """
+        path = Path(path)
+        if not path.exists() or not path.is_file():
+            raise FileExistsError(f"File `{path}` does not exist.")
+
+        return _load_sheet(
+            str(path.resolve()),
+            path.stat().st_mtime_ns,
+            None if frame_size is None else tuple(frame_size),
+            frame_count,
+            transparent,
+        )
+
+
+@functools.lru_cache(maxsize=64)
+def _load_sheet(
+    path: str,
+    mtime: int,
+    frame_size: t.Optional[t.Tuple[int, int]],
+    frame_count: t.Optional[int],
+    transparent: t.Optional[int],
+) -> SpriteSheet:
+    """
+    Loads a sprite sheet, see `SpriteSheet.load`. The modification time is only a
+    part of the cache key.
+    """
+    from PIL import Image, ImageSequence
+
+    with Image.open(path) as img:
+        has_alpha = "A" in img.getbands() or "transparency" in img.info
+        gray = []
+        alpha = []
+        for frame in ImageSequence.Iterator(img):
+            gray.append(np.asarray(frame.convert("L")))
+            if has_alpha:
+                alpha.append(np.asarray(frame.convert("RGBA").getchannel("A")))
+
+    frames = np.stack(gray)
+    mask = np.stack(alpha) >= 128 if has_alpha else None
+
+    if frame_size is not None:
+        frames = _split_grid(frames, frame_size)
+        mask = None if mask is None else _split_grid(mask, frame_size)
+    if frame_count is not None:
+        frames = frames[:frame_count]
+        mask = None if mask is None else mask[:frame_count]
+
+    return SpriteSheet(frames=frames, mask=mask, transparent=transparent)
+
+
+def _split_grid(images: np.ndarray, frame_size: t.Tuple[int, int]) -> np.ndarray:
+    """
+    Splits images into a grid of frames, dropping incomplete cells at the edges.
+    :param images: Array of shape (images, height, width)
+    :param frame_size: Number of rows and columns of each frame
+    :returns: Array of shape (frames, rows, columns), ordered left to right and
+        top to bottom
+    """
+    count, height, width = images.shape
+    rows, cols = frame_size
+    grid_rows, grid_cols = height // rows, width // cols
+    images = images[:, :grid_rows * rows, :grid_cols * cols]
+    return (
+        images.reshape(count, grid_rows, rows, grid_cols, cols)
+        .transpose(0, 1, 3, 2, 4)
+        .reshape(-1, rows, cols)
+    )
+
+
+class Sprite(DrawableObject):
+    """
+    A static image, drawn with transparency. Pixels outside of the canvas are
+    clipped.
+    :param sheet: The sprite sheet, or a path to the image file to load it from
+    :param x: The top left x position of the sprite
+    :param y: The top left y position of the sprite
+    :param frame: Index of the shown frame of the sheet
+    :param blend_mode: How the opaque pixels are combined with the pixels below,
+        see BlendMode
+    """
+
+    def __init__(
+        self,
+        sheet: SpriteSheet | Path | str,
+        x: int = 0,
+        y: int = 0,
+        frame: int = 0,
+        blend_mode: BlendMode = "replace",
+    ):
+        if not isinstance(sheet, SpriteSheet):
+            sheet = SpriteSheet.load(sheet)
+        self.sheet = sheet
+        self.x = x
+        self.y = y
+        self.frame = frame
+        self.blend_mode = blend_mode
+        # Blended pixels are prepared here, then copied through the mask
+        self._scratch = np.empty(sheet.frame_size, dtype=np.uint8)
+
+    def get_bounds(self) -> Bounds:
+        x = round(self.x)
+        y = round(self.y)
+        rows, cols = self.sheet.frame_size
+        return x, y, x + cols, y + rows
+
+    def draw(self, canvas: np.ndarray):
+        x0, y0, x1, y1 = self.get_bounds()
+        canvas_rows, canvas_cols = canvas.shape
+
+        # Clip the sprite to the canvas
+        top, left = max(y0, 0), max(x0, 0)
+        bottom, right = min(y1, canvas_rows), min(x1, canvas_cols)
+        if top >= bottom or left >= right:
+            return
+
+        source = (slice(top - y0, bottom - y0), slice(left - x0, right - x0))
+        pixels = self.sheet.frames[self.frame][source]
+        mask = self.sheet.mask[self.frame][source]
+        target = canvas[top:bottom, left:right]
+
+        if self.blend_mode != "replace":
+            blended = self._scratch[:bottom - top, :right - left]
+            blended[...] = target
+            blend(blended, pixels, self.blend_mode)
+            pixels = blended
+        np.copyto(target, pixels, where=mask)
+
+
+class AnimatedSprite(Sprite):
+    """
+    A sprite cycling through the frames of its sheet. The shown frame follows the
+    time elapsed since the start, so the animation keeps its speed regardless of
+    how often the canvas is updated.
+    :param sheet: The sprite sheet, or a path to the image file to load it from
+    :param x: The top left x position of the sprite
+    :param y: The top left y position of the sprite
+    :param fps: Number of frames shown per second
+    :param loop: Start over after the last frame, otherwise stay on it
+    :param clock: Function returning the current time in seconds, defaults to
+        `time.perf_counter`
+    :param blend_mode: How the opaque pixels are combined with the pixels below,
+        see BlendMode
+    """
+
+    def __init__(
+        self,
+        sheet: SpriteSheet | Path | str,
+        x: int = 0,
+        y: int = 0,
+        fps: float = 10.0,
+        loop: bool = True,
+        clock: t.Callable[[], float] = time.perf_counter,
+        blend_mode: BlendMode = "replace",
+    ):
+        super().__init__(sheet=sheet, x=x, y=y, blend_mode=blend_mode)
+        self.fps = fps
+        self.loop = loop
+        self._clock = clock
+        self._start = clock()
+
+    def restart(self):
+        """
+        Starts the animation again from the first frame.
+        """
+        self._start = self._clock()
+        self.frame = 0
+
+    def update(self):
+        index = int((self._clock() - self._start) * self.fps)
+        if self.loop:
+            index %= len(self.sheet)
+        else:
+            index = min(index, len(self.sheet) - 1)
+        if index != self.frame:
+            self.frame = index
@@ -2,16 +2,19 @@
 Module containing text drawing functionality.
 """
 
+import functools
+import threading
 import typing as t
+from collections.abc import Mapping
+from fractions import Fraction
+from pathlib import Path
 
-import cv2
 import numpy as np
 
-import PIL.Image as Image
-import PIL.ImageDraw as ImageDraw
-import PIL.ImageFont as ImageFont
+from src.drawing.common import BlendMode, Bounds, DrawableObject, blend, insert
+from src.utils import FONTS_PATH
 
-from src.drawing.common import DrawableObject, insert
+# cv2 and PIL are imported where needed, as they take most of the import time
 
 
 class PixelFontRenderer:
@@ -25,6 +28,7 @@ class PixelFontRenderer:
         rendered with internally, before being scaled to the final
         font_pixel_height. This is useful for some fonts where default size is
         some other than the desired output size.
+    :param cache_size: Number of recently rendered lines kept, defaults to 256
     """
 
     def __init__(
@@ -33,15 +37,26 @@ class PixelFontRenderer:
         font_pixel_width: int,
         font_pixel_height: int,
         font_render_height: t.Optional[int] = None,
+        cache_size: int = 256,
     ):
         self.font_pixel_width = font_pixel_width
         self.font_pixel_height = font_pixel_height
         self.font_render_height = font_render_height or font_pixel_height
+
+        import PIL.ImageFont as ImageFont
+
         self.pillow_font = ImageFont.truetype(
             font=font_file_path,
             size=self.font_render_height,
         )
 
+        # Rasterized characters, filled on first render
+        self._glyphs: t.Dict[str, _Glyph] = {}
+        self._atlas_height = 0
+        self._render_cached = functools.lru_cache(maxsize=cache_size)(
+            self._render_one_line
+        )
+
     def render_text(self, text: str, line_spacing: int = 1) -> np.ndarray:
         """
         Render a text string as an image. The input text can also contain
@@ -76,105 +91,304 @@ class PixelFontRenderer:
 
     def render_one_line(self, text: str) -> np.ndarray:
         """
-        Render a single text line as an image.
+        Render a single text line as an image. Recently rendered lines are cached,
+        so the returned array is read-only and shared between callers.
+        :param text: The input text string
+        :returns: The rendered text image
+        """
+        return self._render_cached(text.upper())
+
+    def _render_one_line(self, text: str) -> np.ndarray:
+        """
+        Composes a single, already uppercase, text line from the glyph atlas. The
+        result is the same as drawing the whole line with PIL onto an image of the
+        size of its bounding box (only twice as high), trimming the empty borders
+        and resizing it to the font height.
         :param text: The input text string
         :returns: The rendered text image
         """
+        glyphs = [self._glyph(char) for char in text]
+        if not glyphs:
+            return self._empty_line()
+
+        positions = []
+        pen = 0
+        x0 = y0 = float("inf")
+        x1 = y1 = float("-inf")
+        for glyph in glyphs:
+            left, top, right, bottom = glyph.bbox
+            x0 = min(x0, pen + left)
+            x1 = max(x1, pen + right)
+            y0 = min(y0, top)
+            y1 = max(y1, bottom)
+            positions.append(pen)
+            pen += glyph.advance
+
+        if all(glyph.fits for glyph in glyphs):
+            line = np.concatenate([glyph.bitmap for glyph in glyphs], axis=1)
+            origin = 0
+        else:
+            # Some glyphs reach out of their advance, so they are overlapped
+            origin = -min(0, *(glyph.left for glyph in glyphs))
+            width = max(
+                pos + glyph.left + glyph.bitmap.shape[1]
+                for pos, glyph in zip(positions, glyphs)
+            )
+            line = np.zeros((self._atlas_height, origin + width), dtype=bool)
+            for pos, glyph in zip(positions, glyphs):
+                start = origin + pos + glyph.left
+                line[:, start:start + glyph.bitmap.shape[1]] |= glyph.bitmap
+
+        # PIL draws the line at the origin onto an image of the size of its
+        # bounding box, only twice as high, so anything outside of it is cut off
+        visible = line[:(y1 - y0) * 2, origin:origin + max(x1 - x0, 0)]
+
+        rows = np.flatnonzero(visible.any(axis=1))
+        if not len(rows):
+            return self._empty_line()
+        cols = np.flatnonzero(visible.any(axis=0))
+
+        arr_trimmed = visible[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        arr_trimmed = arr_trimmed * np.uint8(255)
+
+        current_width = arr_trimmed.shape[1]
+        current_height = arr_trimmed.shape[0]
 
-        text = text.upper()
+        final_height = self.font_pixel_height
+        final_width = int(final_height / current_height * current_width)
 
-        (x0, y0, x1, y1) = self.pillow_font.getbbox(text)
+        if (final_height, final_width) == arr_trimmed.shape:
+            result = arr_trimmed
+        else:
+            import cv2
 
-        image_width = x1 - x0
-        image_height = y1 - y0
+            result = cv2.resize(
+                arr_trimmed,
+                (final_width, final_height),
+                interpolation=cv2.INTER_AREA,
+            )
+
+        result.setflags(write=False)
+        return result
+
+    def _empty_line(self) -> np.ndarray:
+        """
+        Image of a line without any visible characters.
+        :returns: The rendered text image
+        """
+        result = np.zeros(shape=(self.font_pixel_height, 1))
+        result.setflags(write=False)
+        return result
+
+    def _glyph(self, char: str) -> "_Glyph":
+        """
+        Looks up a character in the glyph atlas, rasterizing the atlas on first use.
+        Characters outside of it are rasterized separately when first needed.
+        :param char: The character
+        :returns: The rasterized glyph
+        """
+        glyph = self._glyphs.get(char)
+        if glyph is not None:
+            return glyph
+
+        if not self._glyphs:
+            ascent, descent = self.pillow_font.getmetrics()
+            self._atlas_height = ascent + descent
+            self._glyphs.update(self._rasterize(_ATLAS_CHARACTERS))
+        if char not in self._glyphs:
+            if self.pillow_font.getbbox(char)[3] > self._atlas_height:
+                # Rasterize everything again, high enough for the new glyph
+                self._atlas_height = self.pillow_font.getbbox(char)[3]
+                self._glyphs.update(self._rasterize("".join(self._glyphs)))
+            self._glyphs.update(self._rasterize(char))
+        return self._glyphs[char]
+
+    def _rasterize(self, chars: str) -> t.Dict[str, "_Glyph"]:
+        """
+        Draws characters next to each other onto a single image, without
+        anti-aliasing, and splits it into glyphs.
+        :param chars: The characters
+        :returns: Glyphs by character, their bitmaps are views of the shared image
+        """
+        import PIL.Image as Image
+        import PIL.ImageDraw as ImageDraw
+
+        metrics = []
+        offset = 0
+        for char in chars:
+            bbox = self.pillow_font.getbbox(char)
+            # Pixel fonts have whole pixel advances
+            advance = int(self.pillow_font.getlength(char))
+            left = min(0, bbox[0])
+            width = max(advance, bbox[2]) - left
+            metrics.append((char, bbox, advance, left, offset, width))
+            offset += width
 
-        # Create a blank image
         # See https://pillow.readthedocs.io/en/stable/handbook/concepts.html
         img = Image.new(
             mode="1",
-            size=(image_width, image_height * 2),
+            size=(max(offset, 1), self._atlas_height),
             color=0,
         )
-
-        # Get a drawing handle
         draw = ImageDraw.Draw(img)
-
         # Set the font drawing mode to "1" to disable font anti-aliasing
         draw.fontmode = "1"
+        for char, _, _, left, offset, _ in metrics:
+            draw.text(xy=(offset - left, 0), text=char, fill=255, font=self.pillow_font)
+        atlas = np.array(img)
+
+        return {
+            char: _Glyph(
+                bitmap=atlas[:, offset:offset + width],
+                advance=advance,
+                bbox=bbox,
+                left=left,
+                fits=left == 0 and width == advance,
+            )
+            for char, bbox, advance, left, offset, width in metrics
+        }
+
+
+class _Glyph(t.NamedTuple):
+    """
+    A character of a glyph atlas.
+    """
 
-        # Draw on image
-        draw.text(
-            xy=(0, 0),
-            text=text,
-            fill=255,
-            font=self.pillow_font,
-            # anchor="lt",  # Specify left-top text anchor
-            spacing=1,
-        )
-
-        # Convert PIL Image to Numpy array for processing
-        array = np.array(img) * np.uint8(255)
-        # print(array[:20, :20])
-        # array = np.max(array, axis=2)
-
-        if array.max() == 0:
-            return np.zeros(shape=(self.font_pixel_height, 1))
-
-        # https://stackoverflow.com/questions/55917328/numpy-trim-zeros-in-2d-or-3d
-        nz = np.nonzero(array)  # Indices of all nonzero elements
-
-        start_row = nz[0].min()
-        end_row = nz[0].max() + 1
+    # Pixels of the glyph (as drawn at the origin), from `left` to the wider of its
+    # advance and its bounding box, in full atlas height
+    bitmap: np.ndarray
+    # Distance to the origin of the next character
+    advance: int
+    # Bounding box of the drawn glyph relative to its origin
+    bbox: t.Tuple[int, int, int, int]
+    # Column of the bitmap start relative to the origin, 0 unless the glyph reaches
+    # to the left of it
+    left: int
+    # Whether the bitmap starts at the origin and is exactly as wide as the advance
+    fits: bool
 
-        start_col = nz[1].min()
-        end_col = nz[1].max() + 1
 
-        arr_trimmed = array[start_row:end_row, start_col:end_col]
+# Characters rasterized into the glyph atlas of each font, rendered text is uppercase
+_ATLAS_CHARACTERS = "".join(sorted({chr(code).upper() for code in range(32, 127)}))
 
-        current_width = arr_trimmed.shape[1]
-        current_height = arr_trimmed.shape[0]
 
-        final_height = self.font_pixel_height
-        final_width = int(final_height / current_height * current_width)
+class FontRegistry(Mapping):
+    """
+    Named fonts, each loaded on first access. Maps font names to instances of
+    PixelFontRenderer.
+    """
 
-        result = cv2.resize(
-            arr_trimmed,
-            (final_width, final_height),
-            interpolation=cv2.INTER_AREA,
-        )
+    def __init__(self):
+        self._definitions: t.Dict[str, t.Dict[str, t.Any]] = {}
+        self._renderers: t.Dict[str, PixelFontRenderer] = {}
+        self._lock = threading.Lock()
 
-        return result
+    def register(
+        self,
+        name: str,
+        font_file_path: Path | str,
+        font_pixel_width: int,
+        font_pixel_height: int,
+        font_render_height: t.Optional[int] = None,
+    ):
+        """
+        Adds a font, or replaces the font of the same name. The font file is not
+        read until the font is first used.
+        :param name: The name of the font
+        :param font_file_path: Path to a .ttf font file, relative paths are resolved
+            against the fonts directory of the package
+        :param font_pixel_width: The width of the resulting text in pixels
+        :param font_pixel_height: The height of the resulting text in pixels
+        :param font_render_height: Optional different height that the text will be
+            rendered with internally, see PixelFontRenderer
+        """
+        with self._lock:
+            self._definitions[name] = dict(
+                font_file_path=str(FONTS_PATH / font_file_path),
+                font_pixel_width=font_pixel_width,
+                font_pixel_height=font_pixel_height,
+                font_render_height=font_render_height,
+            )
+            self._renderers.pop(name, None)
+
+    def __getitem__(self, name: str) -> PixelFontRenderer:
+        renderer = self._renderers.get(name)
+        if renderer is not None:
+            return renderer
+        with self._lock:
+            if name not in self._renderers:
+                self._renderers[name] = PixelFontRenderer(**self._definitions[name])
+            return self._renderers[name]
+
+    def __iter__(self) -> t.Iterator[str]:
+        return iter(self._definitions)
+
+    def __len__(self) -> int:
+        return len(self._definitions)
+
+
+FONTS = FontRegistry()
+
+
+def register_font(
+    name: str,
+    font_file_path: Path | str,
+    font_pixel_width: int,
+    font_pixel_height: int,
+    font_render_height: t.Optional[int] = None,
+):
+    """
+    Makes a font available by name, e.g. to Text objects. See
+    `FontRegistry.register`.
+    :param name: The name of the font
+    :param font_file_path: Path to a .ttf font file, relative paths are resolved
+        against the fonts directory of the package
+    :param font_pixel_width: The width of the resulting text in pixels
+    :param font_pixel_height: The height of the resulting text in pixels
+    :param font_render_height: Optional different height that the text will be
+        rendered with internally, see PixelFontRenderer
+    """
+    FONTS.register(
+        name=name,
+        font_file_path=font_file_path,
+        font_pixel_width=font_pixel_width,
+        font_pixel_height=font_pixel_height,
+        font_render_height=font_render_height,
+    )
 
 
 # Hard-coded font definitions
-FONTS = {
-    "3x3": PixelFontRenderer(
-        font_file_path="fonts/3x3-Mono.ttf",
-        font_pixel_width=3,
-        font_pixel_height=3,
-        font_render_height=8,
-    ),
-    "3x5": PixelFontRenderer(
-        font_file_path="fonts/3x5 MT Pixel.ttf",
-        font_pixel_width=3,
-        font_pixel_height=5,
-    ),
-    "5x5": PixelFontRenderer(
-        font_file_path="fonts/5x5 MT Pixel.ttf",
-        font_pixel_width=5,
-        font_pixel_height=5,
-    ),
-    "5x7": PixelFontRenderer(
-        font_file_path="fonts/5x7 MT Pixel.ttf",
-        font_pixel_width=5,
-        font_pixel_height=7,
-    ),
-}
+register_font(
+    name="3x3",
+    font_file_path="3x3-Mono.ttf",
+    font_pixel_width=3,
+    font_pixel_height=3,
+    font_render_height=8,
+)
+register_font(
+    name="3x5",
+    font_file_path="3x5 MT Pixel.ttf",
+    font_pixel_width=3,
+    font_pixel_height=5,
+)
+register_font(
+    name="5x5",
+    font_file_path="5x5 MT Pixel.ttf",
+    font_pixel_width=5,
+    font_pixel_height=5,
+)
+register_font(
+    name="5x7",
+    font_file_path="5x7 MT Pixel.ttf",
+    font_pixel_width=5,
+    font_pixel_height=7,
+)
 
 
 def get_pixel_font_renderer_by_name(font: str) -> PixelFontRenderer:
     """
-    Get an instance of a PixelFontRenderer based on a name.
+    Get an instance of a PixelFontRenderer based on a name. The font is loaded on
+    first use.
     :param font: The name of the desired font
     :returns: An instance of a PixelFontRenderer
     """
@@ -190,6 +404,8 @@ class Text(DrawableObject):
     :param font: The name of the font to be used
     :param x: The top left x position of the text
     :param y: The top left y position of the text
+    :param blend_mode: How the text is combined with the pixels below, see
+        BlendMode
     """
 
     def __init__(
@@ -198,13 +414,21 @@ class Text(DrawableObject):
         font: str,
         x: int,
         y: int,
+        blend_mode: BlendMode = "replace",
     ):
         self.x = x
         self.y = y
         self.text = text
+        self.blend_mode = blend_mode
         self.font_renderer = get_pixel_font_renderer_by_name(font=font)
         self.text_array = self.font_renderer.render_text(text=self.text)
 
+    def get_bounds(self) -> Bounds:
+        x = round(self.x)
+        y = round(self.y)
+        height, width = self.text_array.shape
+        return x, y, x + width, y + height
+
     def draw(self, canvas: np.ndarray):
         insert(
             base=canvas,
@@ -212,18 +436,31 @@ class Text(DrawableObject):
             x=self.x,
             y=self.y,
             inplace=True,
+            mode=self.blend_mode,
         )
 
 
 class TextMarquee(Text):
     """
-    A scrolling text object.
+    A scrolling text object. The text is rendered once into a strip holding it
+    repeated with a gap, long enough that every frame is a single slice of the
+    strip. A matching mask marks the repetitions, so pixels of the gap are left
+    untouched. The position advances in exact fractions of a pixel, so fractional
+    speeds don't drift.
     :param text: The text string to display
     :param font: The name of the font to be used
     :param y: The top left y position of the text
     :param x: The top left x position of the text
-    :param speed: The speed of the marquee scrolling effect
+    :param speed: The speed of the marquee scrolling effect in pixels per update,
+        accurate to 1/1000 of a pixel
     :param screen_width: The width of the screen to be scrolled
+    :param gap: The number of pixels between the end of the text and its next
+        repetition, 0 loops the text without a gap. Defaults to the screen size,
+        so the text scrolls out of the screen before it comes back
+    :param vertical: Scroll the text upwards instead of to the left
+    :param screen_height: The height of the screen to be scrolled vertically
+    :param blend_mode: How the text is combined with the pixels below, see
+        BlendMode
     """
 
     def __init__(
@@ -234,14 +471,123 @@ class TextMarquee(Text):
         x: int = 0,
         speed: float = 1.0,
         screen_width: int = 16,
+        gap: t.Optional[int] = None,
+        vertical: bool = False,
+        screen_height: int = 16,
+        blend_mode: BlendMode = "replace",
     ):
-        super().__init__(text=text, font=font, x=x, y=y)
+        super().__init__(text=text, font=font, x=x, y=y, blend_mode=blend_mode)
         self.speed = speed
         self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.vertical = vertical
         self.text_width = self.text_array.shape[1]
-        self.scroll_distance_x = max(self.screen_width, self.text_width)
+
+        screen = screen_height if vertical else screen_width
+        length = self.text_array.shape[0 if vertical else 1]
+        self.period = length + (screen if gap is None else gap)
+
+        # Text and gap repeated to cover the period and a screen after it, with the
+        # mask of the pixels covered by the text
+        axis = 0 if vertical else 1
+        tile_shape = list(self.text_array.shape)
+        tile_shape[axis] = self.period
+        tile = np.zeros(tile_shape, dtype=np.uint8)
+        mask = np.zeros(tile_shape, dtype=bool)
+        if vertical:
+            tile[:length] = self.text_array
+            mask[:length] = True
+        else:
+            tile[:, :length] = self.text_array
+            mask[:, :length] = True
+        repeats = -(-(self.period + screen) // self.period)
+        self._strip = np.concatenate([tile] * repeats, axis=axis)
+        self._mask = np.concatenate([mask] * repeats, axis=axis)
+
+        # Position in 1/denominator pixel ticks, synced from x or y when they are
+        # changed from outside
+        self._speed = None
+        self._step = 0
+        self._denominator = 1
+        self._ticks = 0
+        self._position = None
 
     def update(self):
-        self.x -= self.speed
-        if self.x < -self.scroll_distance_x:
-            self.x = self.screen_width
+        if self.speed != self._speed:
+            step = Fraction(self.speed).limit_denominator(1000)
+            self._speed = self.speed
+            self._step = step.numerator
+            self._denominator = step.denominator
+            self._position = None
+
+        position = self.y if self.vertical else self.x
+        if position != self._position:
+            self._ticks = round(position * self._denominator)
+
+        # Keep the position within a period ending at the far screen edge
+        screen = self.screen_height if self.vertical else self.screen_width
+        end = screen * self._denominator
+        span = self.period * self._denominator
+        self._ticks = end - (end - self._ticks + self._step) % span
+
+        self._position = self._ticks // self._denominator
+        if self._position == position:
+            return
+        if self.vertical:
+            self.y = self._position
+        else:
+            self.x = self._position
+
+    def _repetitions(self) -> range:
+        """
+        Positions of the repetitions of the text visible on the screen, along the
+        direction of scrolling.
+        :returns: Range of the top or left edges of the repetitions
+        """
+        if self.vertical:
+            position, length = round(self.y), self.text_array.shape[0]
+            screen = self.screen_height
+        else:
+            position, length = round(self.x), self.text_width
+            screen = self.screen_width
+        # First repetition reaching into the screen
+        first = position - (position + length - 1) // self.period * self.period
+        return range(first, max(screen, first + 1), self.period)
+
+    def get_bounds(self) -> Bounds:
+        repetitions = self._repetitions()
+        height, width = self.text_array.shape
+        if self.vertical:
+            x = round(self.x)
+            return x, repetitions[0], x + width, repetitions[-1] + height
+        y = round(self.y)
+        return repetitions[0], y, repetitions[-1] + width, y + height
+
+    def draw(self, canvas: np.ndarray):
+        # Top left corner of the strip on the canvas, and the screen window of it
+        if self.vertical:
+            strip_x = round(self.x)
+            strip_y = -(-round(self.y) % self.period)
+            left, top = strip_x, 0
+            right, bottom = strip_x + self.text_width, self.screen_height
+        else:
+            strip_x = -(-round(self.x) % self.period)
+            strip_y = round(self.y)
+            left, top = 0, strip_y
+            right, bottom = self.screen_width, strip_y + self.text_array.shape[0]
+
+        left, top = max(left, 0), max(top, 0)
+        right = min(right, canvas.shape[1])
+        bottom = min(bottom, canvas.shape[0])
+        if right <= left or bottom <= top:
+            return
+
+        rows = slice(top - strip_y, bottom - strip_y)
+        cols = slice(left - strip_x, right - strip_x)
+        target = canvas[top:bottom, left:right]
+        if self.blend_mode in ("replace", "alpha"):
+            # Fully opaque, so only the pixels of the text are copied
+            np.copyto(target, self._strip[rows, cols], where=self._mask[rows, cols])
+        else:
+            # The zeros of the gap leave the pixels below unchanged in other modes
+            blend(target, self._strip[rows, cols], mode=self.blend_mode)
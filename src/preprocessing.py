@@ -0,0 +1,401 @@
+"""
+Module containing image loading and preprocessing functionality.
+
+Usage: python -m src.preprocessing SOURCE OUTPUT [--resolution ROWS COLS]
+    [--mode {resize,crop,pad}] [--workers N]
+"""
+
+import argparse
+import glob
+import os
+import stat
+import typing as t
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from src.container import save_container
+from src.sources import natural_sort_key
+
+PreprocessingMode = t.Literal["resize", "crop", "pad"]
+
+
+def _decode(path: Path | str) -> np.ndarray:
+    """
+    Decodes an image file as an 8-bit grayscale array.
+    :param path: Path to the image file
+    :returns: The pixel array
+    """
+    with Image.open(path) as img:
+        return np.array(img.convert("L"))
+
+
+def crop_batch(images: np.ndarray, resolution: t.Tuple[int, int]) -> np.ndarray:
+    """
+    Crops a stack of equally sized images from their top left corner. Images
+    smaller than the resolution are padded with black on the right and bottom.
+    :param images: Array of shape (N, height, width)
+    :param resolution: Number of rows and columns of the result
+    :returns: Array of shape (N, rows, columns)
+    """
+    rows, cols = resolution
+    result = np.zeros((len(images), rows, cols), dtype=np.uint8)
+    height = min(rows, images.shape[1])
+    width = min(cols, images.shape[2])
+    result[:, :height, :width] = images[:, :height, :width]
+    return result
+
+
+def pad_batch(images: np.ndarray, resolution: t.Tuple[int, int]) -> np.ndarray:
+    """
+    Centers a stack of equally sized images on square black backgrounds, large
+    enough to fit both the images and the resolution.
+    :param images: Array of shape (N, height, width)
+    :param resolution: Number of rows and columns the images are later resized to
+    :returns: Array of shape (N, bound, bound)
+    """
+    count, height, width = images.shape
+    bound = max(height, width, *resolution)
+    result = np.zeros((count, bound, bound), dtype=np.uint8)
+    top = (bound - height) // 2
+    left = (bound - width) // 2
+    result[:, top:top + height, left:left + width] = images
+    return result
+
+
+def resize_batch(images: np.ndarray, resolution: t.Tuple[int, int]) -> np.ndarray:
+    """
+    Resizes a stack of images with the default resampling of PIL.
+    :param images: Array of shape (N, height, width)
+    :param resolution: Number of rows and columns of the result
+    :returns: Array of shape (N, rows, columns)
+    """
+    rows, cols = resolution
+    result = np.empty((len(images), rows, cols), dtype=np.uint8)
+    for i, image in enumerate(images):
+        result[i] = np.asarray(Image.fromarray(image).resize((cols, rows)))
+    return result
+
+
+def preprocess_batch(
+    images: np.ndarray,
+    resolution: t.Tuple[int, int],
+    mode: PreprocessingMode = "resize",
+) -> np.ndarray:
+    """
+    Brings a stack of equally sized grayscale images to the given resolution.
+    See `load_image` for the modes.
+    :param images: Array of shape (N, height, width)
+    :param resolution: Number of rows and columns of the result
+    :param mode: Preprocessing option of images with different resolution, defaults
+        to "resize"
+    :returns: Array of shape (N, rows, columns)
+    :raises ValueError: If unsupported `mode` value is passed
+    """
+    if images.shape[1:] == tuple(resolution):
+        return images
+    match mode:
+        case "resize":
+            return resize_batch(images, resolution)
+        case "crop":
+            return crop_batch(images, resolution)
+        case "pad":
+            return resize_batch(pad_batch(images, resolution), resolution)
+        case _:
+            raise ValueError(f"Incorrect `mode` given ({mode}).")
+
+
+def load_image(
+    path: Path | str,
+    resolution: t.Tuple[int, int],
+    mode: PreprocessingMode = "resize",
+) -> np.ndarray:
+    """
+    Loads an image file as a grayscale pixel array of the given resolution.
+    If its size is not exactly the same as the resolution, it can be cropped (from
+    top left corner), resized or padded (if the image is larger it's first resized
+    and then padded).
+    :param path: Path to the image file
+    :param resolution: Number of rows and columns of the result
+    :param mode: Preprocessing option of images with different resolution, defaults
+        to "resize"
+    :returns: The pixel array
+    :raises FileExistsError: If the path does not point to a file
+    :raises ValueError: If unsupported `mode` value is passed
+    """
+    path = Path(path)
+    if not path.exists() or not path.is_file():
+        raise FileExistsError(f"File `{path}` does not exist.")
+
+    return preprocess_batch(_decode(path)[None], resolution, mode)[0]
+
+
+def _preprocess_files(
+    paths: t.List[Path],
+    resolution: t.Tuple[int, int],
+    mode: PreprocessingMode,
+) -> np.ndarray:
+    """
+    Loads and preprocesses image files, stacking images of the same size so they
+    are processed together.
+    :param paths: Paths to the image files
+    :param resolution: Number of rows and columns of the results
+    :param mode: Preprocessing option of images with different resolution
+    :returns: Array of shape (N, rows, columns)
+    """
+    images = [_decode(path) for path in paths]
+    groups: t.Dict[t.Tuple[int, int], t.List[int]] = {}
+    for i, image in enumerate(images):
+        groups.setdefault(image.shape, []).append(i)
+
+    result = np.empty((len(images), *resolution), dtype=np.uint8)
+    for indices in groups.values():
+        stack = np.stack([images[i] for i in indices])
+        result[indices] = preprocess_batch(stack, resolution, mode)
+    return result
+
+
+def collect_image_paths(source: Path | str | t.Iterable[Path | str]) -> t.List[Path]:
+    """
+    Resolves the image files to preprocess.
+    :param source: Directory (searched recursively), glob pattern, or list of paths
+    :returns: Paths in natural order, or in the given order for lists
+    :raises FileExistsError: If a directory or file does not exist
+    """
+    if not isinstance(source, (str, Path)):
+        return [Path(path) for path in source]
+
+    path = Path(source)
+    if path.is_dir():
+        return sorted(
+            (
+                file for file in path.rglob("*")
+                if file.suffix.lower() in Image.registered_extensions()
+            ),
+            key=lambda file: natural_sort_key(file.relative_to(path)),
+        )
+    if any(char in str(source) for char in "*?["):
+        return sorted(
+            (Path(file) for file in glob.glob(str(source), recursive=True)),
+            key=natural_sort_key,
+        )
+    if not path.is_file():
+        raise FileExistsError(f"Path `{path}` does not exist.")
+    return [path]
+
+
+def preprocess_images(
+    source: Path | str | t.Iterable[Path | str],
+    resolution: t.Tuple[int, int] = (16, 16),
+    mode: PreprocessingMode = "resize",
+    workers: t.Optional[int] = None,
+    chunk_size: int = 64,
+) -> np.ndarray:
+    """
+    Loads and preprocesses many image files in parallel. Files are split into
+    chunks handled by a pool of processes, and within a chunk images of the same
+    size are cropped or padded together as one array.
+    :param source: Directory (searched recursively), glob pattern, or list of paths
+    :param resolution: Number of rows and columns of the results, defaults to
+        (16, 16)
+    :param mode: Preprocessing option of images with different resolution, defaults
+        to "resize"
+    :param workers: Number of processes, defaults to the number of CPUs. With 1 the
+        files are processed in the calling process
+    :param chunk_size: Number of files handled by a process at once, defaults to 64
+    :returns: Array of shape (N, rows, columns), in the order of the files
+    :raises FileExistsError: If a directory or file does not exist
+    :raises ValueError: If unsupported `mode` value is passed
+    """
+    if mode not in t.get_args(PreprocessingMode):
+        raise ValueError(f"Incorrect `mode` given ({mode}).")
+
+    paths = collect_image_paths(source)
+    resolution = tuple(resolution)
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    workers = min(workers or os.cpu_count() or 1, max(len(chunks), 1))
+
+    if workers == 1:
+        results = [_preprocess_files(chunk, resolution, mode) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    _preprocess_files,
+                    chunks,
+                    [resolution] * len(chunks),
+                    [mode] * len(chunks),
+                )
+            )
+
+    if not results:
+        return np.empty((0, *resolution), dtype=np.uint8)
+    return np.concatenate(results)
+
+
+class ImageCache:
+    """
+    Bounded least-recently-used cache of preprocessed images. Entries are keyed by
+    the path as given, the identity, modification time and size of the file
+    together with the preprocessing options, so a modified file is loaded again.
+    Paths are only resolved when invalidating. Cached arrays are read-only and
+    shared between callers.
+    :param maxsize: Maximum number of cached images, defaults to 64
+    """
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(
+        self,
+        path: Path | str,
+        resolution: t.Tuple[int, int],
+        mode: PreprocessingMode = "resize",
+    ) -> np.ndarray:
+        """
+        Returns the preprocessed image, loading it on a cache miss. See `load_image`.
+        :param path: Path to the image file
+        :param resolution: Number of rows and columns of the result
+        :param mode: Preprocessing option of images with different resolution,
+            defaults to "resize"
+        :returns: The read-only pixel array
+        :raises FileExistsError: If the path does not point to a file
+        :raises ValueError: If unsupported `mode` value is passed
+        """
+        path = os.fspath(path)
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            raise FileExistsError(f"File `{path}` does not exist.")
+        if not stat.S_ISREG(file_stat.st_mode):
+            raise FileExistsError(f"File `{path}` does not exist.")
+
+        # The device and inode tell apart relative paths given from different
+        # working directories
+        key = (
+            path,
+            file_stat.st_dev,
+            file_stat.st_ino,
+            file_stat.st_mtime_ns,
+            file_stat.st_size,
+            mode,
+            tuple(resolution),
+        )
+        array = self._entries.get(key)
+        if array is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return array
+
+        self.misses += 1
+        array = load_image(path, resolution, mode)
+        array.setflags(write=False)
+        if self.maxsize > 0:
+            self._entries[key] = array
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return array
+
+    def preload(
+        self,
+        paths: t.Iterable[Path | str],
+        resolution: t.Tuple[int, int],
+        mode: PreprocessingMode = "resize",
+    ):
+        """
+        Loads images into the cache ahead of time.
+        :param paths: Paths to the image files
+        :param resolution: Number of rows and columns of the results
+        :param mode: Preprocessing option of images with different resolution,
+            defaults to "resize"
+        """
+        for path in paths:
+            self.get(path, resolution, mode)
+
+    def invalidate(self, path: t.Optional[Path | str] = None):
+        """
+        Removes cached images.
+        :param path: Remove only the entries of this file, defaults to removing all
+        """
+        if path is None:
+            self._entries.clear()
+            return
+
+        resolved = Path(path).resolve()
+        try:
+            file_stat = os.stat(resolved)
+            identity = (file_stat.st_dev, file_stat.st_ino)
+        except OSError:
+            identity = None
+        for key in list(self._entries):
+            if key[1:3] == identity or Path(key[0]).resolve() == resolved:
+                del self._entries[key]
+
+    @property
+    def stats(self) -> t.Dict[str, int]:
+        """
+        Cache statistics.
+        :returns: Number of hits, misses, evictions and currently cached images
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Preprocess a directory or glob of images into one array."
+    )
+    parser.add_argument("source", help="Directory or glob pattern of image files")
+    parser.add_argument(
+        "output",
+        type=Path,
+        help="Output file, .npy for an array of shape (N, rows, columns), or an "
+        "animation container otherwise",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=int,
+        nargs=2,
+        default=(16, 16),
+        metavar=("ROWS", "COLS"),
+        help="Resolution of the results",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=t.get_args(PreprocessingMode),
+        default="resize",
+        help="Preprocessing option of images with different resolution",
+    )
+    parser.add_argument("--workers", type=int, help="Number of processes")
+    args = parser.parse_args()
+
+    images = preprocess_images(
+        source=args.source,
+        resolution=args.resolution,
+        mode=args.mode,
+        workers=args.workers,
+    )
+    if args.output.suffix == ".npy":
+        np.save(args.output, images)
+    else:
+        save_container(images, args.output)
+    print(f"{len(images)} images written to `{args.output}`.")
+
+
+if __name__ == "__main__":
+    main()
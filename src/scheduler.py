@@ -0,0 +1,201 @@
+"""
+Module containing frame pacing functionality for animations and render loops.
+"""
+
+import asyncio
+import math
+import time
+import typing as t
+
+
+class RunningStats:
+    """
+    Count, mean, standard deviation and maximum of a series of values, updated one
+    value at a time with Welford's online algorithm, so no values are kept.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.max = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float):
+        """
+        Adds a value to the statistics.
+        :param value: The value
+        """
+        self.count += 1
+        self.max = max(self.max, value)
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def std(self) -> float:
+        """
+        Population standard deviation of the values, 0 without any.
+        """
+        return math.sqrt(self._m2 / self.count) if self.count else 0.0
+
+
+class FrameScheduler:
+    """
+    Paces a loop at a fixed frame rate. Deadlines are computed from the start time
+    on a monotonic clock, so timing errors don't add up over time. Waiting sleeps
+    until shortly before the deadline and busy-waits the rest, which is accurate
+    to well under a millisecond.
+
+    Falling behind is handled according to `catch_up`. With "drop", frames whose
+    time has already passed are skipped, so the animation keeps its duration. With
+    "slow", every frame is shown and the following deadlines are pushed back, so
+    the animation takes longer instead.
+
+    :param fps: Frames per second
+    :param catch_up: Behavior when falling behind, "drop" or "slow", defaults to
+        "drop"
+    :param spin: Seconds before each deadline spent busy-waiting instead of
+        sleeping, defaults to 0.002
+    :raises ValueError: If unsupported `catch_up` value is passed
+    """
+
+    def __init__(
+        self,
+        fps: float,
+        catch_up: t.Literal["drop", "slow"] = "drop",
+        spin: float = 0.002,
+    ):
+        if catch_up not in ("drop", "slow"):
+            raise ValueError(f"Incorrect `catch_up` given ({catch_up}).")
+
+        self.fps = fps
+        self.catch_up = catch_up
+        self.spin = spin
+        self.interval = 1 / fps
+        self.start()
+
+    def start(self):
+        """
+        Starts the schedule at the current time, with frame 0 due now, and resets
+        the statistics.
+        """
+        self.frame = 0
+        self.dropped = 0
+        self._start = time.perf_counter()
+        self._last = self._start
+
+        self._lateness = RunningStats()
+        self._intervals = RunningStats()
+
+    def wait(self) -> int:
+        """
+        Waits until the next frame is due.
+        :returns: Index of the frame to show now
+        """
+        self.frame += 1
+        deadline = self._start + self.frame * self.interval
+        now = time.perf_counter()
+
+        if now < deadline:
+            if deadline - now > self.spin:
+                time.sleep(deadline - now - self.spin)
+            while now < deadline:
+                now = time.perf_counter()
+        else:
+            deadline = self._fall_behind(now, deadline)
+
+        self._record(now - deadline, now - self._last)
+        self._last = now
+        return self.frame
+
+    async def wait_async(self) -> int:
+        """
+        Waits until the next frame is due without blocking the event loop, see
+        `wait`. The wait relies on the timers of the loop, so it is only accurate
+        to about a millisecond.
+        :returns: Index of the frame to show now
+        """
+        self.frame += 1
+        deadline = self._start + self.frame * self.interval
+        now = time.perf_counter()
+
+        if now < deadline:
+            await asyncio.sleep(deadline - now)
+            now = time.perf_counter()
+        else:
+            deadline = self._fall_behind(now, deadline)
+
+        self._record(now - deadline, now - self._last)
+        self._last = now
+        return self.frame
+
+    def _fall_behind(self, now: float, deadline: float) -> float:
+        """
+        Handles a frame whose deadline has already passed, according to `catch_up`.
+        :param now: The current time
+        :param deadline: The passed deadline of the frame
+        :returns: Deadline of the frame to show now
+        """
+        if self.catch_up == "drop":
+            due = math.floor((now - self._start) / self.interval)
+            if due > self.frame:
+                self.dropped += due - self.frame
+                self.frame = due
+                deadline = self._start + due * self.interval
+        else:
+            self._start += now - deadline
+            deadline = now
+        return deadline
+
+    def frames(self, count: t.Optional[int] = None) -> t.Iterator[int]:
+        """
+        Starts the schedule and yields the index of each frame when it is due.
+        :param count: Number of frames, defaults to running forever
+        :returns: Iterator of frame indices, with gaps for dropped frames
+        """
+        self.start()
+        frame = 0
+        while count is None or frame < count:
+            yield frame
+            frame = self.wait()
+
+    async def frames_async(
+        self, count: t.Optional[int] = None
+    ) -> t.AsyncIterator[int]:
+        """
+        Starts the schedule and yields the index of each frame when it is due,
+        waiting without blocking the event loop, see `frames`.
+        :param count: Number of frames, defaults to running forever
+        :returns: Async iterator of frame indices, with gaps for dropped frames
+        """
+        self.start()
+        frame = 0
+        while count is None or frame < count:
+            yield frame
+            frame = await self.wait_async()
+
+    def _record(self, lateness: float, interval: float):
+        """
+        Adds a frame to the running statistics.
+        :param lateness: Seconds between the deadline and the actual wake up
+        :param interval: Seconds since the previous frame
+        """
+        self._lateness.add(lateness)
+        self._intervals.add(interval)
+
+    @property
+    def stats(self) -> t.Dict[str, float]:
+        """
+        Timing statistics since the start.
+        :returns: Number of frames waited for and dropped, mean and max lateness
+            and the mean and standard deviation (jitter) of frame intervals, all in
+            seconds
+        """
+        return {
+            "frames": self._intervals.count,
+            "dropped": self.dropped,
+            "mean_lateness": self._lateness.mean,
+            "max_lateness": self._lateness.max,
+            "mean_interval": self._intervals.mean,
+            "jitter": self._intervals.std,
+        }
@@ -0,0 +1,347 @@
+"""
+Module containing sources of animation frames.
+"""
+
+import queue
+import re
+import threading
+import typing as t
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+# cv2 is imported where needed, as it takes most of the import time
+
+
+def natural_sort_key(path: Path) -> t.List[t.Union[int, str]]:
+    """
+    Sort key ordering numbered file names by their numbers, so that e.g.
+    "frame2.bmp" comes before "frame10.bmp".
+    :param path: The file path
+    :returns: The key
+    """
+    return [
+        int(part) if part.isdigit() else part.lower()
+        for part in re.split(r"(\d+)", path.as_posix())
+    ]
+
+
+def list_frame_paths(dir_path: Path | str, pattern: str = "*.bmp") -> t.List[Path]:
+    """
+    Lists the frame files of an animation, including subdirectories, in natural
+    order.
+    :param dir_path: Directory containing frames of the animation
+    :param pattern: Glob pattern of the frame files, defaults to "*.bmp"
+    :returns: Ordered list of frame paths
+    :raises FileExistsError: If incorrect directory path is given
+    """
+    dir_path = Path(dir_path)
+    if not dir_path.exists() or not dir_path.is_dir():
+        raise FileExistsError(f"Directory `{dir_path}` does not exist.")
+
+    return sorted(
+        dir_path.rglob(pattern),
+        key=lambda path: natural_sort_key(path.relative_to(dir_path)),
+    )
+
+
+class FrameSource:
+    """
+    Base class of animation frame sources. Iterating over a source yields frames as
+    2D uint8 grayscale arrays. Yielded arrays may be reused by the source, so they
+    are valid only until the next frame is requested.
+    """
+
+    # Native frame rate of the source, if it has one
+    fps: t.Optional[float] = None
+
+    def __iter__(self) -> t.Iterator[np.ndarray]:
+        raise NotImplementedError
+
+
+class _PrefetchingFrameSource(FrameSource):
+    """
+    Base of sources decoding frames on a background thread into a bounded ring of
+    preallocated buffers. Iteration starts as soon as the first few frames are
+    ready, and memory use stays constant regardless of the number of frames.
+
+    Subclasses implement `_frame_shape` and `_read`, which runs on the background
+    thread. For live sources the thread never waits - when the ring is full, the
+    oldest decoded frame is dropped in favor of the newest one.
+
+    :param prefetch: Number of frames decoded ahead
+    :param start_after: Number of frames decoded before the first one is yielded
+    :param live: Drop the oldest frames instead of waiting when the ring is full
+    """
+
+    def __init__(self, prefetch: int, start_after: int, live: bool = False):
+        self.prefetch = max(prefetch, 2 if live else 1)
+        self.start_after = min(max(start_after, 1), self.prefetch)
+        self.live = live
+        self.frames_dropped = 0
+
+    def _frame_shape(self) -> t.Tuple[int, int]:
+        """
+        Shape of the frames, used to allocate the ring.
+        :returns: Number of rows and columns
+        """
+        raise NotImplementedError
+
+    def _read(self) -> t.Iterator[np.ndarray]:
+        """
+        Reads and decodes the frames, called on the background thread.
+        :returns: Iterator of 2D uint8 grayscale frames
+        """
+        raise NotImplementedError
+
+    def __iter__(self) -> t.Iterator[np.ndarray]:
+        ring = np.empty((self.prefetch, *self._frame_shape()), dtype=np.uint8)
+
+        free: queue.Queue = queue.Queue()
+        for slot in range(self.prefetch):
+            free.put(slot)
+        ready: queue.Queue = queue.Queue()
+        started = threading.Event()
+        stopped = threading.Event()
+
+        thread = threading.Thread(
+            target=self._prefetch,
+            args=(ring, free, ready, started, stopped),
+            name="frame-prefetch",
+            daemon=True,
+        )
+        thread.start()
+        started.wait()
+
+        try:
+            while True:
+                slot = ready.get()
+                if slot is None:
+                    return
+                if isinstance(slot, Exception):
+                    raise slot
+                yield ring[slot]
+                free.put(slot)
+        finally:
+            stopped.set()
+            free.put(None)
+            thread.join()
+
+    def _take_slot(self, free: queue.Queue, ready: queue.Queue) -> t.Optional[int]:
+        """
+        Takes a ring slot to decode the next frame into.
+        :returns: Index of the slot, None if iteration stopped
+        """
+        if self.live:
+            try:
+                return free.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                slot = ready.get_nowait()
+                self.frames_dropped += 1
+                return slot
+            except queue.Empty:
+                pass
+        return free.get()
+
+    def _prefetch(
+        self,
+        ring: np.ndarray,
+        free: queue.Queue,
+        ready: queue.Queue,
+        started: threading.Event,
+        stopped: threading.Event,
+    ):
+        """
+        Decodes the frames into free ring slots, in order, until all are decoded or
+        iteration stops.
+        """
+        frames = self._read()
+        try:
+            for i, frame in enumerate(frames):
+                slot = self._take_slot(free, ready)
+                if slot is None or stopped.is_set():
+                    return
+                if frame.shape != ring.shape[1:]:
+                    raise ValueError(
+                        f"Frame {i} has shape {frame.shape}, expected {ring.shape[1:]}."
+                    )
+                ring[slot] = frame
+                ready.put(slot)
+                if i + 1 == self.start_after:
+                    started.set()
+        except Exception as e:
+            ready.put(e)
+        finally:
+            frames.close()
+            ready.put(None)
+            started.set()
+
+
+class DirectoryFrameSource(_PrefetchingFrameSource):
+    """
+    Frames stored as image files in a directory, decoded lazily on a background
+    thread.
+    :param dir_path: Directory containing frames of the animation
+    :param pattern: Glob pattern of the frame files, defaults to "*.bmp"
+    :param prefetch: Number of frames decoded ahead, defaults to 16
+    :param start_after: Number of frames decoded before the first one is yielded,
+        defaults to 4
+    :param fps: Frame rate of the animation, defaults to None (unknown)
+    :raises FileExistsError: If incorrect directory path is given
+    """
+
+    def __init__(
+        self,
+        dir_path: Path | str,
+        pattern: str = "*.bmp",
+        prefetch: int = 16,
+        start_after: int = 4,
+        fps: t.Optional[float] = None,
+    ):
+        super().__init__(prefetch=prefetch, start_after=start_after)
+        self.paths = list_frame_paths(dir_path, pattern)
+        self.fps = fps
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __iter__(self) -> t.Iterator[np.ndarray]:
+        if not self.paths:
+            return iter(())
+        return super().__iter__()
+
+    def _frame_shape(self) -> t.Tuple[int, int]:
+        with Image.open(self.paths[0]) as img:
+            width, height = img.size
+        return height, width
+
+    def _read(self) -> t.Iterator[np.ndarray]:
+        for path in self.paths:
+            with Image.open(path) as img:
+                yield np.asarray(img.convert("L"))  # convert to 8-bit grayscale
+
+
+def downscale(frame: np.ndarray, resolution: t.Tuple[int, int]) -> np.ndarray:
+    """
+    Resizes a grayscale frame by area averaging, which avoids aliasing when
+    shrinking large frames to a few pixels.
+    :param frame: The input frame
+    :param resolution: Number of rows and columns of the result
+    :returns: The resized frame
+    """
+    if frame.shape == tuple(resolution):
+        return frame
+    import cv2
+
+    return cv2.resize(
+        frame,
+        (resolution[1], resolution[0]),
+        interpolation=cv2.INTER_AREA,
+    )
+
+
+class VideoFrameSource(_PrefetchingFrameSource):
+    """
+    Frames of a video file or a camera, decoded, converted to grayscale and
+    downscaled on a background thread.
+    :param source: Path to a video file, or index of a camera
+    :param resolution: Number of rows and columns of the frames, defaults to
+        (16, 16)
+    :param prefetch: Number of frames decoded ahead, defaults to 8
+    :param start_after: Number of frames decoded before the first one is yielded,
+        defaults to 1
+    :param live: Drop the oldest frames when not consumed fast enough, defaults to
+        True for cameras and False for files
+    :raises ValueError: If the video can't be opened
+    """
+
+    def __init__(
+        self,
+        source: Path | str | int,
+        resolution: t.Tuple[int, int] = (16, 16),
+        prefetch: int = 8,
+        start_after: int = 1,
+        live: t.Optional[bool] = None,
+    ):
+        is_camera = isinstance(source, int)
+        super().__init__(
+            prefetch=prefetch,
+            start_after=start_after,
+            live=is_camera if live is None else live,
+        )
+        self.source = source if is_camera else str(source)
+        self.resolution = tuple(resolution)
+
+        import cv2
+
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            raise ValueError(f"Cannot open video `{source}`.")
+        self.fps = capture.get(cv2.CAP_PROP_FPS) or None
+        capture.release()
+
+    def _frame_shape(self) -> t.Tuple[int, int]:
+        return self.resolution
+
+    def _read(self) -> t.Iterator[np.ndarray]:
+        import cv2
+
+        capture = cv2.VideoCapture(self.source)
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                yield downscale(gray, self.resolution)
+        finally:
+            capture.release()
+
+
+class GifFrameSource(_PrefetchingFrameSource):
+    """
+    Frames of an animated GIF, decoded, converted to grayscale and downscaled on a
+    background thread.
+    :param path: Path to the GIF file
+    :param resolution: Number of rows and columns of the frames, defaults to
+        (16, 16)
+    :param prefetch: Number of frames decoded ahead, defaults to 8
+    :param start_after: Number of frames decoded before the first one is yielded,
+        defaults to 1
+    :raises FileExistsError: If the path does not point to a file
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        resolution: t.Tuple[int, int] = (16, 16),
+        prefetch: int = 8,
+        start_after: int = 1,
+    ):
+        super().__init__(prefetch=prefetch, start_after=start_after)
+        self.path = Path(path)
+        if not self.path.exists() or not self.path.is_file():
+            raise FileExistsError(f"File `{self.path}` does not exist.")
+        self.resolution = tuple(resolution)
+
+        with Image.open(self.path) as img:
+            durations = [
+                frame.info.get("duration", 0) for frame in ImageSequence.Iterator(img)
+            ]
+        self._count = len(durations)
+        mean_duration = sum(durations) / max(len(durations), 1)
+        self.fps = 1000 / mean_duration if mean_duration else None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _frame_shape(self) -> t.Tuple[int, int]:
+        return self.resolution
+
+    def _read(self) -> t.Iterator[np.ndarray]:
+        with Image.open(self.path) as img:
+            for frame in ImageSequence.Iterator(img):
+                yield downscale(np.asarray(frame.convert("L")), self.resolution)
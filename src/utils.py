@@ -2,6 +2,7 @@ import json
 from pathlib import Path
 
 CONFIG_PATH = Path(__file__).parent.parent / "config.json"
+FONTS_PATH = Path(__file__).parent.parent / "fonts"
 
 
 def load_config():
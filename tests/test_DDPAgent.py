@@ -0,0 +1,94 @@
+import socket
+import struct
+
+import numpy as np
+
+from src.DDPAgent import _changed_spans, _DDPAgent, _DDPPacketizer
+
+_HEADER = struct.Struct("!BBBBLH")
+
+
+def _headers(packets):
+    return [_HEADER.unpack_from(packet) for packet in packets]
+
+
+def test_changed_spans_merges_close_changes():
+    old = np.zeros(100, dtype=np.uint8)
+    new = old.copy()
+    new[[10, 12, 50]] = 1
+    spans = _changed_spans(old, new, merge_gap=4)
+    assert spans.tolist() == [[10, 13], [50, 51]]
+
+
+def test_changed_spans_aligns_to_pixels():
+    old = np.zeros(30, dtype=np.uint8)
+    new = old.copy()
+    new[[4, 29]] = 1
+    spans = _changed_spans(old, new, merge_gap=0, alignment=3)
+    assert spans.tolist() == [[3, 6], [27, 30]]
+
+
+def test_changed_spans_empty_when_equal():
+    frame = np.arange(10, dtype=np.uint8)
+    assert _changed_spans(frame, frame.copy(), merge_gap=4).shape == (0, 2)
+
+
+def test_pack_spans_splits_long_spans():
+    max_len = _DDPAgent._MAX_DATALEN
+    data = np.arange(3 * max_len, dtype=np.uint8)
+    packets = _DDPPacketizer().pack_spans(data, np.array([[5, max_len + 10]]), 7)
+
+    headers = _headers(packets)
+    assert [(offset, length) for *_, offset, length in headers] == [
+        (5, max_len),
+        (max_len + 5, 5),
+    ]
+    assert [flags & _DDPAgent._PUSH for flags, *_ in headers] == [0, _DDPAgent._PUSH]
+    assert all(sequence == 7 for _, sequence, *_ in headers)
+    payload = packets[1][_DDPAgent._HEADER_LEN:]
+    assert bytes(payload) == bytes(data[max_len + 5:max_len + 10])
+
+
+def test_pack_spans_without_spans_packs_empty_push():
+    data = np.zeros(100, dtype=np.uint8)
+    packets = _DDPPacketizer().pack_spans(data, np.empty((0, 2), dtype=np.intp), 3)
+    assert len(packets) == 1
+    flags, sequence, _, _, offset, length = _headers(packets)[0]
+    assert flags & _DDPAgent._PUSH
+    assert (sequence, offset, length) == (3, 0, 0)
+    assert len(packets[0]) == _DDPAgent._HEADER_LEN
+
+
+def test_partial_updates_send_empty_push_for_unchanged_frame():
+    agent = _DDPAgent("127.0.0.1", (64, 64), partial_updates=True, keepalive=60)
+    frame = np.zeros(64 * 64 * 3, dtype=np.uint8)
+    full = len(agent.packetize(frame))
+    assert full == 9
+
+    frame[100] = 1
+    changed = agent.packetize(frame)
+    assert len(changed) == 1
+
+    unchanged = agent.packetize(frame)
+    assert len(unchanged) == 1
+    assert _headers(unchanged)[0][5] == 0
+
+
+def test_partial_updates_send_full_frame_after_keepalive():
+    agent = _DDPAgent("127.0.0.1", (64, 64), partial_updates=True, keepalive=0)
+    frame = np.zeros(64 * 64 * 3, dtype=np.uint8)
+    agent.packetize(frame)
+    assert len(agent.packetize(frame)) == 9
+
+
+def test_flush_to_closed_port_sends_every_packet():
+    # Bound and closed right away, so the port is most likely unused
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    frame = np.zeros(64 * 64 * 3, dtype=np.uint8)
+    for batched in (False, True):
+        agent = _DDPAgent("127.0.0.1", (64, 64), dest_port=port, batched=batched)
+        assert [agent.flush(frame) for _ in range(3)] == [9, 9, 9]
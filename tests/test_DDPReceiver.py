@@ -0,0 +1,54 @@
+import socket
+
+import numpy as np
+
+from src.DDPAgent import _DDPAgent
+from src.DDPReceiver import DDPReceiver
+
+_RESOLUTION = (64, 64)
+
+
+def _send(receiver, packets):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for packet in packets:
+            sock.sendto(bytes(packet), ("127.0.0.1", receiver.port))
+    receiver.poll(timeout=1.0)
+
+
+def test_full_frames_complete():
+    agent = _DDPAgent("127.0.0.1", _RESOLUTION)
+    with DDPReceiver(_RESOLUTION, port=0) as receiver:
+        for value in (1, 2):
+            frame = np.full((*_RESOLUTION, 3), value, dtype=np.uint8)
+            _send(receiver, agent.packetize(frame))
+        assert receiver.stats["frames"] == 2
+        assert receiver.stats["frames_partial"] == 0
+        assert (receiver.frame == 2).all()
+
+
+def test_push_without_the_rest_of_the_frame_is_partial():
+    agent = _DDPAgent("127.0.0.1", _RESOLUTION)
+    with DDPReceiver(_RESOLUTION, port=0) as receiver:
+        for value in (1, 2):
+            packets = agent.packetize(
+                np.full((*_RESOLUTION, 3), value, dtype=np.uint8)
+            )
+            assert len(packets) == 9
+            _send(receiver, packets[-1:])
+        stats = receiver.stats
+        assert stats["frames"] == 0
+        assert stats["frames_partial"] == 2
+        assert receiver.frame is None
+
+
+def test_partial_updates_complete_with_some_bytes():
+    agent = _DDPAgent("127.0.0.1", _RESOLUTION, partial_updates=True, keepalive=60)
+    frame = np.zeros((*_RESOLUTION, 3), dtype=np.uint8)
+    with DDPReceiver(_RESOLUTION, port=0, partial_updates=True) as receiver:
+        _send(receiver, agent.packetize(frame))
+        frame[0, 0] = 255
+        _send(receiver, agent.packetize(frame))
+        _send(receiver, agent.packetize(frame))
+        assert receiver.stats["frames"] == 3
+        assert receiver.stats["frames_partial"] == 0
+        assert (receiver.frame == frame).all()
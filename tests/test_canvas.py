@@ -0,0 +1,107 @@
+import random
+
+import numpy as np
+import pytest
+
+from src.drawing.canvas import Canvas
+from src.drawing.common import blend, insert
+from src.drawing.text import Text
+
+_MODES = ["replace", "max", "add", "alpha", "xor"]
+
+
+def _full_redraw(canvas):
+    """
+    Composites the canvas from scratch, without any of its caching.
+    """
+    frame = np.zeros((canvas.height, canvas.width), dtype=np.uint8)
+    for layer in sorted(canvas.layers, key=lambda layer: layer.z):
+        pixels = np.zeros_like(frame)
+        coverage = np.zeros(frame.shape, dtype=bool)
+        for obj in layer.objects:
+            obj.draw(canvas=pixels)
+            x0, y0, x1, y1 = obj.get_bounds()
+            coverage[max(y0, 0):max(y1, 0), max(x0, 0):max(x1, 0)] = True
+        blended = frame.copy()
+        blend(blended, pixels, layer.blend_mode, layer.alpha)
+        np.copyto(frame, blended, where=coverage)
+    return frame
+
+
+def _text(rng):
+    return Text(
+        text=rng.choice(["A", "HI", "42", "XY"]),
+        font="5x5",
+        x=rng.randrange(-6, 24),
+        y=rng.randrange(-6, 20),
+        blend_mode=rng.choice(_MODES),
+    )
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_incremental_render_matches_full_redraw(seed):
+    rng = random.Random(seed)
+    canvas = Canvas(width=24, height=16, objects=[_text(rng) for _ in range(4)])
+    layers = [canvas.layers[0]]
+    for _ in range(3):
+        layers.append(
+            canvas.add_layer(
+                objects=[_text(rng) for _ in range(rng.randrange(4))],
+                z=rng.randrange(-2, 3),
+                blend_mode=rng.choice(_MODES),
+                alpha=rng.random(),
+                static=rng.random() < 0.3,
+            )
+        )
+
+    for _ in range(60):
+        layer = rng.choice(layers)
+        action = rng.random()
+        if action < 0.5 and layer.objects:
+            obj = rng.choice(layer.objects)
+            obj.x += rng.randrange(-3, 4)
+            obj.y += rng.randrange(-2, 3)
+        elif action < 0.6:
+            layer.add(_text(rng))
+        elif action < 0.7 and layer.objects:
+            layer.remove(rng.choice(layer.objects))
+        elif action < 0.75:
+            rng.shuffle(layer.objects)
+        elif action < 0.8:
+            layer.z = rng.randrange(-2, 3)
+        else:
+            # Many objects changing at once
+            for obj in layer.objects:
+                obj.x += 1
+        if layer.static:
+            layer.invalidate()
+
+        canvas.update()
+        assert np.array_equal(canvas.render(), _full_redraw(canvas))
+
+
+def test_default_layers_keep_the_pixels_below():
+    canvas = Canvas(width=16, height=16, objects=[Text("A", "5x5", x=0, y=0)])
+    background = np.full((16, 16), 40, dtype=np.uint8)
+    canvas.add_layer(objects=[_Image(background)], z=-1, static=True)
+    canvas.add_layer(objects=[Text("B", "5x5", x=8, y=8)], z=1)
+
+    frame = canvas.render()
+    assert frame[:5, :5].max() == 255
+    assert frame[8:13, 8:13].max() == 255
+    assert frame[14, 2] == 40
+
+
+class _Image(Text):
+    """
+    A fixed image covering its whole bounds.
+    """
+
+    def __init__(self, image):
+        self.x = 0
+        self.y = 0
+        self.blend_mode = "replace"
+        self.text_array = image
+
+    def draw(self, canvas):
+        insert(canvas, self.text_array, self.x, self.y)
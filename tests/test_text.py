@@ -0,0 +1,45 @@
+import random
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from src.drawing.text import _ATLAS_CHARACTERS, FONTS
+
+
+def _render_with_pil(renderer, text):
+    """
+    Renders a line by drawing all of it with PIL at once, as before the glyph
+    atlas. Lines without visible pixels, which used to fail, render as an empty
+    line.
+    """
+    text = text.upper()
+    x0, y0, x1, y1 = renderer.pillow_font.getbbox(text)
+    img = Image.new(mode="1", size=(x1 - x0, (y1 - y0) * 2), color=0)
+    draw = ImageDraw.Draw(img)
+    draw.fontmode = "1"
+    draw.text(xy=(0, 0), text=text, fill=255, font=renderer.pillow_font, spacing=1)
+    array = np.array(img) * np.uint8(255)
+    if not array.any():
+        return np.zeros(shape=(renderer.font_pixel_height, 1))
+
+    rows, cols = np.nonzero(array)
+    trimmed = array[rows.min():rows.max() + 1, cols.min():cols.max() + 1]
+    height = renderer.font_pixel_height
+    width = int(height / trimmed.shape[0] * trimmed.shape[1])
+    return cv2.resize(trimmed, (width, height), interpolation=cv2.INTER_AREA)
+
+
+@pytest.mark.parametrize("font", list(FONTS))
+def test_glyph_atlas_matches_pil_line_rendering(font):
+    renderer = FONTS[font]
+    rng = random.Random(font)
+    characters = _ATLAS_CHARACTERS + "abcxyz"
+    texts = [characters[i:i + 12] for i in range(0, len(characters), 12)]
+    texts += [
+        "".join(rng.choices(characters, k=rng.randrange(1, 20))) for _ in range(200)
+    ]
+    for text in texts:
+        expected = _render_with_pil(renderer, text)
+        assert np.array_equal(renderer.render_one_line(text), expected), text